@@ -2,6 +2,8 @@
 ASGI config for elearn project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Requests to /api/async/ are served by the async read-only API, others by Django.
+Run with: uvicorn elearn.asgi:application --workers <N>
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
@@ -13,4 +15,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'elearn.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from elearn_app.async_api import AsyncReadAPI  # noqa: E402  (needs configured Django)
+
+async_read_api = AsyncReadAPI()
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "http" and scope["path"].startswith(AsyncReadAPI.prefix):
+        await async_read_api(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -43,14 +43,23 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'elearn_app.replicas.ReplicaPinMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'elearn_app.metrics.RequestMetricsMiddleware',
 ]
 
+# Request metrics (per process), exposed at /metrics/ in Prometheus text format to requests with
+# "Authorization: Bearer <METRICS_TOKEN>" (e.g. Prometheus' "authorization" scrape option); None - disabled.
+METRICS_SAMPLE_RATE = 1.0
+METRICS_SLOW_REQUEST_SECONDS = 1.0
+METRICS_SLOW_REQUEST_TOP_SQL = 5
+METRICS_TOKEN = None
+
 AUTH_USER_MODEL = "elearn_app.User"
 ROOT_URLCONF = 'elearn.urls'
 
@@ -72,6 +81,26 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'elearn.wsgi.application'
 
+# Threads running ORM calls of the async API (elearn/asgi.py), i.e. its max concurrent database connections.
+ASYNC_DB_WORKERS = 8
+
+# New comments are pushed to the async API's streams of all processes through this broker
+# (PostgreSQL LISTEN/NOTIFY; 'elearn_app.broker.InProcessBroker' for a single process, e.g. in tests).
+# Clients reconnecting (to any process) get missed comments with the "since" cursor.
+COMMENTS_BROKER = 'elearn_app.broker.PostgresBroker'
+COMMENTS_STREAM_HEARTBEAT = 15
+
+# Background jobs (elearn_app.jobs) are queued in the database and run by "manage.py run_jobs" workers.
+# Failed attempts are retried after JOBS_RETRY_BACKOFF * 2^(attempt - 1) seconds (up to JOBS_RETRY_BACKOFF_MAX);
+# a job not finished within JOBS_LEASE seconds is considered abandoned by its worker and run again.
+JOBS_MAX_ATTEMPTS = 5
+JOBS_RETRY_BACKOFF = 10
+JOBS_RETRY_BACKOFF_MAX = 60 * 60
+JOBS_LEASE = 5 * 60
+
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+DEFAULT_FROM_EMAIL = 'elearn@localhost'
+
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
@@ -82,15 +111,53 @@ DATABASES = {
     # GRANT ALL PRIVILEGES ON DATABASE elearn TO django_user;
 
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        # PostgreSQL with a connection pool per process (elearn_app.pooling): connections are returned to
+        # the pool at the end of requests (CONN_MAX_AGE = 0) instead of being closed. Size the pool for the
+        # threads of a process (e.g. ASYNC_DB_WORKERS, run_jobs --workers) with the elearn_db_pool_* metrics.
+        'ENGINE': 'elearn_app.backends.postgresql',
         'NAME': 'elearn',
         'USER': 'django_user',
         'PASSWORD': '12345678',
         'HOST': 'localhost',
         'PORT': '',
-    }
+        'POOL': {'MAX_SIZE': 10, 'MAX_LIFETIME': 30 * 60, 'TIMEOUT': 10},
+    },
+    # Read replicas (streaming replication of default), listed in DATABASE_REPLICAS, e.g.:
+    # 'replica': {..., 'HOST': 'replica-host', 'TEST': {'MIRROR': 'default'}},
+}
+
+# Reads of GET requests go to healthy DATABASE_REPLICAS (lag checked every DATABASE_REPLICA_CHECK_INTERVAL
+# seconds, at most DATABASE_REPLICA_MAX_LAG seconds behind), writes and reads after them to default.
+# Clients and users that wrote read from default for DATABASE_PRIMARY_PIN_SECONDS (cookie, and a pin of the user
+# in the DATABASE_PRIMARY_PIN_CACHE_ALIAS cache, to be shared by the workers), longer than the usual lag.
+# With replicas, point it to a shared cache: local memory only pins the user in the worker that wrote
+# (warned by the system checks, e.g. "manage.py check").
+DATABASE_ROUTERS = ['elearn_app.replicas.ReplicaRouter']
+DATABASE_REPLICAS = []
+DATABASE_REPLICA_MAX_LAG = 5
+DATABASE_REPLICA_CHECK_INTERVAL = 5
+DATABASE_PRIMARY_PIN_SECONDS = 10
+DATABASE_PRIMARY_PIN_CACHE_ALIAS = 'default'
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Responses of course, lecture and homework list/retrieve. Local memory is per process,
+    # so with several workers use a shared backend, e.g.:
+    # 'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache', 'LOCATION': '127.0.0.1:11211',
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'responses',
+    },
 }
 
+RESPONSE_CACHE_ALIAS = 'responses'
+RESPONSE_CACHE_TIMEOUT = 5 * 60
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -109,16 +176,65 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+PASSWORD_HASHERS = [
+    'elearn_app.hashers.TunedArgon2PasswordHasher',
+    # Old hashes are still verified and rehashed with the first hasher on login.
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
+
+# memory_cost is in KiB. Measure with "manage.py benchmark_password_hashers" before changing.
+ARGON2_PARAMETERS = {
+    'time_cost': 2,
+    'memory_cost': 19 * 1024,
+    'parallelism': 1,
+}
+
+# Login password hashing runs in a bounded thread pool (argon2 releases the GIL); database queries stay in
+# the request thread, which still waits for the hash. Logins over workers + queue size are rejected with 429
+# and Retry-After. 0 workers - hash passwords in the request thread. The bounds are per process: they limit
+# the hashing CPU and memory of threaded servers (e.g. gunicorn --threads, ASGI) only; sync workers serve
+# one request per process and are never over them.
+AUTHENTICATION_BACKENDS = ['elearn_app.authentication.HashingPoolModelBackend']
+LOGIN_HASHING_WORKERS = 4
+LOGIN_HASHING_QUEUE_SIZE = 16
+
+# Signed tokens issued by /api/login/ (lifetimes in seconds). Revoked tokens are denylisted in the database
+# (elearn_app.RevokedToken) until they expire; expired entries are purged by "manage.py run_jobs".
+# Access tokens are checked against a copy of the denylist per process, reloaded every
+# REVOKED_TOKENS_RELOAD_INTERVAL seconds: a token revoked through another process works up to that long.
+TOKENS_SIGNING_KEY = SECRET_KEY
+ACCESS_TOKEN_LIFETIME = 5 * 60
+REFRESH_TOKEN_LIFETIME = 24 * 60 * 60
+REVOKED_TOKENS_RELOAD_INTERVAL = 5
+# Keeps "Authorization: Token <key>" (authtoken table) working while clients migrate.
+LEGACY_TOKEN_AUTHENTICATION = True
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'elearn_app.authentication.JWTAuthentication',
+        *(['rest_framework.authentication.TokenAuthentication'] if LEGACY_TOKEN_AUTHENTICATION else []),
         # 'rest_framework.authentication.BasicAuthentication',
         # 'rest_framework.authentication.SessionAuthentication'
     ),
     # 'DEFAULT_PERMISSION_CLASSES': (
     #     'rest_framework.permissions.IsAuthenticated',)
+    'DEFAULT_PAGINATION_CLASS': 'elearn_app.pagination.IdCursorPagination',
+    'PAGE_SIZE': 50,
+}
+
+# Max "page_size" query param value. Can be overridden per endpoint by router's basename.
+PAGINATION_MAX_PAGE_SIZE = 200
+PAGINATION_MAX_PAGE_SIZES = {
+    'homework-instance': 500,
+    'homework-instance-mark': 500,
 }
 
+# Users' roles (groups) are resolved once per request. Set a timeout (in seconds) to share them
+# between requests through the cache below; they are invalidated when user's groups change.
+ROLES_CACHE_TIMEOUT = None
+ROLES_CACHE_ALIAS = 'default'
+
 
 SWAGGER_SETTINGS = {
     'SECURITY_DEFINITIONS': {
@@ -149,3 +265,15 @@ USE_TZ = True
 STATIC_URL = '/static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Uploaded files are deduplicated by content (see elearn_app.storage).
+DEFAULT_FILE_STORAGE = 'elearn_app.storage.ContentAddressedStorage'
+
+# Files downloads: None - stream by FILES_CHUNK_SIZE chunks from the app,
+# 'x-accel-redirect' (nginx, internal location at FILES_ACCEL_REDIRECT_PREFIX aliased to MEDIA_ROOT) or 'x-sendfile'.
+FILES_SENDFILE_BACKEND = None
+FILES_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+FILES_CHUNK_SIZE = 64 * 1024
+
+# Chunked uploads. Part files should be on the same filesystem as MEDIA_ROOT to be moved, not copied.
+UPLOAD_SESSIONS_DIR = os.path.join(MEDIA_ROOT, 'uploads_tmp')
+UPLOAD_SESSION_LIFETIME = 24 * 60 * 60
@@ -16,12 +16,12 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
-
-from django.conf import settings
-from django.conf.urls.static import static
+from elearn_app.metrics import metrics_view
 
 
+# Media files are served only through access-checked "download" endpoints of the API.
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('elearn_app.urls')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path('metrics/', metrics_view, name='metrics'),
+]
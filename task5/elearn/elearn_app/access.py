@@ -0,0 +1,150 @@
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+
+from .models import (
+    Course, CourseAccess, Lecture, Homework, HomeworkInstance, HomeworkInstanceComment, HomeworkInstanceMark
+)
+from .roles import SUPERUSERS, TEACHERS, STUDENTS, has_role
+
+MEMBERS_ROLES = (TEACHERS, STUDENTS)
+
+
+def courses_ids(user, role):
+    """
+    Subquery of ids of the courses the user is a member of with the role.
+    Filter with "course_id__in=courses_ids(user, role)" to get a single semi-join on the access index.
+    """
+    return CourseAccess.objects.filter(user_id=user.pk, role=role).values("course_id")
+
+
+def visible_courses(user):
+    if has_role(user, SUPERUSERS):
+        return Course.objects.all()
+    elif has_role(user, TEACHERS):
+        return Course.objects.filter(id__in=courses_ids(user, TEACHERS))
+    elif has_role(user, STUDENTS):
+        return Course.objects.filter(id__in=courses_ids(user, STUDENTS))
+    return Course.objects.none()
+
+
+def visible_lectures(user):
+    if has_role(user, SUPERUSERS):
+        return Lecture.objects.all()
+    elif has_role(user, TEACHERS):
+        return Lecture.objects.filter(course_id__in=courses_ids(user, TEACHERS))
+    elif has_role(user, STUDENTS):
+        return Lecture.objects.filter(course_id__in=courses_ids(user, STUDENTS))
+    return Lecture.objects.none()
+
+
+def visible_homeworks(user):
+    if has_role(user, SUPERUSERS):
+        return Homework.objects.all()
+    elif has_role(user, TEACHERS):
+        return Homework.objects.filter(course_id__in=courses_ids(user, TEACHERS))
+    elif has_role(user, STUDENTS):
+        return Homework.objects.filter(course_id__in=courses_ids(user, STUDENTS))
+    return Homework.objects.none()
+
+
+def visible_homework_instances(user):
+    if has_role(user, SUPERUSERS):
+        return HomeworkInstance.objects.all()
+    elif has_role(user, TEACHERS):
+        return HomeworkInstance.objects.filter(course_id__in=courses_ids(user, TEACHERS))
+    elif has_role(user, STUDENTS):
+        return HomeworkInstance.objects.filter(course_id__in=courses_ids(user, STUDENTS))
+    return HomeworkInstance.objects.none()
+
+
+def visible_comments(user):
+    if has_role(user, SUPERUSERS):
+        return HomeworkInstanceComment.objects.all()
+    elif has_role(user, TEACHERS):
+        return HomeworkInstanceComment.objects.filter(homework_instance__course_id__in=courses_ids(user, TEACHERS))
+    elif has_role(user, STUDENTS):
+        return HomeworkInstanceComment.objects.filter(homework_instance__student_id=user.pk)
+    return HomeworkInstanceComment.objects.none()
+
+
+def commented_homework_instances(user):
+    """Homework instances whose comments the user can see, matching visible_comments()."""
+    if has_role(user, SUPERUSERS):
+        return HomeworkInstance.objects.all()
+    elif has_role(user, TEACHERS):
+        return HomeworkInstance.objects.filter(course_id__in=courses_ids(user, TEACHERS))
+    elif has_role(user, STUDENTS):
+        return HomeworkInstance.objects.filter(student_id=user.pk)
+    return HomeworkInstance.objects.none()
+
+
+def visible_marks(user):
+    if has_role(user, SUPERUSERS):
+        return HomeworkInstanceMark.objects.all()
+    elif has_role(user, TEACHERS):
+        return HomeworkInstanceMark.objects.filter(homework_instance__course_id__in=courses_ids(user, TEACHERS))
+    elif has_role(user, STUDENTS):
+        return HomeworkInstanceMark.objects.filter(homework_instance__student_id=user.pk)
+    return HomeworkInstanceMark.objects.none()
+
+
+def add_access(role, course_ids, user_ids):
+    CourseAccess.objects.bulk_create(
+        [CourseAccess(user_id=user_id, role=role, course_id=course_id) for course_id in course_ids for user_id in user_ids],
+        ignore_conflicts=True,
+    )
+
+
+def remove_access(role, course_ids=None, user_ids=None):
+    queryset = CourseAccess.objects.filter(role=role)
+    if course_ids is not None:
+        queryset = queryset.filter(course_id__in=course_ids)
+    if user_ids is not None:
+        queryset = queryset.filter(user_id__in=user_ids)
+    queryset.delete()
+
+
+def _members_pairs(role):
+    return getattr(Course, role).through.objects.values_list("user_id", "course_id")
+
+
+def _access_pairs(role):
+    return CourseAccess.objects.filter(role=role).values_list("user_id", "course_id")
+
+
+def rebuild_access_index(batch_size=1000):
+    with transaction.atomic():
+        Homework.objects.exclude(course_id=F("lecture__course_id")).update(course_id=Subquery(
+            Lecture.objects.filter(id=OuterRef("lecture_id")).values("course_id")
+        ))
+        HomeworkInstance.objects.exclude(course_id=F("homework__course_id")).update(course_id=Subquery(
+            Homework.objects.filter(id=OuterRef("homework_id")).values("course_id")
+        ))
+
+        CourseAccess.objects.all().delete()
+        for role in MEMBERS_ROLES:
+            CourseAccess.objects.bulk_create(
+                (CourseAccess(user_id=user_id, role=role, course_id=course_id)
+                 for user_id, course_id in _members_pairs(role).iterator()),
+                batch_size=batch_size,
+            )
+
+
+def verify_access_index():
+    """Returns a dict of found inconsistencies counts. Empty dict means the index is consistent."""
+    problems = {}
+    for role in MEMBERS_ROLES:
+        missing = set(_members_pairs(role)) - set(_access_pairs(role))
+        extra = set(_access_pairs(role)) - set(_members_pairs(role))
+        if missing:
+            problems[f"missing {role}"] = len(missing)
+        if extra:
+            problems[f"extra {role}"] = len(extra)
+
+    wrong_homeworks = Homework.objects.exclude(course_id=F("lecture__course_id")).count()
+    if wrong_homeworks:
+        problems["homeworks with wrong course"] = wrong_homeworks
+    wrong_instances = HomeworkInstance.objects.exclude(course_id=F("homework__course_id")).count()
+    if wrong_instances:
+        problems["homework instances with wrong course"] = wrong_instances
+    return problems
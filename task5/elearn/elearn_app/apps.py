@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ElearnAppConfig(AppConfig):
     name = 'elearn_app'
+
+    def ready(self):
+        from . import checks, signals  # noqa: F401
+        from .search import create_sqlite_triggers
+
+        post_migrate.connect(create_sqlite_triggers, sender=self)
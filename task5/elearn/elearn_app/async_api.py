@@ -0,0 +1,212 @@
+import asyncio
+import io
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.utils.encoders import JSONEncoder
+
+from .access import (
+    visible_courses, visible_lectures, visible_homeworks, visible_comments, commented_homework_instances,
+)
+from .authentication import ACCESS, decode_token, user_from_payload
+from .broker import get_broker, homework_instance_channel
+from .roles import SUPERUSERS, TEACHERS, STUDENTS, get_user_roles
+from .serializers import CourseSerializer, LectureSerializer, HomeworkSerializer, HomeworkInstanceCommentSerializer
+
+_db_executor = ThreadPoolExecutor(max_workers=settings.ASYNC_DB_WORKERS, thread_name_prefix="async-db")
+
+
+def _run_closing_connections(func, *args):
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+async def run_db(func, *args):
+    """Runs blocking (ORM) code in the bounded database thread pool, so the event loop is never blocked."""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(_db_executor, partial(_run_closing_connections, func, *args))
+
+
+async def get_user_roles_async(user):
+    roles = getattr(user, "_roles", None)  # memoized, e.g. from the access token claims
+    if roles is None:
+        roles = await run_db(get_user_roles, user)
+    return roles
+
+
+async def authenticate(scope):
+    """Returns the user of the request or None."""
+    headers = dict(scope["headers"])
+    auth = headers.get(b"authorization", b"").split()
+    if len(auth) != 2:
+        return None
+
+    keyword, credentials = auth[0].lower(), auth[1].decode()
+    if keyword == b"bearer":
+        return user_from_payload(await run_db(decode_token, credentials, ACCESS))  # may reload the denylist
+    elif keyword == b"token" and settings.LEGACY_TOKEN_AUTHENTICATION:
+        user, _ = await run_db(TokenAuthentication().authenticate_credentials, credentials)
+        return user
+    return None
+
+
+def _get_max_page_size(basename):
+    return settings.PAGINATION_MAX_PAGE_SIZES.get(basename, settings.PAGINATION_MAX_PAGE_SIZE)
+
+
+class AsyncReadAPI:
+    """
+    ASGI application with read-only list endpoints: GET {prefix}<resource>/?after=<id>&page_size=<n>.
+    Visibility rules and serializers are the ones of the REST API; pages are keyset-paginated by id.
+
+    GET {prefix}homework_instance/<id>/comments/stream/?since=<comment id> streams the comments of a homework
+    instance as server-sent events: first the ones after "since" (or the Last-Event-ID header), then new ones.
+    """
+    prefix = "/api/async/"
+    comments_stream_path = re.compile(r"^homework_instance/(?P<id>\d+)/comments/stream$")
+
+    # resource: (router basename, visible queryset, serializer)
+    resources = {
+        "course": ("course", visible_courses, CourseSerializer),
+        "lecture": ("lecture", visible_lectures, LectureSerializer),
+        "homework": ("homework", visible_homeworks, HomeworkSerializer),
+        "homework_instance_comment": ("homework-instance-comment", visible_comments, HomeworkInstanceCommentSerializer),
+    }
+
+    def _list_page(self, resource, request, user, after, page_size):
+        basename, get_queryset, serializer_class = self.resources[resource]
+        queryset = get_queryset(user)
+        if hasattr(serializer_class, "setup_eager_loading"):
+            queryset = serializer_class.setup_eager_loading(queryset, request)
+        if after is not None:
+            queryset = queryset.filter(id__gt=after)
+
+        page = list(queryset.order_by("id")[:page_size + 1])
+        has_next = len(page) > page_size
+        page = page[:page_size]
+        return {
+            "next": f"?after={page[-1].id}&page_size={page_size}" if has_next else None,
+            "results": serializer_class(page, many=True, context={"request": request}).data,
+        }
+
+    def _comments_since(self, user, homework_instance_id, since):
+        if not commented_homework_instances(user).filter(id=homework_instance_id).exists():
+            return None
+        comments = visible_comments(user).filter(homework_instance_id=homework_instance_id, id__gt=since)
+        return HomeworkInstanceCommentSerializer(comments.order_by("id"), many=True).data
+
+    async def __call__(self, scope, receive, send):
+        path = scope["path"][len(self.prefix):].strip("/")
+        stream = self.comments_stream_path.match(path)
+        if path not in self.resources and stream is None:
+            return await self._send_json(send, 404, {"detail": "Not found."})
+        if scope["method"] != "GET":
+            return await self._send_json(send, 405, {"detail": f"Method \"{scope['method']}\" not allowed."})
+
+        try:
+            user = await authenticate(scope)
+            if user is None:
+                return await self._send_json(send, 401, {"detail": "Authentication credentials were not provided."})
+            if not await get_user_roles_async(user) & {SUPERUSERS, TEACHERS, STUDENTS}:
+                return await self._send_json(send, 403, {"detail": "You do not have permission to perform this action."})
+        except APIException as error:
+            return await self._send_json(send, error.status_code, {"detail": str(error.detail)})
+
+        query = parse_qs(scope["query_string"].decode())
+        if stream is not None:
+            return await self._stream_comments(scope, receive, send, user, int(stream["id"]), query)
+
+        try:
+            after = int(query["after"][0]) if "after" in query else None
+            page_size = int(query.get("page_size", [settings.REST_FRAMEWORK["PAGE_SIZE"]])[0])
+        except ValueError:
+            return await self._send_json(send, 400, {"detail": "Invalid \"after\" or \"page_size\"."})
+
+        page_size = max(1, min(page_size, _get_max_page_size(self.resources[path][0])))
+        # As the REST API's serializers see it: ?fields=/?expand= and absolute file URLs.
+        request = Request(ASGIRequest(scope, io.BytesIO()))
+        data = await run_db(self._list_page, path, request, user, after, page_size)
+        await self._send_json(send, 200, data)
+
+    async def _stream_comments(self, scope, receive, send, user, homework_instance_id, query):
+        try:
+            last_event_id = dict(scope["headers"]).get(b"last-event-id", b"").decode()
+            since = int(query["since"][0] if "since" in query else last_event_id or 0)
+        except ValueError:
+            return await self._send_json(send, 400, {"detail": "Invalid \"since\"."})
+
+        # Subscribes before reading the backlog, so no comment is lost in between; duplicates are skipped by id.
+        broker, channel = get_broker(), homework_instance_channel(homework_instance_id)
+        loop, queue = asyncio.get_event_loop(), asyncio.Queue()
+        broker.subscribe(channel, loop, queue)
+        disconnected = asyncio.ensure_future(self._wait_disconnect(receive))
+        try:
+            backlog = await run_db(self._comments_since, user, homework_instance_id, since)
+            if backlog is None:
+                return await self._send_json(send, 404, {"detail": "Not found."})
+
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no"),
+                ],
+            })
+            for comment in backlog:
+                since = await self._send_comment(send, comment)
+
+            while not disconnected.done():
+                received = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait(
+                    {received, disconnected}, timeout=settings.COMMENTS_STREAM_HEARTBEAT,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if received in done:
+                    comment = received.result()
+                    if comment["id"] <= since:
+                        continue
+                    if len(comment) == 1:  # reduced to its id by the broker
+                        for comment in await run_db(self._comments_since, user, homework_instance_id, since) or []:
+                            since = await self._send_comment(send, comment)
+                    else:
+                        since = await self._send_comment(send, comment)
+                else:
+                    received.cancel()
+                    if not disconnected.done():
+                        await send({"type": "http.response.body", "body": b": heartbeat\n\n", "more_body": True})
+        finally:
+            broker.unsubscribe(channel, loop, queue)
+            disconnected.cancel()
+
+    async def _send_comment(self, send, comment):
+        data = json.dumps(comment, cls=JSONEncoder)
+        body = f"id: {comment['id']}\nevent: comment\ndata: {data}\n\n".encode()
+        await send({"type": "http.response.body", "body": body, "more_body": True})
+        return comment["id"]
+
+    @staticmethod
+    async def _wait_disconnect(receive):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    async def _send_json(self, send, status, data):
+        body = json.dumps(data, cls=JSONEncoder).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,211 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import jwt
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import check_password, make_password
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, TokenAuthentication, get_authorization_header
+
+from .models import User, RevokedToken
+from .roles import get_user_roles
+
+ACCESS = "access"
+REFRESH = "refresh"
+
+_ALGORITHM = "HS256"
+
+
+_hashing_executor = (
+    ThreadPoolExecutor(max_workers=settings.LOGIN_HASHING_WORKERS, thread_name_prefix="login-hashing")
+    if settings.LOGIN_HASHING_WORKERS else None
+)
+_hashing_slots = threading.BoundedSemaphore(settings.LOGIN_HASHING_WORKERS + settings.LOGIN_HASHING_QUEUE_SIZE)
+
+
+def run_in_hashing_pool(func, *args):
+    """
+    Runs func (hashing a password, without database queries) in the bounded login hashing pool and waits
+    for its result: the calling thread is busy for the whole hash, the pool bounds concurrent hashes of
+    the process (not of all the workers). With LOGIN_HASHING_WORKERS = 0 it's run in the calling thread,
+    the queue size is still a limit.
+    """
+    if not _hashing_slots.acquire(blocking=False):
+        raise exceptions.Throttled(wait=1, detail="Too many logins at once.")
+    try:
+        if _hashing_executor is None:
+            return func(*args)
+        return _hashing_executor.submit(func, *args).result()
+    finally:
+        _hashing_slots.release()
+
+
+def check_user_password(user, password):
+    """
+    User.check_password() with the hashing in the pool. Hashes of old hashers or parameters are
+    upgraded, the user being saved in the calling thread.
+    """
+    must_update = []
+    if not run_in_hashing_pool(check_password, password, user.password, must_update.append):
+        return False
+    if must_update:
+        user.password = run_in_hashing_pool(make_password, password)
+        user.save(update_fields=["password"])
+    return True
+
+
+class HashingPoolModelBackend(ModelBackend):
+    """ModelBackend checking passwords with check_user_password(), i.e. hashing in the bounded pool."""
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = User._default_manager.get_by_natural_key(username)
+        except User.DoesNotExist:
+            run_in_hashing_pool(make_password, password)  # as long as for existing users (timing attacks)
+            return None
+        if check_user_password(user, password) and self.user_can_authenticate(user):
+            return user
+        return None
+
+
+def _encode(user, token_type, lifetime, roles):
+    now = int(time.time())
+    token = jwt.encode({
+        "type": token_type,
+        "jti": uuid.uuid4().hex,
+        "iat": now,
+        "exp": now + lifetime,
+        "sub": user.pk,
+        "email": user.email,
+        "roles": roles,
+    }, settings.TOKENS_SIGNING_KEY, algorithm=_ALGORITHM)
+    return token if isinstance(token, str) else token.decode()
+
+
+def issue_tokens(user):
+    """Returns signed access and refresh tokens carrying the user's id, email and roles."""
+    roles = sorted(get_user_roles(user))
+    return {
+        ACCESS: _encode(user, ACCESS, settings.ACCESS_TOKEN_LIFETIME, roles),
+        REFRESH: _encode(user, REFRESH, settings.REFRESH_TOKEN_LIFETIME, roles),
+    }
+
+
+class RevokedAccessTokens:
+    """
+    Copy of the denylisted access tokens of the process (RevokedToken stays the source of truth),
+    reloaded every settings.REVOKED_TOKENS_RELOAD_INTERVAL seconds, so checks of access tokens need no query.
+    Tokens revoked by this process are added at once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jtis = frozenset()
+        self._loaded_on = None
+
+    def _is_stale(self):
+        return self._loaded_on is None or time.monotonic() - self._loaded_on >= settings.REVOKED_TOKENS_RELOAD_INTERVAL
+
+    def __contains__(self, jti):
+        if self._is_stale():
+            with self._lock:
+                if self._is_stale():
+                    self._jtis = frozenset(
+                        RevokedToken.objects.filter(token_type=ACCESS, expires_on__gt=datetime.now(tz=timezone.utc))
+                        .values_list("jti", flat=True)
+                    )
+                    self._loaded_on = time.monotonic()
+        return jti in self._jtis
+
+    def add(self, jti):
+        with self._lock:
+            self._jtis |= {jti}
+
+
+_revoked_access_tokens = RevokedAccessTokens()
+
+
+def decode_token(token, token_type):
+    try:
+        payload = jwt.decode(token, settings.TOKENS_SIGNING_KEY, algorithms=[_ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise exceptions.AuthenticationFailed("Token has expired.")
+    except jwt.InvalidTokenError:
+        raise exceptions.AuthenticationFailed("Invalid token.")
+
+    if payload.get("type") != token_type:
+        raise exceptions.AuthenticationFailed("Invalid token type.")
+    if token_type == ACCESS:
+        revoked = payload["jti"] in _revoked_access_tokens
+    else:  # rare, and rotated refresh tokens must be rejected at once
+        revoked = RevokedToken.objects.filter(jti=payload["jti"]).exists()
+    if revoked:
+        raise exceptions.AuthenticationFailed("Token has been revoked.")
+    return payload
+
+
+def user_from_payload(payload):
+    """Builds the user (with memoized roles) from access token's claims without a database query."""
+    user = User(id=payload["sub"], email=payload["email"])
+    user._state.adding = False
+    user._state.db = DEFAULT_DB_ALIAS
+    user._roles = frozenset(payload["roles"])
+    return user
+
+
+def revoke_token(payload):
+    """
+    Denylists the token until it expires. Returns False if it was already revoked, so of concurrent
+    revocations of the same token (e.g. refresh rotations) only one succeeds.
+    """
+    try:
+        with transaction.atomic():
+            RevokedToken.objects.create(
+                jti=payload["jti"], token_type=payload["type"],
+                expires_on=datetime.fromtimestamp(payload["exp"], tz=timezone.utc),
+            )
+    except IntegrityError:
+        return False
+    if payload["type"] == ACCESS:
+        _revoked_access_tokens.add(payload["jti"])
+    return True
+
+
+def purge_revoked_tokens():
+    """Deletes denylist entries of expired tokens, which are rejected anyway."""
+    return RevokedToken.objects.filter(expires_on__lt=datetime.now(tz=timezone.utc)).delete()[0]
+
+
+class JWTAuthentication(BaseAuthentication):
+    """
+    "Authorization: Bearer <access token>". The user is built from the token claims,
+    so neither identity, roles nor the denylist (see RevokedAccessTokens) need database queries.
+    """
+    keyword = "Bearer"
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed("Invalid Authorization header.")
+
+        payload = decode_token(auth[1].decode(), ACCESS)
+        return user_from_payload(payload), payload
+
+    def authenticate_header(self, request):
+        return f'{self.keyword} realm="api"'
+
+
+AUTHENTICATION_CLASSES = [JWTAuthentication]
+if settings.LEGACY_TOKEN_AUTHENTICATION:
+    AUTHENTICATION_CLASSES.append(TokenAuthentication)
@@ -0,0 +1,13 @@
+from django.db.backends.postgresql import base, creation
+
+from elearn_app.pooling import PooledDatabaseCreationMixin, PooledDatabaseWrapperMixin, discard_all
+
+
+class DatabaseCreation(PooledDatabaseCreationMixin, creation.DatabaseCreation):
+    pass
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    """PostgreSQL (psycopg2) with pooled connections, see elearn_app.pooling."""
+    creation_class = DatabaseCreation
+    pool_reset = staticmethod(discard_all)
@@ -0,0 +1,140 @@
+import json
+import logging
+import os
+import select
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from rest_framework.utils.encoders import JSONEncoder
+
+logger = logging.getLogger(__name__)
+
+# PostgreSQL limits notification payloads to 8000 bytes.
+_MAX_PAYLOAD_SIZE = 7999
+
+
+class InProcessBroker:
+    """
+    Publishes messages to asyncio queues subscribed in the same process. publish() is thread-safe,
+    so it can be called from sync code (signals) while subscribers live in the event loop.
+    """
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel, loop, queue):
+        with self._lock:
+            self._subscribers[channel].add((loop, queue))
+
+    def unsubscribe(self, channel, loop, queue):
+        with self._lock:
+            self._subscribers[channel].discard((loop, queue))
+            if not self._subscribers[channel]:
+                del self._subscribers[channel]
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, message)
+
+
+class PostgresBroker(InProcessBroker):
+    """
+    Cross-process broker on PostgreSQL LISTEN/NOTIFY: publish() notifies the channel through the database,
+    and a listener thread of each process with subscribers delivers the notifications to its queues.
+    Messages are dicts with an "id"; ones too big for a notification are reduced to {"id"},
+    which subscribers read from the database.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        super().__init__()
+        self.using = using
+        self._listener = None
+        self._wakeup_read, self._wakeup_write = os.pipe()
+
+    def subscribe(self, channel, loop, queue):
+        super().subscribe(channel, loop, queue)
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name="comments-broker", daemon=True)
+                self._listener.start()
+        os.write(self._wakeup_write, b"1")  # LISTEN to the channel
+
+    def unsubscribe(self, channel, loop, queue):
+        super().unsubscribe(channel, loop, queue)
+        os.write(self._wakeup_write, b"1")
+
+    def publish(self, channel, message):
+        payload = json.dumps(message, cls=JSONEncoder)
+        if len(payload.encode()) > _MAX_PAYLOAD_SIZE:
+            payload = json.dumps({"id": message["id"]})
+        with connections[self.using].cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [channel, payload])
+
+    def _connect(self):
+        """A connection of its own (not pooled), in autocommit mode as LISTEN requires."""
+        wrapper = connections[self.using]
+        connection = wrapper.Database.connect(**wrapper.get_connection_params())
+        connection.autocommit = True
+        return connection
+
+    def _sync_channels(self, cursor, listened):
+        with self._lock:
+            channels = set(self._subscribers)
+        for channel in channels - listened:
+            cursor.execute(f"LISTEN \"{channel}\"")
+        for channel in listened - channels:
+            cursor.execute(f"UNLISTEN \"{channel}\"")
+        return channels
+
+    def _listen(self):
+        while True:
+            try:
+                connection = self._connect()
+                try:
+                    listened = set()
+                    while True:
+                        with connection.cursor() as cursor:
+                            listened = self._sync_channels(cursor, listened)
+                        readable, _, _ = select.select([connection, self._wakeup_read], [], [], 60)
+                        if self._wakeup_read in readable:
+                            os.read(self._wakeup_read, 4096)
+                        connection.poll()
+                        while connection.notifies:
+                            notify = connection.notifies.pop(0)
+                            super().publish(notify.channel, json.loads(notify.payload))
+                finally:
+                    connection.close()
+            except Exception:
+                # Notifications are lost until it's reconnected: clients get them with "since" when they reconnect.
+                logger.exception("Comments broker listener failed, reconnecting.")
+                time.sleep(1)
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(settings.COMMENTS_BROKER)()
+    return _broker
+
+
+@receiver(setting_changed)
+def reset_broker(setting, **kwargs):
+    global _broker
+    if setting == "COMMENTS_BROKER":
+        _broker = None
+
+
+def homework_instance_channel(homework_instance_id):
+    return f"homework_instance:{homework_instance_id}"
@@ -0,0 +1,96 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+
+from .models import CourseAccess
+from .replicas import reads_from_replicas
+from .roles import SUPERUSERS, get_user_roles
+
+_GLOBAL_VERSION_KEY = "elearn:responses:version"
+_COURSE_VERSION_KEY = "elearn:responses:course:{}"
+
+
+def get_response_cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def _new_version():
+    # Time based, so a re-created (evicted) version never matches an old one.
+    return time.time_ns()
+
+
+def _get_versions(keys):
+    cache = get_response_cache()
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _new_version(), None)
+            versions[key] = cache.get(key)
+    return versions
+
+
+def _bump_versions(keys):
+    cache = get_response_cache()
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_version(), None)
+
+
+def bump_course_versions(course_ids):
+    """Invalidates cached responses depending on the courses. It's done after the current transaction commit."""
+    keys = [_COURSE_VERSION_KEY.format(course_id) for course_id in course_ids] + [_GLOBAL_VERSION_KEY]
+    transaction.on_commit(lambda: _bump_versions(keys))
+
+
+class CachedResponseMixin:
+    """
+    Caches list and retrieve responses per user. Keys include versions of all user's courses
+    (all data for superusers), which are bumped by bump_course_versions on changes.
+    """
+
+    def _get_cache_key(self, request):
+        user = request.user
+        roles = get_user_roles(user)
+        if SUPERUSERS in roles:
+            version_keys = [_GLOBAL_VERSION_KEY]
+        else:
+            course_ids = sorted(set(CourseAccess.objects.filter(user_id=user.pk).values_list("course_id", flat=True)))
+            version_keys = [_COURSE_VERSION_KEY.format(course_id) for course_id in course_ids]
+
+        versions = _get_versions(version_keys)
+        fingerprint = hashlib.sha1("|".join([
+            ",".join(sorted(roles)),
+            request.get_full_path(),
+            *(f"{key}={versions[key]}" for key in version_keys),
+        ]).encode()).hexdigest()
+        return f"elearn:responses:{self.basename}:{self.action}:{user.pk}:{fingerprint}"
+
+    def _get_cached_response(self, request, get_response):
+        cache = get_response_cache()
+        key = self._get_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+
+        response = get_response()
+        if response.status_code == 200:
+            timeout = settings.RESPONSE_CACHE_TIMEOUT
+            if reads_from_replicas():
+                # Rendered from a replica behind the bumped version: may be stale up to the lag.
+                timeout = min(timeout, settings.DATABASE_REPLICA_MAX_LAG)
+            cache.set(key, response.data, timeout)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self._get_cached_response(request, lambda: super(CachedResponseMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._get_cached_response(
+            request, lambda: super(CachedResponseMixin, self).retrieve(request, *args, **kwargs)
+        )
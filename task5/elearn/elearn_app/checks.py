@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# Cache backends whose data isn't shared by the processes of the server.
+_LOCAL_CACHE_BACKENDS = {
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+}
+
+
+@register(Tags.caches)
+def check_primary_pin_cache(app_configs, **kwargs):
+    """Users' pins to the primary (elearn_app.replicas) must be seen by all workers to read their writes."""
+    if not settings.DATABASE_REPLICAS:
+        return []
+    alias = settings.DATABASE_PRIMARY_PIN_CACHE_ALIAS
+    backend = settings.CACHES.get(alias, {}).get("BACKEND")
+    if backend not in _LOCAL_CACHE_BACKENDS:
+        return []
+    return [Warning(
+        f"DATABASE_PRIMARY_PIN_CACHE_ALIAS '{alias}' uses {backend}, which isn't shared by the workers.",
+        hint="Users may read stale replica data through another worker after a write. "
+             "Use a shared cache (e.g. Memcached, Redis or the database cache) for the pins.",
+        id="elearn_app.W001",
+    )]
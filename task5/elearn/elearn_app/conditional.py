@@ -0,0 +1,84 @@
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+class ConditionalGetMixin:
+    """
+    ETag (and Last-Modified for retrieve) of list and retrieve responses, made of the version of the rows
+    behind them, including updated_at of ?expand= relations. If-None-Match/If-Modified-Since get 304
+    without serializing. Lists are versioned by the pk and updated_at of the rows of the requested page
+    (one keyset query of the page size, ids changing on deletions and insertions); retrieves by
+    Max(updated_at) and Count. Lists have no Last-Modified: a deletion doesn't move Max(updated_at).
+    """
+
+    def _get_expanded_lookups(self, queryset):
+        """updated_at lookups of the ?expand= relations."""
+        lookups = []
+        serializer_class = self.get_serializer_class()
+        if hasattr(serializer_class, "get_requested_fields"):
+            _, expand = serializer_class.get_requested_fields(self.request)
+            for field_name in sorted(expand):
+                related_model = queryset.model._meta.get_field(field_name).related_model
+                if any(field.name == "updated_at" for field in related_model._meta.fields):
+                    lookups.append(f"{field_name}__updated_at")
+        return lookups
+
+    def _get_version(self, queryset):
+        aggregates = {"count": Count("pk"), "updated_at": Max("updated_at")}
+        for lookup in self._get_expanded_lookups(queryset):
+            aggregates[lookup] = Max(lookup)
+        return queryset.order_by().aggregate(**aggregates)
+
+    def _get_page_version(self, queryset):
+        lookups = ["pk", "updated_at", *self._get_expanded_lookups(queryset)]
+        if self.paginator is None:
+            rows = list(queryset.values(*lookups))
+        else:
+            # Values of the page rows, with the fields the cursor of the paginator is made of.
+            ordering = [field.lstrip("-") for field in self.paginator.get_ordering(self.request, queryset, self)]
+            rows = self.paginator.paginate_queryset(queryset.values(*lookups, *ordering), self.request, view=self)
+        return {
+            "count": len(rows),
+            "rows": ";".join(",".join(str(row[lookup]) for lookup in lookups) for row in rows),
+        }
+
+    def _get_conditional_response(self, request, version, get_response, with_last_modified):
+        if not version["count"]:
+            return get_response()
+
+        fingerprint = "|".join([
+            str(request.user.pk), request.get_full_path(), request.META.get("HTTP_ACCEPT", ""),
+            *(f"{key}={value}" for key, value in sorted(version.items())),
+        ])
+        etag = f'W/"{hashlib.sha1(fingerprint.encode()).hexdigest()}"'
+        last_modified = int(version["updated_at"].timestamp()) if with_last_modified else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = get_response()
+        if response.status_code in {200, 304}:
+            response["ETag"] = etag
+            if last_modified is not None:
+                response["Last-Modified"] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self._get_conditional_response(
+            request, self._get_page_version(self.filter_queryset(self.get_queryset())),
+            lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs), with_last_modified=False,
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            queryset = self.filter_queryset(self.get_queryset()).filter(**{self.lookup_field: kwargs[lookup_url_kwarg]})
+        except (TypeError, ValueError, ValidationError):
+            return super().retrieve(request, *args, **kwargs)  # 404 as get_object() does
+        return self._get_conditional_response(
+            request, self._get_version(queryset),
+            lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs), with_last_modified=True,
+        )
@@ -0,0 +1,42 @@
+from django.db.models import F
+from rest_framework.reverse import reverse
+
+from .access import courses_ids
+from .models import Course, Lecture, Homework, HomeworkInstance
+from .roles import STUDENTS
+
+
+def build_dashboard(user, request=None):
+    """
+    Returns the student's courses with their lectures, homeworks and the student's instance (is_done, mark)
+    of each homework, nested. Four queries, whatever the number of courses: one per level, without models.
+    """
+    student_courses_ids = courses_ids(user, STUDENTS)
+    courses = Course.objects.filter(id__in=student_courses_ids).order_by("title").values("id", "title")
+    lectures = Lecture.objects.filter(course_id__in=student_courses_ids).order_by("id").values("id", "course_id", "title")
+    homeworks = (
+        Homework.objects.filter(course_id__in=student_courses_ids).order_by("id")
+        .values("id", "lecture_id", "title", "text")
+    )
+    instances = (
+        HomeworkInstance.objects.filter(student_id=user.pk, course_id__in=student_courses_ids)
+        .values("id", "homework_id", "is_done", mark=F("homeworkinstancemark__mark"))
+    )
+
+    instances_by_homework = {instance.pop("homework_id"): instance for instance in instances}
+    homeworks_by_lecture = {}
+    for homework in homeworks:
+        homework["instance"] = instances_by_homework.get(homework["id"])
+        homeworks_by_lecture.setdefault(homework.pop("lecture_id"), []).append(homework)
+
+    lectures_by_course = {}
+    for lecture in lectures:
+        lecture["download"] = reverse("lecture-download", args=[lecture["id"]], request=request)
+        lecture["homeworks"] = homeworks_by_lecture.get(lecture["id"], [])
+        lectures_by_course.setdefault(lecture.pop("course_id"), []).append(lecture)
+
+    return {
+        "courses": [
+            {**course, "lectures": lectures_by_course.get(course["id"], [])} for course in courses
+        ],
+    }
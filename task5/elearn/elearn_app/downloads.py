@@ -0,0 +1,132 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class _ChunkedFileResponse(FileResponse):
+    block_size = getattr(settings, "FILES_CHUNK_SIZE", 64 * 1024)
+
+
+def _read_chunks(file, length):
+    try:
+        while length > 0:
+            chunk = file.read(min(_ChunkedFileResponse.block_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def _parse_range(header, size):
+    """
+    Returns (start, end) of a single "bytes" range, None if the whole file must be sent
+    (no, multiple or invalid ranges) or raises ValueError if the range is not satisfiable.
+    """
+    match = _RANGE_RE.match(header.replace(" ", ""))
+    if not match:
+        return None
+
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not size:
+        raise ValueError("Empty file.")
+    if not start:  # suffix range: last N bytes
+        length = int(end)
+        if not length:
+            raise ValueError("Empty suffix range.")
+        return max(size - length, 0), size - 1
+
+    start = int(start)
+    if end and int(end) < start:  # invalid, ignored (RFC 7233, 3.1)
+        return None
+    if start >= size:
+        raise ValueError("Range is not satisfiable.")
+    return start, min(int(end), size - 1) if end else size - 1
+
+
+def _range_is_valid_for(request, etag, last_modified):
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def file_response(request, field_file):
+    """
+    Serves the file with conditional requests (ETag/Last-Modified) and single Range requests support.
+    The file is streamed by chunks or handed off to the front-end server (settings.FILES_SENDFILE_BACKEND).
+    """
+    if not field_file:
+        raise Http404("No file.")
+
+    path = field_file.path
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise Http404("No file.")
+
+    size, last_modified = stat.st_size, int(stat.st_mtime)
+    etag = f'"{size:x}-{stat.st_mtime_ns:x}"'
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return response
+
+    content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    sendfile_backend = getattr(settings, "FILES_SENDFILE_BACKEND", None)
+
+    if sendfile_backend == "x-accel-redirect":
+        response = HttpResponse(content_type=content_type)
+        relative_path = os.path.relpath(path, settings.MEDIA_ROOT)
+        response["X-Accel-Redirect"] = settings.FILES_ACCEL_REDIRECT_PREFIX + quote(relative_path)
+    elif sendfile_backend == "x-sendfile":
+        response = HttpResponse(content_type=content_type)
+        response["X-Sendfile"] = path
+    else:
+        byte_range = None
+        if "HTTP_RANGE" in request.META and _range_is_valid_for(request, etag, last_modified):
+            try:
+                byte_range = _parse_range(request.META["HTTP_RANGE"], size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response["Content-Range"] = f"bytes */{size}"
+                return response
+
+        if byte_range is None:
+            response = _ChunkedFileResponse(open(path, "rb"), content_type=content_type)
+        else:
+            start, end = byte_range
+            file = open(path, "rb")
+            file.seek(start)
+            response = StreamingHttpResponse(_read_chunks(file, end - start + 1), status=206, content_type=content_type)
+            response["Content-Range"] = f"bytes {start}-{end}/{size}"
+            response["Content-Length"] = str(end - start + 1)
+        response["Accept-Ranges"] = "bytes"
+
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    response["Cache-Control"] = "private"
+    response["Content-Disposition"] = _content_disposition(os.path.basename(field_file.name))
+    return response
+
+
+def _content_disposition(filename):
+    """As FileResponse(as_attachment=True): non-ASCII names are sent as RFC 6266 "filename*"."""
+    try:
+        filename.encode("ascii")
+    except UnicodeEncodeError:
+        return f"attachment; filename*=utf-8''{quote(filename)}"
+    return 'attachment; filename="{}"'.format(filename.replace("\\", "\\\\").replace('"', '\\"'))
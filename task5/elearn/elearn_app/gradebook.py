@@ -0,0 +1,52 @@
+from statistics import mean, median
+
+from django.db.models import Count, Max
+
+from .models import Homework, HomeworkInstance
+
+
+def build_gradebook(course):
+    """
+    Returns the course's student x homework matrices of marks, is_done flags and comments counts
+    with per-homework stats, as column-oriented data. Cells come from one aggregated query.
+    """
+    students = list(course.students.order_by("id").values_list("id", "email"))
+    homeworks = list(Homework.objects.filter(course=course).order_by("lecture_id", "id").values_list("id", "title"))
+    cells = (
+        HomeworkInstance.objects.filter(course=course)
+        .values("student_id", "homework_id", "is_done")
+        .annotate(mark=Max("homeworkinstancemark__mark"), comments=Count("homeworkinstancecomment"))
+    )
+
+    students_indexes = {student_id: i for i, (student_id, _) in enumerate(students)}
+    homeworks_indexes = {homework_id: i for i, (homework_id, _) in enumerate(homeworks)}
+    marks = [[None] * len(homeworks) for _ in students]
+    is_done = [[False] * len(homeworks) for _ in students]
+    comments = [[0] * len(homeworks) for _ in students]
+
+    for cell in cells:
+        i, j = students_indexes.get(cell["student_id"]), homeworks_indexes.get(cell["homework_id"])
+        if i is None or j is None:  # instance of a student who has left the course
+            continue
+        marks[i][j], is_done[i][j], comments[i][j] = cell["mark"], cell["is_done"], cell["comments"]
+
+    homeworks_marks = [[row[j] for row in marks if row[j] is not None] for j in range(len(homeworks))]
+    homeworks_done = [sum(row[j] for row in is_done) for j in range(len(homeworks))]
+
+    return {
+        "course": {"id": course.id, "title": course.title},
+        "students": {
+            "id": [student_id for student_id, _ in students],
+            "email": [email for _, email in students],
+        },
+        "homeworks": {
+            "id": [homework_id for homework_id, _ in homeworks],
+            "title": [title for _, title in homeworks],
+            "mean": [mean(values) if values else None for values in homeworks_marks],
+            "median": [median(values) if values else None for values in homeworks_marks],
+            "submission_rate": [done / len(students) if students else None for done in homeworks_done],
+        },
+        "marks": marks,
+        "is_done": is_done,
+        "comments": comments,
+    }
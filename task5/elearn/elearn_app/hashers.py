@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    """
+    Argon2id with parameters from settings.ARGON2_PARAMETERS.
+    Hashes made with other parameters or variety (Django's default argon2i) are upgraded on login.
+    """
+
+    @property
+    def time_cost(self):
+        return settings.ARGON2_PARAMETERS["time_cost"]
+
+    @property
+    def memory_cost(self):
+        return settings.ARGON2_PARAMETERS["memory_cost"]
+
+    @property
+    def parallelism(self):
+        return settings.ARGON2_PARAMETERS["parallelism"]
+
+    def encode(self, password, salt):
+        argon2 = self._load_library()
+        data = argon2.low_level.hash_secret(
+            password.encode(),
+            salt.encode(),
+            time_cost=self.time_cost,
+            memory_cost=self.memory_cost,
+            parallelism=self.parallelism,
+            hash_len=argon2.DEFAULT_HASH_LENGTH,
+            type=argon2.low_level.Type.ID,
+        )
+        return self.algorithm + data.decode('ascii')
+
+    def verify(self, password, encoded):
+        argon2 = self._load_library()
+        algorithm, rest = encoded.split('$', 1)
+        assert algorithm == self.algorithm
+        variety = rest.split('$', 1)[0]
+        argon2_type = argon2.low_level.Type.ID if variety == 'argon2id' else argon2.low_level.Type.I
+        try:
+            return argon2.low_level.verify_secret(('$' + rest).encode('ascii'), password.encode(), type=argon2_type)
+        except argon2.exceptions.VerificationError:
+            return False
+
+    def must_update(self, encoded):
+        return encoded.split('$')[1] != 'argon2id' or super().must_update(encoded)
@@ -0,0 +1,177 @@
+import json
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import send_mass_mail
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job, User, Lecture, Homework, HomeworkInstanceMark
+
+logger = logging.getLogger(__name__)
+
+_jobs = {}
+
+
+def job(name):
+    """Registers the function as the job "name". It's called with the enqueued payload as keyword arguments."""
+    def register(func):
+        _jobs[name] = func
+        return func
+    return register
+
+
+def enqueue(name, payload=None, idempotency_key=None, delay=None, max_attempts=None):
+    """
+    Adds a job in the current transaction, so it's only run if the transaction commits.
+    Returns the existing job instead if there is one with the idempotency key.
+    """
+    if name not in _jobs:
+        raise ValueError(f"Unknown job {name}.")
+    new_job = Job(
+        name=name,
+        payload=json.dumps(payload or {}),
+        idempotency_key=idempotency_key,
+        max_attempts=max_attempts or settings.JOBS_MAX_ATTEMPTS,
+        run_after=timezone.now() + (delay or timedelta()),
+    )
+    if idempotency_key is None:
+        new_job.save()
+        return new_job
+
+    try:
+        with transaction.atomic():
+            new_job.save()
+        return new_job
+    except IntegrityError:
+        return Job.objects.get(idempotency_key=idempotency_key)
+
+
+def enqueue_many(name, payloads_and_keys):
+    """Bulk enqueue of (payload, idempotency key) pairs; already enqueued keys are skipped."""
+    if name not in _jobs:
+        raise ValueError(f"Unknown job {name}.")
+    Job.objects.bulk_create([
+        Job(name=name, payload=json.dumps(payload), idempotency_key=key, max_attempts=settings.JOBS_MAX_ATTEMPTS)
+        for payload, key in payloads_and_keys
+    ], ignore_conflicts=True)
+
+
+def claim_jobs(limit):
+    """
+    Marks up to "limit" due jobs as running with a lease (settings.JOBS_LEASE seconds) and returns their ids.
+    Running jobs whose lease expired (e.g. their worker crashed) are due again, unless it was their last attempt.
+    """
+    now = timezone.now()
+    expired = Q(status=Job.RUNNING, locked_until__lte=now)
+    with transaction.atomic():
+        Job.objects.filter(expired, attempts__gte=F("max_attempts")).update(
+            status=Job.FAILED, locked_until=None, last_error="The lease of the last attempt expired.", updated_at=now,
+        )
+        jobs_ids = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(Q(status=Job.PENDING, run_after__lte=now) | expired)
+            .order_by("run_after")
+            .values_list("id", flat=True)[:limit]
+        )
+        Job.objects.filter(id__in=jobs_ids).update(
+            status=Job.RUNNING, attempts=F("attempts") + 1,
+            locked_until=now + timedelta(seconds=settings.JOBS_LEASE), updated_at=now,
+        )
+    return jobs_ids
+
+
+def get_retry_delay(attempts):
+    """Exponential backoff with jitter: JOBS_RETRY_BACKOFF * 2^(attempts - 1), up to JOBS_RETRY_BACKOFF_MAX."""
+    delay = min(settings.JOBS_RETRY_BACKOFF * 2 ** (attempts - 1), settings.JOBS_RETRY_BACKOFF_MAX)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def run_job(job_id):
+    """
+    Runs the claimed attempt of the job and records its result. Returns the job's new status, or None if
+    the attempt isn't the job's current one anymore (its lease expired and it was claimed again).
+    """
+    try:
+        current_job = Job.objects.filter(id=job_id, status=Job.RUNNING).first()
+        if current_job is None:
+            return None
+        current_attempt = Job.objects.filter(id=job_id, status=Job.RUNNING, attempts=current_job.attempts)
+        try:
+            _jobs[current_job.name](**json.loads(current_job.payload))
+        except Exception:
+            error = traceback.format_exc()
+            logger.warning("Job %s %s attempt %d failed:\n%s", job_id, current_job.name, current_job.attempts, error)
+            if current_job.attempts >= current_job.max_attempts:
+                status, run_after = Job.FAILED, current_job.run_after
+            else:
+                status, run_after = Job.PENDING, timezone.now() + get_retry_delay(current_job.attempts)
+            updated = current_attempt.update(
+                status=status, run_after=run_after, locked_until=None, last_error=error, updated_at=timezone.now(),
+            )
+            return status if updated else None
+
+        updated = current_attempt.update(status=Job.DONE, locked_until=None, last_error="", updated_at=timezone.now())
+        return Job.DONE if updated else None
+    finally:
+        close_old_connections()
+
+
+def purge_finished_jobs(older_than):
+    """Deletes done jobs finished before now - older_than. Failed ones are kept for inspection."""
+    return Job.objects.filter(status=Job.DONE, updated_at__lt=timezone.now() - older_than).delete()[0]
+
+
+def _course_students_emails(course_id):
+    return list(User.objects.filter(course_students__id=course_id).values_list("email", flat=True))
+
+
+def _send_to_each(subject, message, emails):
+    send_mass_mail([(subject, message, settings.DEFAULT_FROM_EMAIL, [email]) for email in emails])
+
+
+@job("notify_new_lecture")
+def notify_new_lecture(lecture_id):
+    lecture = Lecture.objects.select_related("course").filter(id=lecture_id).first()
+    if lecture is not None:
+        _send_to_each(
+            f"New lecture in {lecture.course.title}", f"Lecture \"{lecture.title}\" is available.",
+            _course_students_emails(lecture.course_id),
+        )
+
+
+@job("notify_new_homework")
+def notify_new_homework(homework_id):
+    homework = Homework.objects.select_related("course").filter(id=homework_id).first()
+    if homework is not None:
+        _send_to_each(
+            f"New homework in {homework.course.title}", f"Homework \"{homework.title}\" is assigned.",
+            _course_students_emails(homework.course_id),
+        )
+
+
+@job("notify_mark")
+def notify_mark(mark_id):
+    mark = (
+        HomeworkInstanceMark.objects
+        .select_related("homework_instance__homework", "homework_instance__student")
+        .filter(id=mark_id).first()
+    )
+    if mark is not None:
+        homework_instance = mark.homework_instance
+        _send_to_each(
+            f"Mark for {homework_instance.homework.title}", f"Your mark: {mark.mark}.",
+            [homework_instance.student.email],
+        )
+
+
+def mark_notification_key(mark):
+    """
+    One notification per change of the mark, keyed by its updated_at (which only increases): enqueueing the
+    same change twice (e.g. by concurrent bulk upserts) is deduplicated, setting an earlier value again is not.
+    """
+    return f"notify_mark:{mark.id}:{mark.updated_at.timestamp():.6f}"
@@ -0,0 +1,125 @@
+import json
+import logging
+import resource
+import time
+from statistics import mean, quantiles
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from elearn_app.authentication import issue_tokens
+from elearn_app.caching import get_response_cache
+from elearn_app.models import User
+from elearn_app.roles import SUPERUSERS, TEACHERS, STUDENTS, get_user_roles
+from elearn_app.urls import router
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the list and retrieve endpoints of the API router in process (Django test client) "
+        "as a superuser, a teacher and a student: latency percentiles, queries per request and peak RSS. "
+        "Run it on a seeded database (manage.py seed_data) and compare the JSON results of runs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=50, help="Measured requests per endpoint and role.")
+        parser.add_argument("--warmup", type=int, default=3)
+        parser.add_argument("--roles", nargs="+", choices=(SUPERUSERS, TEACHERS, STUDENTS),
+                            default=[SUPERUSERS, TEACHERS, STUDENTS])
+        parser.add_argument("--as", dest="emails", nargs="+", default=[],
+                            help="Emails of the users to benchmark as, instead of the first user of each role.")
+        parser.add_argument("--cold", action="store_true", help="Clear the response cache before every request.")
+        parser.add_argument("--output", help="Write the JSON results to the file instead of stdout.")
+
+    def handle(self, *args, **options):
+        users = self._get_users(options)
+        setup_test_environment()  # allows the test client's host
+        request_logger = logging.getLogger("django.request")
+        request_log_level = request_logger.level
+        request_logger.setLevel(logging.ERROR)  # 403s of other roles' endpoints are expected
+        try:
+            results = [
+                result
+                for role, user in users
+                for result in self._benchmark_user(role, user, options)
+            ]
+        finally:
+            request_logger.setLevel(request_log_level)
+            teardown_test_environment()
+
+        report = json.dumps({
+            "started_on": timezone.now().isoformat(),
+            "vendor": connection.vendor,
+            "options": {key: options[key] for key in ("requests", "warmup", "cold")},
+            "results": results,
+        }, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                file.write(report)
+        else:
+            self.stdout.write(report)
+
+    def _get_users(self, options):
+        """Returns [(role, user)]."""
+        if options["emails"]:
+            users = list(User.objects.filter(email__in=options["emails"]))
+            return [(", ".join(sorted(get_user_roles(user))) or "none", user) for user in users]
+
+        users = []
+        for role in options["roles"]:
+            user = User.objects.filter(groups__name=role).order_by("id").first()
+            if user is None:
+                raise CommandError(f"No user in {role}, seed the database first.")
+            users.append((role, user))
+        return users
+
+    def _get_endpoints(self, client):
+        """List URLs of the router and the retrieve URL of the first listed object."""
+        for prefix, viewset, basename in router.registry:
+            if not hasattr(viewset, "list"):
+                continue
+            url = f"/api/{prefix}/"
+            yield f"{basename}-list", url
+            response = client.get(url)
+            if response.status_code == 200:
+                results = response.json()
+                results = results.get("results", []) if isinstance(results, dict) else results
+                if results and "id" in results[0]:
+                    yield f"{basename}-detail", f"{url}{results[0]['id']}/"
+
+    def _benchmark_user(self, role, user, options):
+        client = Client(HTTP_AUTHORIZATION=f"Bearer {issue_tokens(user)['access']}")
+        for endpoint, url in list(self._get_endpoints(client)):
+            for _ in range(options["warmup"]):
+                client.get(url)
+
+            latencies, queries, statuses = [], [], {}
+            for _ in range(options["requests"]):
+                if options["cold"]:
+                    get_response_cache().clear()
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    response = client.get(url)
+                    latencies.append(time.perf_counter() - start)
+                queries.append(len(captured))
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+            percentiles = quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+            yield {
+                "endpoint": endpoint,
+                "url": url,
+                "role": role,
+                "requests": len(latencies),
+                "statuses": statuses,
+                "p50_ms": round(percentiles[49] * 1000, 2),
+                "p95_ms": round(percentiles[94] * 1000, 2),
+                "p99_ms": round(percentiles[98] * 1000, 2),
+                "queries_per_request": round(mean(queries), 2),
+                "max_queries": max(queries),
+                # Peak of the whole process so far: endpoints are measured one by one, so growth shows up
+                # at the endpoint that caused it.
+                "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            }
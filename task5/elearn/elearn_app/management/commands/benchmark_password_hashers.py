@@ -0,0 +1,38 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher, get_hashers_by_algorithm
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures password checks (logins) per second of the configured hashers: "
+        "in one thread (per core) and in the login hashing pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--logins", type=int, default=50, help="Password checks per measurement.")
+        parser.add_argument(
+            "--threads", type=int, default=settings.LOGIN_HASHING_WORKERS or 1, help="Pool size to measure."
+        )
+
+    def _measure(self, hasher, encoded, logins, threads):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(lambda _: hasher.verify("benchmark-password", encoded), range(logins)))
+        assert all(results)
+        return logins / (time.perf_counter() - start)
+
+    def handle(self, *args, **options):
+        logins, threads = options["logins"], options["threads"]
+        self.stdout.write(f"{'hasher':<55} {'logins/s, 1 thread':>20} {f'logins/s, {threads} threads':>22}")
+
+        for algorithm in get_hashers_by_algorithm():
+            hasher = get_hasher(algorithm)
+            encoded = hasher.encode("benchmark-password", hasher.salt())
+            single = self._measure(hasher, encoded, logins, 1)
+            pooled = self._measure(hasher, encoded, logins, threads)
+            name = f"{type(hasher).__module__}.{type(hasher).__name__}"
+            self.stdout.write(f"{name:<55} {single:>20.1f} {pooled:>22.1f}")
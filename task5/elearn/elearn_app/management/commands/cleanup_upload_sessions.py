@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from elearn_app.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = "Deletes expired upload sessions with their part files."
+
+    def handle(self, *args, **options):
+        expired_sessions = UploadSession.objects.filter(expires_on__lte=timezone.now())
+        count = 0
+        for session in expired_sessions.iterator():
+            session.discard()
+            count += 1
+        self.stdout.write(f"Deleted {count} expired upload sessions.")
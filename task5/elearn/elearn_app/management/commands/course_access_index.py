@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from elearn_app.access import rebuild_access_index, verify_access_index
+
+
+class Command(BaseCommand):
+    help = "Rebuilds (or only verifies with --verify) the course access index and denormalized course ids."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--verify", action="store_true", help="Only check the index, don't rebuild it.")
+
+    def handle(self, *args, **options):
+        if not options["verify"]:
+            rebuild_access_index()
+            self.stdout.write("Course access index rebuilt.")
+
+        problems = verify_access_index()
+        if problems:
+            raise CommandError(
+                "Course access index is inconsistent: " + ", ".join(f"{key}: {count}" for key, count in problems.items())
+            )
+        self.stdout.write(self.style.SUCCESS("Course access index is consistent."))
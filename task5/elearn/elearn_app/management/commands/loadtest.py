@@ -0,0 +1,59 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from statistics import quantiles
+
+import requests
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "HTTP load test of running servers: sends GET requests to the URLs with the given concurrency "
+        "and reports throughput and latency percentiles. E.g. compare WSGI and ASGI deployments "
+        "with equal worker counts by running it against both."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("urls", nargs="+", help="Full URLs, requested round-robin.")
+        parser.add_argument("--authorization", default="", help='Authorization header, e.g. "Bearer <access>".')
+        parser.add_argument("--concurrency", type=int, default=16)
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+
+    def handle(self, *args, **options):
+        urls, total = options["urls"], options["requests"]
+        headers = {"Authorization": options["authorization"]} if options["authorization"] else {}
+        sessions = {}
+
+        def request(i):
+            session = sessions.setdefault(i % options["concurrency"], requests.Session())
+            start = time.perf_counter()
+            try:
+                status = session.get(urls[i % len(urls)], headers=headers).status_code
+            except requests.RequestException:
+                status = None
+            return status, time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+            results = list(executor.map(request, range(total)))
+        elapsed = time.perf_counter() - start
+
+        latencies = sorted(latency for _, latency in results)
+        percentiles = quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        report = {
+            "requests": total,
+            "concurrency": options["concurrency"],
+            "errors": sum(1 for status, _ in results if status is None or status >= 400),
+            "requests_per_second": round(total / elapsed, 1),
+            "p50_ms": round(percentiles[49] * 1000, 1),
+            "p95_ms": round(percentiles[94] * 1000, 1),
+            "p99_ms": round(percentiles[98] * 1000, 1),
+        }
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report))
+        else:
+            for key, value in report.items():
+                self.stdout.write(f"{key:>20}: {value}")
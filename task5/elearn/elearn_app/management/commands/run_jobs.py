@@ -0,0 +1,58 @@
+import multiprocessing
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+
+import django
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from elearn_app.authentication import purge_revoked_tokens
+from elearn_app.jobs import claim_jobs, run_job, purge_finished_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs queued background jobs (elearn_app.jobs) in a pool of threads or processes. "
+        "Several workers may run at once (on any hosts): jobs are claimed with SKIP LOCKED on PostgreSQL. "
+        "When idle, done jobs, denylist entries of expired tokens and unreferenced stored files are purged."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--pool", choices=("thread", "process"), default="thread",
+                            help="Processes for CPU-bound jobs, threads for I/O-bound ones (emails).")
+        parser.add_argument("--batch", type=int, help="Jobs claimed at once, --workers by default.")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between polls of an empty queue.")
+        parser.add_argument("--purge-after", type=int, default=7 * 24 * 60 * 60,
+                            help="Seconds to keep done jobs (and their idempotency keys).")
+        parser.add_argument("--once", action="store_true", help="Exit when there are no due jobs.")
+
+    def handle(self, *args, **options):
+        if options["pool"] == "process":
+            # Spawned, not forked: children don't share the parent's database connections.
+            executor = ProcessPoolExecutor(
+                options["workers"], mp_context=multiprocessing.get_context("spawn"), initializer=django.setup
+            )
+        else:
+            executor = ThreadPoolExecutor(options["workers"])
+
+        statuses, purged_on = Counter(), 0
+        with executor:
+            while True:
+                jobs_ids = claim_jobs(options["batch"] or options["workers"])
+                if jobs_ids:
+                    statuses.update(status for status in executor.map(run_job, jobs_ids) if status)
+                    continue
+                if options["once"]:
+                    break
+                if time.monotonic() - purged_on > options["poll_interval"] * 60:
+                    purge_finished_jobs(timedelta(seconds=options["purge_after"]))
+                    purge_revoked_tokens()
+                    if hasattr(default_storage, "purge_unreferenced"):
+                        default_storage.purge_unreferenced(timedelta(seconds=options["purge_after"]))
+                    purged_on = time.monotonic()
+                time.sleep(options["poll_interval"])
+
+        self.stdout.write(", ".join(f"{status}: {count}" for status, count in sorted(statuses.items())) or "No jobs.")
@@ -0,0 +1,150 @@
+import os
+import random
+import time
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+
+from elearn_app.caching import bump_course_versions
+from elearn_app.models import (
+    User, Group, Course, CourseAccess, Lecture, Homework, HomeworkInstance, HomeworkInstanceMark,
+    HomeworkInstanceComment, StoredBlob,
+)
+from elearn_app.roles import TEACHERS, STUDENTS
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a synthetic dataset with bulk inserts: users, courses with members, lectures, homeworks, "
+        "homework instances of every course student, marks of done instances and comments. "
+        "All users get the same password, hashed once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--prefix", default="seed", help="Prefix of emails and course titles, unique per run.")
+        parser.add_argument("--teachers", type=int, default=50)
+        parser.add_argument("--students", type=int, default=2000)
+        parser.add_argument("--courses", type=int, default=100)
+        parser.add_argument("--teachers-per-course", type=int, default=2)
+        parser.add_argument("--students-per-course", type=int, default=100)
+        parser.add_argument("--lectures-per-course", type=int, default=10)
+        parser.add_argument("--homeworks-per-lecture", type=int, default=2)
+        parser.add_argument("--done-ratio", type=float, default=0.7, help="Share of done (and marked) instances.")
+        parser.add_argument("--comments-per-instance", type=int, default=2)
+        parser.add_argument("--password", default="password")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--random-seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options["teachers_per_course"] > options["teachers"] or options["students_per_course"] > options["students"]:
+            raise CommandError("Courses can't have more members than there are users.")
+        if User.objects.filter(email__startswith=f"{options['prefix']}.").exists():
+            raise CommandError(f"Data with prefix \"{options['prefix']}\" already exists, use another --prefix.")
+
+        self.options, self.random = options, random.Random(options["random_seed"])
+        start = time.perf_counter()
+        with transaction.atomic():
+            teachers_ids = self._create_users(TEACHERS, options["teachers"])
+            students_ids = self._create_users(STUDENTS, options["students"])
+            courses_members = self._create_courses(teachers_ids, students_ids)
+            # Seeded courses as a subquery: lists of ids could exceed the query parameters limit.
+            courses_ids = Course.objects.filter(title__startswith=f"{options['prefix']} course")
+            courses_ids = courses_ids.values_list("id", flat=True)
+            self._create_lectures_and_homeworks(courses_ids)
+            self._create_homework_instances(courses_ids, courses_members)
+            self._create_marks_and_comments(courses_ids)
+            bump_course_versions(list(courses_members))
+
+        self.stdout.write(self.style.SUCCESS(f"Seeded in {time.perf_counter() - start:.1f}s."))
+
+    def _bulk_create(self, model, objects):
+        """Inserts the (lazy) objects in batches, without materializing them all."""
+        objects, count = iter(objects), 0
+        while True:
+            batch = list(islice(objects, self.options["batch_size"]))
+            if not batch:
+                break
+            model.objects.bulk_create(batch)  # split further by the backend limits
+            count += len(batch)
+        self.stdout.write(f"{model._meta.label}: {count}")
+        return count
+
+    def _create_users(self, group, count):
+        prefix, password = f"{self.options['prefix']}.{group}", make_password(self.options["password"])
+        self._bulk_create(User, (
+            User(email=f"{prefix}{i}@example.com", first_name="Seed", last_name=f"{group.title()} {i}", password=password)
+            for i in range(count)
+        ))
+        users_ids = list(User.objects.filter(email__startswith=prefix).order_by("id").values_list("id", flat=True))
+        group_id = Group.objects.get(name=group).id
+        self._bulk_create(User.groups.through, (
+            User.groups.through(user_id=user_id, group_id=group_id) for user_id in users_ids
+        ))
+        return users_ids
+
+    def _create_courses(self, teachers_ids, students_ids):
+        """Returns {course id: {role: members ids}}. The course access index is filled along with the members."""
+        prefix = f"{self.options['prefix']} course"
+        self._bulk_create(Course, (Course(title=f"{prefix} {i}") for i in range(self.options["courses"])))
+        courses_ids = Course.objects.filter(title__startswith=prefix).order_by("id").values_list("id", flat=True)
+        courses_members = {
+            course_id: {
+                TEACHERS: self.random.sample(teachers_ids, self.options["teachers_per_course"]),
+                STUDENTS: self.random.sample(students_ids, self.options["students_per_course"]),
+            }
+            for course_id in courses_ids
+        }
+
+        for role in (TEACHERS, STUDENTS):
+            through = getattr(Course, role).through
+            pairs = [(course_id, user_id) for course_id, members in courses_members.items() for user_id in members[role]]
+            self._bulk_create(through, (through(course_id=course_id, user_id=user_id) for course_id, user_id in pairs))
+            self._bulk_create(CourseAccess, (
+                CourseAccess(course_id=course_id, user_id=user_id, role=role) for course_id, user_id in pairs
+            ))
+        return courses_members
+
+    def _create_lectures_and_homeworks(self, courses_ids):
+        # All lectures share one stored file; its blob (if the storage deduplicates) counts every reference.
+        file_name = default_storage.save("lectures/seed.txt", ContentFile(b"Seeded lecture.\n"))
+        lectures_count = self._bulk_create(Lecture, (
+            Lecture(course_id=course_id, title=f"Lecture {i}", file=file_name)
+            for course_id in courses_ids for i in range(self.options["lectures_per_course"])
+        ))
+        StoredBlob.objects.filter(digest=os.path.basename(os.path.dirname(file_name))).update(
+            refcount=F("refcount") + lectures_count - 1
+        )
+
+        lectures = Lecture.objects.filter(course_id__in=courses_ids).values_list("id", "course_id").iterator()
+        self._bulk_create(Homework, (
+            Homework(lecture_id=lecture_id, course_id=course_id, title=f"Homework {i}", text="Seeded homework.")
+            for lecture_id, course_id in lectures for i in range(self.options["homeworks_per_lecture"])
+        ))
+
+    def _create_homework_instances(self, courses_ids, courses_members):
+        homeworks = Homework.objects.filter(course_id__in=courses_ids).values_list("id", "course_id")
+        self._bulk_create(HomeworkInstance, (
+            HomeworkInstance(
+                homework_id=homework_id, course_id=course_id, student_id=student_id,
+                is_done=self.random.random() < self.options["done_ratio"],
+            )
+            for homework_id, course_id in homeworks.iterator()
+            for student_id in courses_members[course_id][STUDENTS]
+        ))
+
+    def _create_marks_and_comments(self, courses_ids):
+        instances = HomeworkInstance.objects.filter(course_id__in=courses_ids)
+        self._bulk_create(HomeworkInstanceMark, (
+            HomeworkInstanceMark(homework_instance_id=homework_instance_id, mark=self.random.randint(0, 100))
+            for homework_instance_id in instances.filter(is_done=True).values_list("id", flat=True).iterator()
+        ))
+        self._bulk_create(HomeworkInstanceComment, (
+            HomeworkInstanceComment(homework_instance_id=homework_instance_id, author_id=student_id, body=f"Comment {i}")
+            for homework_instance_id, student_id in instances.values_list("id", "student_id").iterator()
+            for i in range(self.options["comments_per_instance"])
+        ))
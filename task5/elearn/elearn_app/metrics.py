@@ -0,0 +1,237 @@
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+from rest_framework.authentication import get_authorization_header
+
+from .pooling import get_pools_stats
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Histograms and counters of this process, by name and labels. Thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # name: (description, buckets, {labels: Histogram})
+        self._counters = {}  # name: (description, {labels: value})
+        self._collected = {}  # name: (type, description, collect() -> {labels: value})
+
+    def histogram(self, name, description, buckets):
+        self._histograms.setdefault(name, (description, buckets, {}))
+
+    def counter(self, name, description):
+        self._counters.setdefault(name, (description, {}))
+
+    def collected(self, name, metric_type, description, collect):
+        """Counter or gauge kept elsewhere: collect() returns its {labels: value} when rendered."""
+        self._collected.setdefault(name, (metric_type, description, collect))
+
+    def observe(self, name, labels, value):
+        _, buckets, series = self._histograms[name]
+        with self._lock:
+            if labels not in series:
+                series[labels] = Histogram(buckets)
+            series[labels].observe(value)
+
+    def increment(self, name, labels, value=1):
+        _, series = self._counters[name]
+        with self._lock:
+            series[labels] = series.get(labels, 0) + value
+
+    def render(self):
+        """Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, (description, series) in self._counters.items():
+                lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+                lines += [f"{name}{_format_labels(labels)} {value}" for labels, value in series.items()]
+
+            for name, (metric_type, description, collect) in self._collected.items():
+                lines += [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}"]
+                lines += [f"{name}{_format_labels(labels)} {value}" for labels, value in collect().items()]
+
+            for name, (description, buckets, series) in self._histograms.items():
+                lines += [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+                for labels, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(buckets + ("+Inf",), histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f"{key}=\"{_escape_label(value)}\"" for key, value in labels) + "}"
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+registry = MetricsRegistry()
+registry.counter("elearn_requests_total", "Sampled requests by view and status.")
+registry.histogram("elearn_request_duration_seconds", "Wall time of sampled requests.", DURATION_BUCKETS)
+registry.histogram("elearn_request_db_duration_seconds", "Time in database queries of sampled requests.",
+                   DURATION_BUCKETS)
+registry.histogram("elearn_request_queries", "Database queries of sampled requests.", QUERIES_BUCKETS)
+registry.histogram("elearn_request_duplicate_queries", "Queries repeating an SQL of the same request.",
+                   QUERIES_BUCKETS)
+registry.histogram("elearn_response_size_bytes", "Response body size of sampled requests.", SIZE_BUCKETS)
+
+
+# Connection pools (elearn_app.pooling) of the process, by database alias.
+
+def _collect_pools_stats(key):
+    def collect():
+        return {
+            (("alias", alias), ("database", database)): stats[key]
+            for (alias, database), stats in get_pools_stats().items()
+        }
+    return collect
+
+
+for name, metric_type, key, description in (
+    ("elearn_db_pool_max_size", "gauge", "max_size", "Maximum connections of the pool."),
+    ("elearn_db_pool_in_use", "gauge", "in_use", "Checked out connections."),
+    ("elearn_db_pool_idle", "gauge", "idle", "Open connections waiting in the pool."),
+    ("elearn_db_pool_waits_total", "counter", "waits", "Checkouts that waited for a free connection."),
+    ("elearn_db_pool_wait_seconds_total", "counter", "wait_seconds", "Time checkouts waited for a free connection."),
+    ("elearn_db_pool_timeouts_total", "counter", "timeouts", "Checkouts that got no connection in time."),
+    ("elearn_db_pool_connections_created_total", "counter", "created", "Connections opened."),
+    ("elearn_db_pool_connections_closed_total", "counter", "closed", "Connections closed (too old, broken)."),
+    ("elearn_db_pool_failed_checks_total", "counter", "failed_checks", "Connections failing the checkout check."),
+):
+    registry.collected(name, metric_type, description, _collect_pools_stats(key))
+
+
+class QueryRecorder:
+    """connection.execute_wrapper() recording SQL statements (without parameters) and their time."""
+
+    def __init__(self):
+        self.statements = Counter()
+        self.duration = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.statements[sql] += 1
+
+    @property
+    def count(self):
+        return sum(self.statements.values())
+
+    @property
+    def duplicates(self):
+        return self.count - len(self.statements)
+
+    def top_duplicates(self, limit):
+        return [(sql, count) for sql, count in self.statements.most_common(limit) if count > 1]
+
+
+def get_view_name(request):
+    """E.g. "CourseViewSet.list" for DRF views, the function name for others."""
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unresolved"
+    view_class = getattr(match.func, "cls", None)
+    if view_class is None:
+        return match.func.__name__
+    method = request.method.lower()
+    action = (getattr(match.func, "actions", None) or {}).get(method, method)
+    return f"{view_class.__name__}.{action}"
+
+
+class RequestMetricsMiddleware:
+    """
+    Records wall time, database time, queries, duplicated queries and response size of a sample
+    (settings.METRICS_SAMPLE_RATE) of requests by view into the metrics registry.
+    Requests slower than settings.METRICS_SLOW_REQUEST_SECONDS are logged with their most repeated SQL.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        view = get_view_name(request)
+        labels = (("view", view),)
+        registry.increment("elearn_requests_total", labels + (("status", response.status_code),))
+        registry.observe("elearn_request_duration_seconds", labels, duration)
+        registry.observe("elearn_request_db_duration_seconds", labels, recorder.duration)
+        registry.observe("elearn_request_queries", labels, recorder.count)
+        registry.observe("elearn_request_duplicate_queries", labels, recorder.duplicates)
+        registry.observe("elearn_response_size_bytes", labels, _get_response_size(response))
+
+        if duration >= settings.METRICS_SLOW_REQUEST_SECONDS:
+            logger.warning(
+                "Slow request %s %s (%s): %.3fs, %d queries (%d duplicates) in %.3fs.%s",
+                request.method, request.path, view, duration, recorder.count, recorder.duplicates, recorder.duration,
+                "".join(
+                    f"\n  {count}x {sql}" for sql, count in recorder.top_duplicates(settings.METRICS_SLOW_REQUEST_TOP_SQL)
+                ),
+            )
+        return response
+
+
+def _get_response_size(response):
+    if response.streaming:
+        return int(response.get("Content-Length", 0))
+    return len(response.content)
+
+
+def metrics_view(request):
+    """
+    Metrics of this process, only for the scraper sending "Authorization: Bearer <settings.METRICS_TOKEN>".
+    Client addresses aren't checked: behind the reverse proxy all requests come from its address.
+    """
+    auth = get_authorization_header(request).split()
+    if (
+        not settings.METRICS_TOKEN or len(auth) != 2 or auth[0].lower() != b"bearer"
+        or not constant_time_compare(auth[1], settings.METRICS_TOKEN.encode())
+    ):
+        raise Http404
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
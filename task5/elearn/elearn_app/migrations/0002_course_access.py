@@ -0,0 +1,72 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def forwards_course_access(apps, schema_editor):
+    Course = apps.get_model("elearn_app", "Course")
+    CourseAccess = apps.get_model("elearn_app", "CourseAccess")
+    Lecture = apps.get_model("elearn_app", "Lecture")
+    Homework = apps.get_model("elearn_app", "Homework")
+    HomeworkInstance = apps.get_model("elearn_app", "HomeworkInstance")
+    db_alias = schema_editor.connection.alias
+
+    Homework.objects.using(db_alias).update(course_id=models.Subquery(
+        Lecture.objects.using(db_alias).filter(id=models.OuterRef("lecture_id")).values("course_id")
+    ))
+    HomeworkInstance.objects.using(db_alias).update(course_id=models.Subquery(
+        Homework.objects.using(db_alias).filter(id=models.OuterRef("homework_id")).values("course_id")
+    ))
+
+    for role in ("teachers", "students"):
+        through = getattr(Course, role).through
+        CourseAccess.objects.using(db_alias).bulk_create(
+            (
+                CourseAccess(user_id=user_id, role=role, course_id=course_id)
+                for user_id, course_id in through.objects.using(db_alias).values_list("user_id", "course_id")
+            ),
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elearn_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseAccess',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('teachers', 'teachers'), ('students', 'students')], max_length=16)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='elearn_app.Course')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'role', 'course')},
+            },
+        ),
+        migrations.AddField(
+            model_name='homework',
+            name='course',
+            field=models.ForeignKey(null=True, editable=False, on_delete=django.db.models.deletion.CASCADE, to='elearn_app.Course'),
+        ),
+        migrations.AddField(
+            model_name='homeworkinstance',
+            name='course',
+            field=models.ForeignKey(null=True, editable=False, on_delete=django.db.models.deletion.CASCADE, to='elearn_app.Course'),
+        ),
+        migrations.RunPython(forwards_course_access, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='homework',
+            name='course',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, to='elearn_app.Course'),
+        ),
+        migrations.AlterField(
+            model_name='homeworkinstance',
+            name='course',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, to='elearn_app.Course'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.0.3 on 2026-10-18 05:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elearn_app', '0002_course_access'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('target', models.CharField(choices=[('lecture', 'lecture'), ('homework_instance', 'homework_instance')], max_length=32)),
+                ('target_id', models.PositiveIntegerField()),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('offset', models.BigIntegerField(default=0)),
+                ('checksum', models.BigIntegerField(default=0)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('expires_on', models.DateTimeField()),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
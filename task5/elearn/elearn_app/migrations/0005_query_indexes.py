@@ -0,0 +1,35 @@
+# Generated by Django 3.0.3 on 2026-10-18 05:13
+
+from django.db import migrations, models
+
+
+def _members_index(table):
+    """(user_id, course_id) index of an auto-created Course m2m table: "courses of a user" without table lookups."""
+    return migrations.RunSQL(
+        f"CREATE INDEX {table}_user_course_idx ON {table} (user_id, course_id)",
+        f"DROP INDEX {table}_user_course_idx",
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elearn_app', '0004_stored_blob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='homeworkinstance',
+            index=models.Index(fields=['student', 'is_done'], name='instance_student_done_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='homeworkinstance',
+            index=models.Index(condition=models.Q(is_done=False), fields=['course', 'homework'], name='instance_undone_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='homeworkinstancecomment',
+            index=models.Index(fields=['homework_instance', 'created_on', 'id'], name='comment_instance_created_idx'),
+        ),
+        _members_index('elearn_app_course_teachers'),
+        _members_index('elearn_app_course_students'),
+    ]
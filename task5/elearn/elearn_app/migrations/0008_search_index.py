@@ -0,0 +1,91 @@
+from django.db import migrations
+
+# Searched columns by table, with their PostgreSQL weights (see elearn_app.search).
+SEARCHED_COLUMNS = {
+    'elearn_app_lecture': (('title', 'A'),),
+    'elearn_app_homework': (('title', 'A'), ('text', 'B')),
+    'elearn_app_homeworkinstancecomment': (('body', 'B'),),
+}
+SEARCH_CONFIG = 'english'
+
+
+def _postgresql_sql(table, columns):
+    """Trigger-maintained tsvector column with a GIN index."""
+    vector = " || ".join(
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.{column}, '')), '{weight}')" for column, weight in columns
+    )
+    names = ", ".join(column for column, _ in columns)
+    return [
+        f"ALTER TABLE {table} ADD COLUMN search_vector tsvector",
+        f"""CREATE FUNCTION {table}_search_vector() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector := {vector};
+                RETURN NEW;
+            END
+        $$ LANGUAGE plpgsql""",
+        f"""CREATE TRIGGER {table}_search_vector BEFORE INSERT OR UPDATE OF {names} ON {table}
+            FOR EACH ROW EXECUTE PROCEDURE {table}_search_vector()""",
+        f"UPDATE {table} SET {columns[0][0]} = {columns[0][0]}",  # fills existing rows by the trigger
+        f"CREATE INDEX {table}_search_idx ON {table} USING GIN (search_vector)",
+    ]
+
+
+def _postgresql_reverse_sql(table, columns):
+    return [
+        f"DROP TRIGGER {table}_search_vector ON {table}",
+        f"DROP FUNCTION {table}_search_vector()",
+        f"ALTER TABLE {table} DROP COLUMN search_vector",
+    ]
+
+
+def _sqlite_sql(table, columns):
+    """
+    External content FTS5 table (rowid = id) kept in sync by triggers.
+    SQLite table rebuilds (Django's ALTER of these tables) drop the triggers: they are recreated
+    after migrations (elearn_app.search.create_sqlite_triggers).
+    """
+    names = ", ".join(column for column, _ in columns)
+    new_values = ", ".join(f"new.{column}" for column, _ in columns)
+    old_values = ", ".join(f"old.{column}" for column, _ in columns)
+    delete = f"INSERT INTO {table}_fts ({table}_fts, rowid, {names}) VALUES ('delete', old.id, {old_values});"
+    insert = f"INSERT INTO {table}_fts (rowid, {names}) VALUES (new.id, {new_values});"
+    return [
+        f"""CREATE VIRTUAL TABLE {table}_fts USING fts5(
+            {names}, content='{table}', content_rowid='id', tokenize='porter unicode61'
+        )""",
+        f"CREATE TRIGGER {table}_fts_insert AFTER INSERT ON {table} BEGIN {insert} END",
+        f"CREATE TRIGGER {table}_fts_delete AFTER DELETE ON {table} BEGIN {delete} END",
+        f"CREATE TRIGGER {table}_fts_update AFTER UPDATE OF {names} ON {table} BEGIN {delete} {insert} END",
+        f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')",
+    ]
+
+
+def _sqlite_reverse_sql(table, columns):
+    return [f"DROP TRIGGER {table}_fts_{event}" for event in ("insert", "delete", "update")] + [
+        f"DROP TABLE {table}_fts",
+    ]
+
+
+def _run(builders):
+    def run(apps, schema_editor):
+        builder = builders.get(schema_editor.connection.vendor)
+        if builder is None:
+            return
+        for table, columns in SEARCHED_COLUMNS.items():
+            for sql in builder(table, columns):
+                schema_editor.execute(sql, params=None)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elearn_app', '0007_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'postgresql': _postgresql_sql, 'sqlite': _sqlite_sql}),
+            _run({'postgresql': _postgresql_reverse_sql, 'sqlite': _sqlite_reverse_sql}),
+        ),
+    ]
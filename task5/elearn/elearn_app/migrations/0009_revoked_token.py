@@ -0,0 +1,20 @@
+# Generated by Django 3.0.3 on 2026-10-18 06:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elearn_app', '0008_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevokedToken',
+            fields=[
+                ('jti', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('expires_on', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.0.3 on 2026-10-18 06:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elearn_app', '0009_revoked_token'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='homeworkinstance',
+            name='file',
+            field=models.FileField(max_length=255, null=True, upload_to='done_homeworks/'),
+        ),
+        migrations.AlterField(
+            model_name='lecture',
+            name='file',
+            field=models.FileField(max_length=255, upload_to='lectures/'),
+        ),
+    ]
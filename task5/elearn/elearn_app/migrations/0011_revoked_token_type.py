@@ -0,0 +1,20 @@
+# Generated by Django 3.0.3 on 2026-10-18 06:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elearn_app', '0010_file_max_length'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='revokedtoken',
+            name='token_type',
+            # Existing entries are kept in the access tokens denylist: their type is unknown.
+            field=models.CharField(default='access', max_length=7),
+            preserve_default=False,
+        ),
+    ]
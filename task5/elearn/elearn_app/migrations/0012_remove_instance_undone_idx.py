@@ -0,0 +1,17 @@
+# Generated by Django 3.0.3 on 2026-10-18 07:05
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elearn_app', '0011_revoked_token_type'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='homeworkinstance',
+            name='instance_undone_idx',
+        ),
+    ]
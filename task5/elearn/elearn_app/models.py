@@ -1,3 +1,7 @@
+import os
+import uuid
+
+from django.conf import settings
 from django.db import models
 from django.utils import timezone
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager, Group
@@ -56,18 +60,38 @@ class Course(models.Model):
     title = models.CharField(max_length=128, null=False, unique=True)
     teachers = models.ManyToManyField(User, related_name="course_teachers")
     students = models.ManyToManyField(User, related_name="course_students", blank=True)
+    updated_at = models.DateTimeField(auto_now=True)  # also touched by teachers/students changes
 
     def __str__(self):
         return f"Course \"{self.title}\""
 
 
+class CourseAccess(models.Model):
+    """
+    Denormalized index of Course.teachers and Course.students: one (user, role, course) row per membership.
+    It's kept in sync by m2m_changed signals and can be rebuilt by "manage.py course_access_index".
+    """
+    class Meta:
+        unique_together = (("user", "role", "course"),)
+
+    ROLES = (("teachers", "teachers"), ("students", "students"))
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    role = models.CharField(max_length=16, choices=ROLES)
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name="+")
+
+    def __str__(self):
+        return f"{self.user} in {self.role} of {self.course}"
+
+
 class Lecture(models.Model):
     class Meta:
         unique_together = (("course_id", "title"),)
 
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
     title = models.CharField(max_length=128, null=False)
-    file = models.FileField(upload_to="lectures/", null=False)
+    file = models.FileField(upload_to="lectures/", null=False, max_length=255)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Lecture \"{self.title}\""
@@ -78,8 +102,14 @@ class Homework(models.Model):
         unique_together = (("lecture_id", "title"),)
 
     lecture = models.ForeignKey(Lecture, on_delete=models.CASCADE)
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, editable=False)  # denormalized lecture.course
     title = models.CharField(max_length=128, null=False)
     text = models.TextField(null=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def save(self, *args, **kwargs):
+        self.course_id = self.lecture.course_id
+        super(Homework, self).save(*args, **kwargs)
 
     def __str__(self):
         return f"Homework \"{self.title}\" from lecture \"{self.lecture.title}\""
@@ -88,12 +118,21 @@ class Homework(models.Model):
 class HomeworkInstance(models.Model):
     class Meta:
         unique_together = (("homework_id", "student_id"),)
+        indexes = [
+            models.Index(fields=["student", "is_done"], name="instance_student_done_idx"),
+        ]
 
     homework = models.ForeignKey(Homework, on_delete=models.CASCADE)
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, editable=False)  # denormalized homework.course
     student = models.ForeignKey(User, on_delete=models.CASCADE)
 
-    file = models.FileField(upload_to="done_homeworks/", null=True)
+    file = models.FileField(upload_to="done_homeworks/", null=True, max_length=255)
     is_done = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def save(self, *args, **kwargs):
+        self.course_id = self.homework.course_id
+        super(HomeworkInstance, self).save(*args, **kwargs)
 
     def __str__(self):
         return f"Homework: {self.homework.title} by {self.student}"
@@ -102,6 +141,7 @@ class HomeworkInstance(models.Model):
 class HomeworkInstanceMark(models.Model):
     homework_instance = models.OneToOneField(HomeworkInstance, on_delete=models.CASCADE)
     mark = models.SmallIntegerField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.homework_instance} : {self.mark}"
@@ -112,9 +152,93 @@ class HomeworkInstanceComment(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     created_on = models.DateTimeField(auto_now_add=True)
     body = models.TextField(null=False, blank=False)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ["created_on"]
+        indexes = [
+            # Comments of a homework instance in the order of the cursor pagination.
+            models.Index(fields=["homework_instance", "created_on", "id"], name="comment_instance_created_idx"),
+        ]
 
     def __str__(self):
         return f"Comment: {self.body} by {self.author}"
+
+
+class UploadSession(models.Model):
+    """
+    Resumable chunked upload of a file for an existing Lecture or HomeworkInstance.
+    Received bytes are appended to the part file; checksum is the running CRC32 of them.
+    """
+    TARGETS = (("lecture", "lecture"), ("homework_instance", "homework_instance"))
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    target = models.CharField(max_length=32, choices=TARGETS)
+    target_id = models.PositiveIntegerField()
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    checksum = models.BigIntegerField(default=0)
+    created_on = models.DateTimeField(auto_now_add=True)
+    expires_on = models.DateTimeField()
+
+    @property
+    def part_path(self):
+        return os.path.join(settings.UPLOAD_SESSIONS_DIR, f"{self.id}.part")
+
+    def discard(self):
+        if os.path.exists(self.part_path):
+            os.remove(self.part_path)
+        self.delete()
+
+    def __str__(self):
+        return f"Upload of {self.filename} ({self.offset}/{self.size})"
+
+
+class StoredBlob(models.Model):
+    """A file content stored once by ContentAddressedStorage, with the number of files referencing it."""
+    digest = models.CharField(max_length=64, primary_key=True)
+    size = models.BigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    created_on = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Blob {self.digest} ({self.refcount} refs)"
+
+
+class RevokedToken(models.Model):
+    """Denylisted signed token (by its "jti" claim) until it expires, shared by all workers."""
+    jti = models.CharField(max_length=32, primary_key=True)
+    token_type = models.CharField(max_length=7)  # "access" or "refresh"
+    expires_on = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"Revoked token {self.jti}"
+
+
+class Job(models.Model):
+    """
+    Background job of the database queue (elearn_app.jobs), run by "manage.py run_jobs" workers.
+    A job with an idempotency key is enqueued once; failed attempts are retried after a growing delay.
+    """
+    PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+    STATUSES = ((PENDING, PENDING), (RUNNING, RUNNING), (DONE, DONE), (FAILED, FAILED))
+
+    name = models.CharField(max_length=128)
+    payload = models.TextField(default="{}")  # JSON of the job function's keyword arguments
+    idempotency_key = models.CharField(max_length=255, unique=True, null=True, blank=True)
+    status = models.CharField(max_length=16, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField()
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)  # lease of the running attempt
+    last_error = models.TextField(blank=True)
+    created_on = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "run_after"], name="job_status_run_after_idx")]
+
+    def __str__(self):
+        return f"Job {self.name} ({self.status})"
@@ -0,0 +1,24 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Keyset pagination by the primary key: every page is a single indexed range query, no OFFSET scans.
+    Page size cap can be set per endpoint (router basename) in settings.PAGINATION_MAX_PAGE_SIZES.
+    """
+    ordering = "id"
+    page_size_query_param = "page_size"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.max_page_size = self._get_max_page_size(view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def _get_max_page_size(self, view):
+        max_page_sizes = getattr(settings, "PAGINATION_MAX_PAGE_SIZES", {})
+        basename = getattr(view, "basename", None)
+        return max_page_sizes.get(basename, getattr(settings, "PAGINATION_MAX_PAGE_SIZE", None))
+
+
+class CreatedOnCursorPagination(IdCursorPagination):
+    ordering = ("created_on", "id")
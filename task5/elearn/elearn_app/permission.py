@@ -1,16 +1,10 @@
-from django.contrib.auth.models import Group
 from rest_framework import permissions
 
-
-def _is_in_group(user, group_name):
-    try:
-        return Group.objects.get(name=group_name).user_set.filter(id=user.id).exists()
-    except Group.DoesNotExist:
-        return None
+from .roles import has_role
 
 
 def _has_group_permission(user, required_groups):
-    return any([_is_in_group(user, group_name) for group_name in required_groups])
+    return any(has_role(user, group_name) for group_name in required_groups)
 
 
 class IsSuperuser(permissions.BasePermission):
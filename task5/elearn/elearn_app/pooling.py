@@ -0,0 +1,254 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from django.db import OperationalError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL = {
+    "MAX_SIZE": 10,  # open connections per process and database
+    "MAX_LIFETIME": 30 * 60,  # seconds, then a connection is closed when returned (or found idle)
+    "TIMEOUT": 10,  # seconds to wait for a free connection
+}
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+def ping(connection):
+    """Checkout health check of DB-API connections. Leaves no transaction open."""
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT 1")
+    finally:
+        cursor.close()
+    connection.rollback()
+
+
+def rollback(connection):
+    """Default reset of returned connections: their transaction is rolled back."""
+    connection.rollback()
+
+
+def discard_all(connection):
+    """
+    Reset of returned PostgreSQL (psycopg2) connections: their transaction is rolled back and their session
+    state (SET parameters, prepared statements, temporary tables, advisory locks, LISTENs) discarded.
+    """
+    connection.rollback()
+    autocommit = connection.autocommit
+    connection.autocommit = True  # DISCARD ALL can't run in a transaction
+    try:
+        cursor = connection.cursor()
+        try:
+            cursor.execute("DISCARD ALL")
+        finally:
+            cursor.close()
+    finally:
+        connection.autocommit = autocommit
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of at most max_size DB-API connections made by connect().
+    Idle connections are checked with check() when acquired, reset with reset() when released, and closed
+    instead of being reused when older than max_lifetime seconds. acquire() waits up to timeout seconds for a free connection.
+    """
+
+    def __init__(self, connect, max_size, max_lifetime, timeout, check=ping, reset=rollback):
+        self.connect = connect
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self.check = check
+        self.reset = reset
+        self._condition = threading.Condition()
+        self._idle = deque()  # (connection, created on); the most recently used at the right
+        self._created_on = {}  # id(connection): created on, of open connections
+        self._opening = 0
+        self._stats = {"waits": 0, "wait_seconds": 0.0, "timeouts": 0, "created": 0, "closed": 0, "failed_checks": 0}
+
+    def acquire(self):
+        while True:
+            with self._condition:
+                connection = self._take_idle_or_reserve()
+            if connection is None:
+                return self._open()
+            try:
+                self.check(connection)
+            except Exception:
+                logger.info("Pooled connection failed the health check, replaced.")
+                with self._condition:
+                    self._stats["failed_checks"] += 1
+                self.discard(connection)
+                continue
+            return connection
+
+    def _open_count(self):
+        return len(self._created_on) + self._opening
+
+    def _take_idle_or_reserve(self):
+        """
+        Returns an idle connection, or None after reserving a place for a new one.
+        Waits while all connections are in use. Called with the condition held.
+        """
+        start = None
+        try:
+            while True:
+                while self._idle:
+                    connection, created_on = self._idle.pop()
+                    if time.monotonic() - created_on < self.max_lifetime:
+                        return connection
+                    self._close(connection)
+                if self._open_count() < self.max_size:
+                    self._opening += 1
+                    return None
+
+                now = time.monotonic()
+                if start is None:
+                    start = now
+                    self._stats["waits"] += 1
+                remaining = start + self.timeout - now
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"No free connection in the pool of {self.max_size} in {self.timeout}s.")
+                self._condition.wait(remaining)
+        finally:
+            if start is not None:
+                self._stats["wait_seconds"] += time.monotonic() - start
+
+    def _open(self):
+        try:
+            connection = self.connect()
+        except BaseException:
+            with self._condition:
+                self._opening -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._opening -= 1
+            self._created_on[id(connection)] = time.monotonic()
+            self._stats["created"] += 1
+        return connection
+
+    def release(self, connection):
+        """Returns the connection to the pool once reset, or closes it if it's unusable or old."""
+        with self._condition:
+            created_on = self._created_on.get(id(connection))
+        if created_on is None:  # not from this pool, or already released and closed
+            return
+        try:
+            self.reset(connection)
+        except Exception:
+            logger.info("Pooled connection failed the reset, closed.")
+            self.discard(connection)
+            return
+        if time.monotonic() - created_on >= self.max_lifetime:
+            self.discard(connection)
+            return
+        with self._condition:
+            self._idle.append((connection, created_on))
+            self._condition.notify()
+
+    def discard(self, connection):
+        """Closes the (acquired) connection instead of returning it."""
+        with self._condition:
+            self._close(connection)
+            self._condition.notify()
+
+    def _close(self, connection):
+        """Called with the condition held."""
+        self._created_on.pop(id(connection), None)
+        self._stats["closed"] += 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close_idle(self):
+        with self._condition:
+            while self._idle:
+                self._close(self._idle.pop()[0])
+
+    def get_stats(self):
+        with self._condition:
+            return {
+                "max_size": self.max_size,
+                "open": len(self._created_on),
+                "in_use": len(self._created_on) - len(self._idle),
+                "idle": len(self._idle),
+                **self._stats,
+            }
+
+
+_pools = {}  # (pid, alias, database, connection parameters): ConnectionPool
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, database, conn_params, connect, options, reset=rollback):
+    """The pool of the process for the database alias and connection parameters (e.g. test databases get theirs)."""
+    key = (os.getpid(), alias, database, repr(sorted(conn_params.items())))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            options = {**DEFAULT_POOL, **options}
+            pool = _pools[key] = ConnectionPool(
+                connect, options["MAX_SIZE"], options["MAX_LIFETIME"], options["TIMEOUT"], reset=reset,
+            )
+        return pool
+
+
+def get_pools_stats():
+    """{(alias, database): stats} of the pools of this process."""
+    pid = os.getpid()
+    with _pools_lock:
+        pools = [((alias, database), pool) for (pool_pid, alias, database, _), pool in _pools.items() if pool_pid == pid]
+    return {key: pool.get_stats() for key, pool in pools}
+
+
+def close_pools(database=None):
+    """Closes the idle connections of the pools (of the database), e.g. before dropping it."""
+    with _pools_lock:
+        pools = [pool for (_, _, pool_database, _), pool in _pools.items() if database in {None, pool_database}]
+    for pool in pools:
+        pool.close_idle()
+
+
+class PooledDatabaseWrapperMixin:
+    """
+    Database backend wrapper getting connections from the process's pool instead of opening them,
+    and returning them on close() (at the end of requests with CONN_MAX_AGE = 0).
+    Pool options are the "POOL" dict of the database settings (see DEFAULT_POOL), connections are reset
+    with pool_reset when returned.
+    """
+
+    pool_reset = staticmethod(rollback)
+
+    def _get_pool(self, conn_params):
+        return get_pool(
+            self.alias, self.settings_dict["NAME"], conn_params,
+            lambda: super(PooledDatabaseWrapperMixin, self).get_new_connection(conn_params),
+            self.settings_dict.get("POOL", {}), self.pool_reset,
+        )
+
+    def get_new_connection(self, conn_params):
+        self._pool = self._get_pool(conn_params)
+        return self._pool.acquire()
+
+    def _close(self):
+        if self.connection is None:
+            return
+        if self.in_atomic_block:
+            self._pool.discard(self.connection)  # still referenced until the atomic block exits
+        else:
+            self._pool.release(self.connection)
+
+
+class PooledDatabaseCreationMixin:
+    def _destroy_test_db(self, test_database_name, verbosity):
+        close_pools(test_database_name)  # pooled connections would prevent dropping it
+        super()._destroy_test_db(test_database_name, verbosity)
@@ -0,0 +1,179 @@
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils.functional import SimpleLazyObject, empty
+from rest_framework.permissions import SAFE_METHODS
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = "db_primary_pin"
+
+# State of the current request: reads go to replicas unless it's pinned to the primary.
+# Outside requests (management commands, jobs workers) there is no state and everything goes to the primary.
+_request_state = ContextVar("replicas_request_state", default=None)
+
+_LAG_SQL = {
+    # Not streaming (or silent for longer than the receiver's timeout) or nothing replayed yet: unavailable (NULL).
+    # Replayed everything received: no lag, even if the primary had no writes for a while.
+    "postgresql": """
+        SELECT CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN receiver.status IS DISTINCT FROM 'streaming' THEN NULL
+            WHEN current_setting('wal_receiver_timeout') <> '0'
+                AND receiver.last_msg_receipt_time < now() - current_setting('wal_receiver_timeout')::interval THEN NULL
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+        END
+        FROM (SELECT 1) AS one LEFT JOIN pg_stat_wal_receiver AS receiver ON true
+    """,
+}
+
+
+class RequestState:
+    def __init__(self, request, pinned):
+        self.request = request
+        self.pinned = pinned
+        self.wrote = False
+        self.user_id = None
+
+
+def _get_pins_cache():
+    return caches[settings.DATABASE_PRIMARY_PIN_CACHE_ALIAS]
+
+
+def _pin_key(user_id):
+    return f"replicas:pin:{user_id}"
+
+
+def _get_user_id(request):
+    """Id of the request's user if it's already authenticated (never authenticates, i.e. queries, for it)."""
+    user = request.__dict__.get("user")  # set by the authentication middleware (lazily) and by DRF views
+    if isinstance(user, SimpleLazyObject):
+        user = None if user._wrapped is empty else user._wrapped
+    if user is None or not user.is_authenticated:
+        return None
+    return user.pk
+
+
+def _is_pinned(state):
+    """Checks the pin of the request's user once it's authenticated: other clients of the user read their writes."""
+    if not state.pinned and state.user_id is None:
+        state.user_id = _get_user_id(state.request)
+        if state.user_id is not None:
+            state.pinned = _get_pins_cache().get(_pin_key(state.user_id)) is not None
+    return state.pinned
+
+
+def reads_from_replicas():
+    """Whether reads of the current request may go to replicas (i.e. see data up to DATABASE_REPLICA_MAX_LAG old)."""
+    state = _request_state.get()
+    return state is not None and not state.pinned and bool(settings.DATABASE_REPLICAS)
+
+
+class ReplicaHealth:
+    """Replication lag of the replicas, checked at most every settings.DATABASE_REPLICA_CHECK_INTERVAL per process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checks = {}  # alias: (checked on, healthy)
+
+    def is_healthy(self, alias):
+        now = time.monotonic()
+        checked_on, healthy = self._checks.get(alias, (None, False))
+        if checked_on is not None and now - checked_on < settings.DATABASE_REPLICA_CHECK_INTERVAL:
+            return healthy
+
+        with self._lock:
+            checked_on, healthy = self._checks.get(alias, (None, False))
+            if checked_on is None or now - checked_on >= settings.DATABASE_REPLICA_CHECK_INTERVAL:
+                lag = self.get_lag(alias)
+                healthy = lag is not None and lag <= settings.DATABASE_REPLICA_MAX_LAG
+                if not healthy:
+                    logger.warning("Replica %s is not used: %s.", alias,
+                                   "unavailable" if lag is None else f"{lag:.1f}s behind")
+                self._checks[alias] = (time.monotonic(), healthy)
+        return healthy
+
+    @staticmethod
+    def get_lag(alias):
+        """Seconds the replica is behind the primary, None if it's unavailable."""
+        connection = connections[alias]
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(_LAG_SQL.get(connection.vendor, "SELECT 0"))
+                lag = cursor.fetchone()[0]
+        except DatabaseError:
+            connection.close()
+            return None
+        return None if lag is None else float(lag)
+
+
+class ReplicaRouter:
+    """
+    Reads of GET/HEAD/OPTIONS requests go to a healthy replica of settings.DATABASE_REPLICAS, everything else
+    to the primary (default). Requests are pinned to the primary from their first write, inside transactions
+    and for settings.DATABASE_PRIMARY_PIN_SECONDS after a write of the same client or user (see ReplicaPinMiddleware).
+    """
+
+    health = ReplicaHealth()
+
+    def db_for_read(self, model, **hints):
+        state = _request_state.get()
+        if state is None or _is_pinned(state) or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        replicas = [alias for alias in settings.DATABASE_REPLICAS if self.health.is_healthy(alias)]
+        if not replicas:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False  # replicated from the primary
+        return None
+
+
+class ReplicaPinMiddleware:
+    """
+    Sets the request state of ReplicaRouter: unsafe methods, clients with the pin cookie and users with a pin
+    (in the DATABASE_PRIMARY_PIN_CACHE_ALIAS cache) use the primary. Requests that wrote set the pin cookie
+    and the user's pin, so the next reads of the client, or of any client of the user (e.g. with tokens
+    and no cookies), see the writes while the replicas catch up.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        state = RequestState(request, pinned=request.method not in SAFE_METHODS or PIN_COOKIE in request.COOKIES)
+        token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        if state.wrote:
+            response.set_cookie(PIN_COOKIE, "1", max_age=settings.DATABASE_PRIMARY_PIN_SECONDS, httponly=True)
+            user_id = _get_user_id(request)
+            if user_id is not None:
+                _get_pins_cache().set(_pin_key(user_id), 1, settings.DATABASE_PRIMARY_PIN_SECONDS)
+        return response
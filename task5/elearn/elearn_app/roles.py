@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.core.cache import caches
+
+SUPERUSERS = "superusers"
+TEACHERS = "teachers"
+STUDENTS = "students"
+
+_ROLES_CACHE_KEY = "elearn:roles:{}"
+
+
+def _get_roles_cache():
+    return caches[getattr(settings, "ROLES_CACHE_ALIAS", "default")]
+
+
+def _load_user_roles(user):
+    timeout = getattr(settings, "ROLES_CACHE_TIMEOUT", None)
+    if not timeout:
+        return frozenset(user.groups.values_list("name", flat=True))
+
+    cache = _get_roles_cache()
+    key = _ROLES_CACHE_KEY.format(user.pk)
+    roles = cache.get(key)
+    if roles is None:
+        roles = frozenset(user.groups.values_list("name", flat=True))
+        cache.set(key, roles, timeout)
+    return roles
+
+
+def get_user_roles(user):
+    """
+    Returns the set of group names of the user.
+    The set is loaded once and memoized on the user object, so it lives as long as the request does.
+    """
+    if not user or not user.is_authenticated:
+        return frozenset()
+
+    roles = getattr(user, "_roles", None)
+    if roles is None:
+        roles = _load_user_roles(user)
+        user._roles = roles
+    return roles
+
+
+def has_role(user, role):
+    return role in get_user_roles(user)
+
+
+def invalidate_user_roles(user_ids):
+    if getattr(settings, "ROLES_CACHE_TIMEOUT", None):
+        _get_roles_cache().delete_many([_ROLES_CACHE_KEY.format(user_id) for user_id in user_ids])
@@ -0,0 +1,113 @@
+import re
+
+from django.db import NotSupportedError, connection, connections
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+
+from .access import visible_lectures, visible_homeworks, visible_comments
+
+SEARCH_CONFIG = "english"  # text search configuration of the tsvector triggers (migration 0008)
+
+# type: (visible queryset of the user, rendered fields, searched columns with their SQLite bm25 weights).
+# PostgreSQL weights are set by the triggers: A (1.0) for titles, B (0.4) for texts.
+SEARCH_TYPES = {
+    "lecture": (visible_lectures, ("id", "course_id", "title"), (1.0,)),
+    "homework": (visible_homeworks, ("id", "course_id", "lecture_id", "title"), (1.0, 0.4)),
+    "comment": (visible_comments, ("id", "homework_instance_id", "author_id", "body"), (0.4,)),
+}
+
+
+def _get_terms(query):
+    return re.findall(r"\w+", query)
+
+
+def _postgresql_search(queryset, terms, weights):
+    column = f"{queryset.model._meta.db_table}.search_vector"
+    ts_query = "plainto_tsquery(%s, %s)"
+    params = [SEARCH_CONFIG, " ".join(terms)]
+    return queryset.filter(
+        RawSQL(f"{column} @@ {ts_query}", params, output_field=BooleanField())
+    ).annotate(rank=RawSQL(f"ts_rank({column}, {ts_query})", params, output_field=FloatField()))
+
+
+def _sqlite_search(queryset, terms, weights):
+    table = queryset.model._meta.db_table
+    # Quoted terms: FTS5 query syntax (operators, columns) of user input is matched as plain words.
+    params = [" ".join(f"\"{term}\"" for term in terms)]
+    bm25_weights = "".join(f", {weight}" for weight in weights)
+    return queryset.filter(
+        RawSQL(f"{table}.id IN (SELECT rowid FROM {table}_fts WHERE {table}_fts MATCH %s)", params,
+               output_field=BooleanField())
+    ).annotate(rank=RawSQL(
+        f"(SELECT -bm25({table}_fts{bm25_weights}) FROM {table}_fts WHERE {table}_fts MATCH %s AND rowid = {table}.id)",
+        params, output_field=FloatField(),
+    ))
+
+
+# Searched columns by table of the SQLite FTS5 tables (migration 0008).
+SQLITE_SEARCHED_COLUMNS = {
+    "elearn_app_lecture": ("title",),
+    "elearn_app_homework": ("title", "text"),
+    "elearn_app_homeworkinstancecomment": ("body",),
+}
+
+
+def _sqlite_triggers_sql(table, columns):
+    names = ", ".join(columns)
+    new_values = ", ".join(f"new.{column}" for column in columns)
+    old_values = ", ".join(f"old.{column}" for column in columns)
+    delete = f"INSERT INTO {table}_fts ({table}_fts, rowid, {names}) VALUES ('delete', old.id, {old_values});"
+    insert = f"INSERT INTO {table}_fts (rowid, {names}) VALUES (new.id, {new_values});"
+    return {
+        f"{table}_fts_insert": f"AFTER INSERT ON {table} BEGIN {insert} END",
+        f"{table}_fts_delete": f"AFTER DELETE ON {table} BEGIN {delete} END",
+        f"{table}_fts_update": f"AFTER UPDATE OF {names} ON {table} BEGIN {delete} {insert} END",
+    }
+
+
+def create_sqlite_triggers(using="default", **kwargs):
+    """
+    post_migrate handler recreating the FTS triggers that SQLite table rebuilds (Django's ALTER) drop,
+    and rebuilding the index of the tables that missed them.
+    """
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT type, name FROM sqlite_master WHERE type IN ('table', 'trigger')")
+        existing = set(cursor.fetchall())
+        for table, columns in SQLITE_SEARCHED_COLUMNS.items():
+            if ("table", f"{table}_fts") not in existing:
+                continue  # not migrated (yet or anymore)
+            missing = {
+                name: sql for name, sql in _sqlite_triggers_sql(table, columns).items()
+                if ("trigger", name) not in existing
+            }
+            for name, sql in missing.items():
+                cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {sql}")
+            if missing:
+                cursor.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')")
+
+
+_backends = {"postgresql": _postgresql_search, "sqlite": _sqlite_search}
+
+
+def search(user, query, types=None, limit=20):
+    """
+    Ranked full-text search of the lectures, homeworks and comments visible to the user.
+    Returns the best "limit" results as [{"type", "rank", **fields}]. Ranks of different types are
+    comparable on PostgreSQL only (bm25 scores are relative to their table on SQLite).
+    """
+    backend = _backends.get(connection.vendor)
+    if backend is None:
+        raise NotSupportedError(f"Full-text search isn't supported on {connection.vendor}.")
+    terms = _get_terms(query)
+    if not terms:
+        return []
+
+    results = []
+    for search_type in types or SEARCH_TYPES:
+        get_visible, fields, weights = SEARCH_TYPES[search_type]
+        queryset = backend(get_visible(user), terms, weights).order_by("-rank", "-id").values(*fields, "rank")
+        results += [{"type": search_type, **result} for result in queryset[:limit]]
+    return sorted(results, key=lambda result: result["rank"], reverse=True)[:limit]
@@ -1,12 +1,104 @@
+import csv
+import io
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Prefetch
+from django.db.models.signals import m2m_changed
+from django.utils import timezone
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.reverse import reverse
 from rest_framework.validators import UniqueValidator
 
+from .access import courses_ids
+from .jobs import enqueue_many, mark_notification_key
 from .models import (
-    User, Group, Course, Lecture, Homework, HomeworkInstance, HomeworkInstanceComment, HomeworkInstanceMark
+    User, Group, Course, Lecture, Homework, HomeworkInstance, HomeworkInstanceComment, HomeworkInstanceMark,
+    UploadSession
 )
+from .roles import TEACHERS, STUDENTS, has_role
+
+
+def _get_list_param(request, name):
+    value = request.query_params.get(name) if request is not None else None
+    if value is None:
+        return None
+    return {item.strip() for item in value.split(",") if item.strip()}
+
+
+class SparseFieldsMixin:
+    """
+    ?fields=a,b renders only the listed fields; ?expand=a,b renders the listed expandable_fields
+    (foreign keys) as nested objects instead of ids, on reads. Both apply to the top-level serializer only.
+    Fields left out are neither computed nor loaded: views pass their queryset through setup_eager_loading().
+    """
+    expandable_fields = {}  # field name: serializer class of the nested object
+
+    @staticmethod
+    def get_prefetched_fields():
+        """{field name: Prefetch/lookup needed to render it}."""
+        return {}
+
+    @classmethod
+    def get_requested_fields(cls, request):
+        """Returns (rendered fields, None for all of them; expanded fields)."""
+        fields = _get_list_param(request, "fields")
+        expand = set()
+        if request is not None and request.method in SAFE_METHODS:
+            expand = (_get_list_param(request, "expand") or set()) & set(cls.expandable_fields)
+        if fields is not None:
+            expand &= fields
+        return fields, expand
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, request=None):
+        fields, expand = cls.get_requested_fields(request)
+        if expand:
+            queryset = queryset.select_related(*sorted(expand))
+        prefetches = [
+            prefetch for field_name, prefetch in cls.get_prefetched_fields().items()
+            if fields is None or field_name in fields
+        ]
+        return queryset.prefetch_related(*prefetches) if prefetches else queryset
+
+    def _get_requested_fields(self):
+        if not hasattr(self, "_requested_fields"):
+            parent = self.parent.parent if isinstance(self.parent, serializers.ListSerializer) else self.parent
+            if parent is None:
+                self._requested_fields = self.get_requested_fields(self.context.get("request"))
+            else:
+                self._requested_fields = None, set()
+        return self._requested_fields
+
+    def get_fields(self):
+        fields = super().get_fields()
+        for field_name in self._get_requested_fields()[1]:
+            fields[field_name] = self.expandable_fields[field_name](read_only=True)
+        return fields
+
+    @property
+    def _readable_fields(self):
+        requested = self._get_requested_fields()[0]
+        for field in super()._readable_fields:
+            if requested is None or field.field_name in requested:
+                yield field
+
+
+class UserSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ("id", "email", "first_name", "last_name")
 
 
-class UserSerializer(serializers.Serializer):
+class CourseSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Course
+        fields = ("id", "title")
+
+
+class UserSerializer(SparseFieldsMixin, serializers.Serializer):
     id = serializers.IntegerField(label="ID", required=False)
     email = serializers.EmailField(
         max_length=40, required=True, validators=[UniqueValidator(queryset=User.objects.all())]
@@ -27,6 +119,10 @@ class UserSerializer(serializers.Serializer):
         else:
             return value
 
+    @staticmethod
+    def get_prefetched_fields():
+        return {"user_group": "groups"}
+
     def get_user_group(self, obj):
         return str(obj.groups.all()[0])
 
@@ -44,13 +140,46 @@ class UserSerializer(serializers.Serializer):
         return user
 
 
-class CourseSerializer(serializers.ModelSerializer):
+def _resolve_users_emails(emails, group):
+    """
+    Resolves all emails with one query.
+    Returns ({email: id} of users of the group, unknown emails, emails of users not in the group).
+    """
+    emails = list(dict.fromkeys(emails))
+    users_groups = {}
+    for user_id, email, group_name in User.objects.filter(email__in=emails).values_list("id", "email", "groups__name"):
+        users_groups.setdefault(email, (user_id, set()))[1].add(group_name)
+
+    users_ids, unknown_emails, wrong_role_emails = {}, [], []
+    for email in emails:
+        if email not in users_groups:
+            unknown_emails.append(email)
+        elif group not in users_groups[email][1]:
+            wrong_role_emails.append(email)
+        else:
+            users_ids[email] = users_groups[email][0]
+    return users_ids, unknown_emails, wrong_role_emails
+
+
+class TokenRefreshSerializer(serializers.Serializer):
+    refresh = serializers.CharField()
+
+
+class CourseSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     teachers_emails = serializers.ListField(write_only=True, required=False)
     students_emails = serializers.ListField(write_only=True, required=False)
 
     course_teachers = serializers.SerializerMethodField()
     course_students = serializers.SerializerMethodField()
 
+    @staticmethod
+    def get_prefetched_fields():
+        members = User.objects.only("id", "email")
+        return {
+            "course_teachers": Prefetch("teachers", queryset=members),
+            "course_students": Prefetch("students", queryset=members),
+        }
+
     def get_course_teachers(self, obj):
         return [str(teacher) for teacher in obj.teachers.all()]
 
@@ -71,25 +200,22 @@ class CourseSerializer(serializers.ModelSerializer):
         }
 
     def validate_teachers_emails(self, value):
-        try:
-            users_querysets = []
-            for email_as_text in value:
-                users_querysets.append(User.objects.get(email=email_as_text, groups__name="teachers"))
-        except User.DoesNotExist:
-            raise serializers.ValidationError({"teachers_email": [f"Teacher with email {email_as_text} not exists."]})
-        else:
-            return users_querysets
+        users_ids, unknown_emails, wrong_role_emails = _resolve_users_emails(value, TEACHERS)
+        not_teachers_emails = unknown_emails + wrong_role_emails
+        if not_teachers_emails:
+            raise serializers.ValidationError({"teachers_email": [
+                f"Teacher with email {email_as_text} not exists." for email_as_text in not_teachers_emails
+            ]})
+        return list(users_ids.values())
 
     def validate_students_emails(self, value):
-        try:
-            users_querysets = []
-            for email_as_text in value:
-                users_querysets.append(User.objects.get(email=email_as_text, groups__name="students"))
-        except User.DoesNotExist:
-            raise serializers.ValidationError({"students_email": [f"Student with email {email_as_text} not exists."]})
-        else:
-            return users_querysets
-
+        users_ids, unknown_emails, wrong_role_emails = _resolve_users_emails(value, STUDENTS)
+        not_students_emails = unknown_emails + wrong_role_emails
+        if not_students_emails:
+            raise serializers.ValidationError({"students_email": [
+                f"Student with email {email_as_text} not exists." for email_as_text in not_students_emails
+            ]})
+        return list(users_ids.values())
 
     def create(self, validated_data):
         user = self.context["request"].user
@@ -124,8 +250,108 @@ class CourseSerializer(serializers.ModelSerializer):
         return instance
 
 
-class LectureSerializer(serializers.ModelSerializer):
+class CourseMembersSerializer(serializers.Serializer):
+    """
+    Adds/removes course members in bulk. Emails come as "add"/"remove" lists or as a CSV "file"
+    with rows "email[,add|remove]" (the file is read line by line).
+    """
+    role = serializers.ChoiceField(choices=(TEACHERS, STUDENTS))
+    add = serializers.ListField(child=serializers.EmailField(), required=False, default=list)
+    remove = serializers.ListField(child=serializers.EmailField(), required=False, default=list)
+    file = serializers.FileField(required=False, write_only=True)
+
+    def _read_csv(self, file):
+        add, remove = [], []
+        for row in csv.reader(io.TextIOWrapper(file, encoding="utf-8-sig")):
+            if not row or not row[0].strip():
+                continue
+            email, action = row[0].strip(), (row[1].strip().lower() if len(row) > 1 else "add")
+            if action == "add":
+                add.append(email)
+            elif action == "remove":
+                remove.append(email)
+            else:
+                raise serializers.ValidationError({"file": [f"Unknown action {action} for {email}."]})
+        return add, remove
+
+    def validate(self, attrs):
+        add, remove = list(attrs["add"]), list(attrs["remove"])
+        if "file" in attrs:
+            file_add, file_remove = self._read_csv(attrs.pop("file"))
+            add += file_add
+            remove += file_remove
+
+        conflicting_emails = set(add) & set(remove)
+        if conflicting_emails:
+            raise serializers.ValidationError({"detail": [
+                f"Emails are both added and removed: {', '.join(sorted(conflicting_emails))}."
+            ]})
+
+        users_ids, unknown_emails, wrong_role_emails = _resolve_users_emails(add + remove, attrs["role"])
+        if unknown_emails or wrong_role_emails:
+            raise serializers.ValidationError({
+                "unknown_emails": unknown_emails,
+                "wrong_role_emails": wrong_role_emails,
+            })
+
+        attrs["add"] = {users_ids[email] for email in add}
+        attrs["remove"] = {users_ids[email] for email in remove}
+        return attrs
+
+    def apply(self, course):
+        """
+        Applies only the difference to the course members "through" table.
+        m2m_changed signals are sent as Course.<role>.add()/remove() would do.
+        """
+        role = self.validated_data["role"]
+        through = getattr(Course, role).through
+        add_ids, remove_ids = self.validated_data["add"], self.validated_data["remove"]
+
+        with transaction.atomic():
+            existing_ids = set(
+                through.objects.filter(course_id=course.id, user_id__in=add_ids | remove_ids)
+                .values_list("user_id", flat=True)
+            )
+            added_ids = add_ids - existing_ids
+            removed_ids = remove_ids & existing_ids
+
+            if added_ids:
+                self._send_m2m_changed(through, course, "pre_add", added_ids)
+                through.objects.bulk_create([through(course_id=course.id, user_id=user_id) for user_id in added_ids])
+                self._send_m2m_changed(through, course, "post_add", added_ids)
+
+            if removed_ids:
+                self._send_m2m_changed(through, course, "pre_remove", removed_ids)
+                through.objects.filter(course_id=course.id, user_id__in=removed_ids).delete()
+                self._send_m2m_changed(through, course, "post_remove", removed_ids)
+
+        return {"role": role, "added": len(added_ids), "removed": len(removed_ids)}
+
+    @staticmethod
+    def _send_m2m_changed(through, course, action, pk_set):
+        m2m_changed.send(
+            sender=through, instance=course, action=action,
+            reverse=False, model=User, pk_set=pk_set, using=router.db_for_write(Course, instance=course)
+        )
+
+
+class DownloadFileField(serializers.FileField):
+    """Uploaded file, rendered as the URL of the access-checked download action (media files aren't served)."""
+
+    def __init__(self, view_name, **kwargs):
+        self.view_name = view_name
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        return reverse(self.view_name, args=[value.instance.pk], request=self.context.get("request"))
+
+
+class LectureSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    file = DownloadFileField("lecture-download")
     course_name = serializers.CharField(write_only=True, required=False)
+    expandable_fields = {"course": CourseSummarySerializer}
 
     class Meta:
         model = Lecture
@@ -192,7 +418,9 @@ class LectureSerializer(serializers.ModelSerializer):
         return instance
 
 
-class HomeworkSerializer(serializers.ModelSerializer):
+class HomeworkSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = {"lecture": LectureSerializer}
+
     class Meta:
         model = Homework
         fields = ("id", "title", "text", "lecture")
@@ -229,7 +457,9 @@ class HomeworkSerializer(serializers.ModelSerializer):
         return instance
 
 
-class HomeworkInstanceSerializer(serializers.ModelSerializer):
+class HomeworkInstanceSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    file = DownloadFileField("homework-instance-download", required=False, allow_null=True)
+    expandable_fields = {"homework": HomeworkSerializer, "student": UserSummarySerializer}
 
     class Meta:
         model = HomeworkInstance
@@ -287,7 +517,9 @@ class HomeworkInstanceSerializer(serializers.ModelSerializer):
         return instance
 
 
-class HomeworkInstanceCommentSerializer(serializers.ModelSerializer):
+class HomeworkInstanceCommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = {"homework_instance": HomeworkInstanceSerializer, "author": UserSummarySerializer}
+
     class Meta:
         model = HomeworkInstanceComment
 
@@ -302,13 +534,13 @@ class HomeworkInstanceCommentSerializer(serializers.ModelSerializer):
     def _get_author(self, homework_instance):
         user = self.context["request"].user
 
-        if user.groups.filter(name="students").exists():
+        if has_role(user, STUDENTS):
             if homework_instance.student == user:
                 return user
             else:
                 raise serializers.ValidationError({"detail": ["Access denied. Wrong auth student."]})
 
-        elif user.groups.filter(name="teachers").exists():
+        elif has_role(user, TEACHERS):
             if homework_instance.homework.lecture.course.teachers.filter(email=user).exists():
                 return user
             else:
@@ -345,7 +577,9 @@ class HomeworkInstanceCommentSerializer(serializers.ModelSerializer):
         return instance
 
 
-class HomeworkInstanceMarkSerializer(serializers.ModelSerializer):
+class HomeworkInstanceMarkSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = {"homework_instance": HomeworkInstanceSerializer}
+
     class Meta:
         model = HomeworkInstanceMark
         fields = ("id", "mark", "homework_instance")
@@ -385,3 +619,123 @@ class HomeworkInstanceMarkSerializer(serializers.ModelSerializer):
         instance.mark = validated_data.get("mark", instance.mark)
         instance.save()
         return instance
+
+
+class HomeworkInstanceMarkRowSerializer(serializers.Serializer):
+    homework_instance = serializers.IntegerField()
+    mark = serializers.IntegerField(allow_null=True)
+
+    def validate_mark(self, value):
+        if value is not None and not (0 <= value <= 100):
+            raise serializers.ValidationError("Mark value must be in [0:100]")
+        return value
+
+
+class HomeworkInstanceMarksBulkSerializer(serializers.Serializer):
+    """
+    Sets marks of many homework instances at once: {"marks": [{"homework_instance": id, "mark": mark}, ...]}.
+    Invalid rows are reported by index and skipped, unless "strict" is set: then nothing is written.
+    """
+    marks = serializers.ListField(allow_empty=False)  # rows are validated one by one in validate()
+    strict = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        user = self.context["request"].user
+        rows, errors = {}, []
+        for index, row in enumerate(attrs["marks"]):
+            row_serializer = HomeworkInstanceMarkRowSerializer(data=row)
+            if not row_serializer.is_valid():
+                errors.append({"index": index, "errors": row_serializer.errors})
+            elif row_serializer.validated_data["homework_instance"] in rows:
+                errors.append({"index": index, "errors": {"homework_instance": ["Duplicated homework instance."]}})
+            else:
+                rows[row_serializer.validated_data["homework_instance"]] = (index, row_serializer.validated_data["mark"])
+
+        allowed_ids = set(
+            HomeworkInstance.objects.filter(id__in=rows, course_id__in=courses_ids(user, TEACHERS))
+            .values_list("id", flat=True)
+        )
+        for homework_instance_id in set(rows) - allowed_ids:
+            index, _ = rows.pop(homework_instance_id)
+            errors.append({"index": index, "errors": {"detail": ["Access denied."]}})
+
+        errors.sort(key=lambda error: error["index"])
+        attrs["marks"] = {homework_instance_id: mark for homework_instance_id, (_, mark) in rows.items()}
+        attrs["errors"] = errors
+        return attrs
+
+    @property
+    def rejected(self):
+        return bool(self.validated_data["errors"]) and self.validated_data["strict"]
+
+    def apply(self):
+        """
+        Upserts the marks in one transaction: bulk_create() of the missing ones ignoring conflicts (marks created
+        meanwhile by concurrent requests), then bulk_update() of all the rows having another mark.
+        """
+        marks = self.validated_data["marks"]
+        with transaction.atomic():
+            previous_marks = dict(
+                HomeworkInstanceMark.objects.select_for_update().filter(homework_instance_id__in=marks)
+                .values_list("homework_instance_id", "mark")
+            )
+            created_ids = set(marks) - set(previous_marks)
+            HomeworkInstanceMark.objects.bulk_create([
+                HomeworkInstanceMark(homework_instance_id=homework_instance_id, mark=marks[homework_instance_id])
+                for homework_instance_id in created_ids
+            ], ignore_conflicts=True)
+
+            rows = list(HomeworkInstanceMark.objects.select_for_update().filter(homework_instance_id__in=marks))
+            changed = [row for row in rows if row.mark != marks[row.homework_instance_id]]
+            now = timezone.now()  # bulk_update() doesn't apply auto_now
+            for row in changed:
+                row.mark = marks[row.homework_instance_id]
+                row.updated_at = now
+            HomeworkInstanceMark.objects.bulk_update(changed, ["mark", "updated_at"])
+
+            # Bulk operations send no post_save: notifications of new values are enqueued as the receiver would do.
+            enqueue_many("notify_mark", [
+                ({"mark_id": row.id}, mark_notification_key(row)) for row in rows
+                if row.homework_instance_id in created_ids or row.mark != previous_marks[row.homework_instance_id]
+            ])
+
+        changed_ids = {row.homework_instance_id for row in changed}
+        return {
+            "created": len(created_ids - changed_ids),  # the changed ones were created meanwhile by others
+            "updated": len(changed),
+            "errors": self.validated_data["errors"],
+        }
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = ("id", "target", "target_id", "filename", "size", "offset", "checksum", "expires_on")
+        read_only_fields = ("offset", "checksum", "expires_on")
+
+    def validate_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError({"size": ["Size must be positive."]})
+        return value
+
+    def _check_users_permissions(self, target, target_id):
+        user = self.context["request"].user
+        if target == "lecture":
+            has_access = Lecture.objects.filter(id=target_id, course_id__in=courses_ids(user, TEACHERS)).exists()
+        else:
+            has_access = HomeworkInstance.objects.filter(id=target_id, student=user).exists()
+        if not has_access:
+            raise serializers.ValidationError({"detail": ["Access denied."]})
+
+    def create(self, validated_data):
+        self._check_users_permissions(validated_data["target"], validated_data["target_id"])
+        session = UploadSession(
+            owner=self.context["request"].user,
+            target=validated_data["target"],
+            target_id=validated_data["target_id"],
+            filename=validated_data["filename"],
+            size=validated_data["size"],
+            expires_on=timezone.now() + timedelta(seconds=settings.UPLOAD_SESSION_LIFETIME),
+        )
+        session.save()
+        return session
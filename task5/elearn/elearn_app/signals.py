@@ -0,0 +1,226 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .access import add_access, remove_access
+from .broker import get_broker, homework_instance_channel
+from .caching import bump_course_versions
+from .jobs import enqueue, mark_notification_key
+from .models import (
+    User, Course, CourseAccess, Lecture, Homework, HomeworkInstance, HomeworkInstanceMark, HomeworkInstanceComment,
+)
+from .roles import TEACHERS, STUDENTS, invalidate_user_roles
+from .serializers import HomeworkInstanceCommentSerializer
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in {"pre_clear", "post_add", "post_remove", "post_clear"}:
+        return
+
+    if not reverse:
+        instance.__dict__.pop("_roles", None)
+        invalidate_user_roles([instance.pk])
+    elif action == "pre_clear":
+        invalidate_user_roles(instance.user_set.values_list("id", flat=True))
+    elif pk_set:
+        invalidate_user_roles(pk_set)
+
+
+def _course_members_changed(role, instance, action, reverse, pk_set):
+    # Not reversed: instance is a course and pk_set are users ids. Reversed: vice versa.
+    if action == "post_add":
+        if reverse:
+            add_access(role, pk_set, [instance.pk])
+        else:
+            add_access(role, [instance.pk], pk_set)
+    elif action == "post_remove":
+        if reverse:
+            remove_access(role, course_ids=pk_set, user_ids=[instance.pk])
+        else:
+            remove_access(role, course_ids=[instance.pk], user_ids=pk_set)
+    elif action == "post_clear":
+        if reverse:
+            remove_access(role, user_ids=[instance.pk])
+        else:
+            remove_access(role, course_ids=[instance.pk])
+
+
+@receiver(m2m_changed, sender=Course.teachers.through)
+def course_teachers_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    _course_members_changed(TEACHERS, instance, action, reverse, pk_set)
+
+
+@receiver(m2m_changed, sender=Course.students.through)
+def course_students_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    _course_members_changed(STUDENTS, instance, action, reverse, pk_set)
+
+
+def _members_changed_courses_ids(sender, instance, action, reverse, pk_set):
+    if not reverse:
+        return [instance.pk]
+    elif action == "pre_clear":
+        return sender.objects.filter(user_id=instance.pk).values_list("course_id", flat=True)
+    return pk_set
+
+
+# Homeworks and homework instances store their course (denormalized): moves of lectures to other courses,
+# and of homeworks to lectures of other courses, are propagated to them. Cached responses of the course
+# they left are invalidated too (the current one is by bump_versions_on_course_content_change).
+
+@receiver(post_init, sender=Lecture)
+@receiver(post_init, sender=Homework)
+def remember_course(sender, instance, **kwargs):
+    instance._committed_course_id = instance.__dict__.get("course_id")  # None if deferred
+
+
+@receiver(post_save, sender=Lecture)
+@receiver(post_save, sender=Homework)
+def propagate_course_change(sender, instance, created, raw, **kwargs):
+    previous_course_id, instance._committed_course_id = instance._committed_course_id, instance.course_id
+    if created or raw or previous_course_id == instance.course_id:
+        return
+    if previous_course_id is not None:
+        bump_course_versions([previous_course_id])
+    now = timezone.now()
+    if sender is Lecture:
+        Homework.objects.filter(lecture_id=instance.id).exclude(course_id=instance.course_id).update(
+            course_id=instance.course_id, updated_at=now
+        )
+        instances = HomeworkInstance.objects.filter(homework__lecture_id=instance.id)
+    else:
+        instances = HomeworkInstance.objects.filter(homework_id=instance.id)
+    instances.exclude(course_id=instance.course_id).update(course_id=instance.course_id, updated_at=now)
+
+
+# Cached responses are invalidated by bumping versions of the changed courses.
+
+@receiver(m2m_changed, sender=Course.teachers.through)
+@receiver(m2m_changed, sender=Course.students.through)
+def bump_versions_on_members_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in {"post_add", "post_remove", "pre_clear"}:
+        bump_course_versions(_members_changed_courses_ids(sender, instance, action, reverse, pk_set))
+
+
+# Members are rendered with courses: their changes are changes of the courses (ETag/Last-Modified).
+
+@receiver(m2m_changed, sender=Course.teachers.through)
+@receiver(m2m_changed, sender=Course.students.through)
+def touch_courses_on_members_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in {"post_add", "post_remove", "pre_clear"}:
+        courses_ids = list(_members_changed_courses_ids(sender, instance, action, reverse, pk_set))
+        Course.objects.filter(id__in=courses_ids).update(updated_at=timezone.now())
+
+
+# Users are rendered with their courses (course_teachers/course_students): changes of their rendered fields,
+# and deletions (cascading to memberships without m2m_changed), change the courses.
+
+USER_RENDERED_FIELDS = ("email", "first_name", "last_name")
+
+
+def _get_rendered_fields(user):
+    return tuple(user.__dict__.get(field) for field in USER_RENDERED_FIELDS)  # deferred ones aren't saved
+
+
+@receiver(post_init, sender=User)
+def remember_rendered_fields(sender, instance, **kwargs):
+    instance._committed_rendered_fields = _get_rendered_fields(instance)
+
+
+def _touch_user_courses(user_id):
+    courses_ids = list(CourseAccess.objects.filter(user_id=user_id).values_list("course_id", flat=True).distinct())
+    if courses_ids:
+        bump_course_versions(courses_ids)
+        Course.objects.filter(id__in=courses_ids).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=User)
+def touch_courses_on_user_change(sender, instance, created, raw, **kwargs):
+    rendered_fields = _get_rendered_fields(instance)
+    previous_rendered_fields, instance._committed_rendered_fields = instance._committed_rendered_fields, rendered_fields
+    if not created and not raw and previous_rendered_fields != rendered_fields:
+        _touch_user_courses(instance.pk)
+
+
+@receiver(pre_delete, sender=User)
+def touch_courses_on_user_delete(sender, instance, **kwargs):
+    _touch_user_courses(instance.pk)
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def bump_versions_on_course_change(sender, instance, **kwargs):
+    bump_course_versions([instance.pk])
+
+
+@receiver(post_save, sender=Lecture)
+@receiver(post_delete, sender=Lecture)
+@receiver(post_save, sender=Homework)
+@receiver(post_delete, sender=Homework)
+def bump_versions_on_course_content_change(sender, instance, **kwargs):
+    bump_course_versions([instance.course_id])
+
+
+# Storage's files are referenced when Lecture/HomeworkInstance rows are saved with them, and released
+# when the rows are deleted or get another file: in the saving transaction, so a rollback undoes both.
+
+@receiver(post_init, sender=Lecture)
+@receiver(post_init, sender=HomeworkInstance)
+def remember_file_name(sender, instance, **kwargs):
+    instance._committed_file_name = instance.file.name
+
+
+@receiver(post_save, sender=Lecture)
+@receiver(post_save, sender=HomeworkInstance)
+def count_file_references(sender, instance, **kwargs):
+    previous_file_name = instance._committed_file_name
+    if previous_file_name != instance.file.name:
+        if instance.file:
+            instance.file.storage.reference(instance.file.name)
+        if previous_file_name:
+            instance.file.storage.delete(previous_file_name)
+    instance._committed_file_name = instance.file.name
+
+
+@receiver(post_delete, sender=Lecture)
+@receiver(post_delete, sender=HomeworkInstance)
+def release_deleted_file(sender, instance, **kwargs):
+    if instance.file:
+        instance.file.storage.delete(instance.file.name)
+
+
+@receiver(post_save, sender=HomeworkInstanceComment)
+def publish_new_comment(sender, instance, created, **kwargs):
+    if not created:
+        return
+    channel = homework_instance_channel(instance.homework_instance_id)
+    message = HomeworkInstanceCommentSerializer(instance).data
+    transaction.on_commit(lambda: get_broker().publish(channel, message))
+
+
+# Notifications are enqueued in the saving transaction and sent by the jobs workers.
+
+@receiver(post_save, sender=Lecture)
+def enqueue_new_lecture_notification(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        enqueue("notify_new_lecture", {"lecture_id": instance.id}, idempotency_key=f"notify_new_lecture:{instance.id}")
+
+
+@receiver(post_save, sender=Homework)
+def enqueue_new_homework_notification(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        enqueue("notify_new_homework", {"homework_id": instance.id},
+                idempotency_key=f"notify_new_homework:{instance.id}")
+
+
+@receiver(post_init, sender=HomeworkInstanceMark)
+def remember_mark(sender, instance, **kwargs):
+    instance._committed_mark = instance.__dict__.get("mark")
+
+
+@receiver(post_save, sender=HomeworkInstanceMark)
+def enqueue_mark_notification(sender, instance, created, raw, **kwargs):
+    previous_mark, instance._committed_mark = instance._committed_mark, instance.mark
+    if not raw and (created or previous_mark != instance.mark):
+        enqueue("notify_mark", {"mark_id": instance.id}, idempotency_key=mark_notification_key(instance))
@@ -0,0 +1,165 @@
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Deduplicating storage: every distinct content is stored once as "blobs/<ab>/<sha256>".
+    Names of files are "<upload_to>/<sha256>/<original name>", so a duplicate upload is only a metadata write.
+    Blob references are counted in StoredBlob by the rows owning the files (see signals), in their transactions:
+    reference() when a row gets a file, delete() when it loses it. A blob is deleted with its last reference;
+    blobs saved for rows that were never committed are left unreferenced and purged later.
+    Files with other names (saved before this storage was used) are handled as by FileSystemStorage.
+    """
+    blobs_dir = "blobs"
+
+    def _get_digest(self, name):
+        digest = os.path.basename(os.path.dirname(name))
+        return digest if _DIGEST_RE.match(digest) else None
+
+    def _get_blob_name(self, digest):
+        return os.path.join(self.blobs_dir, digest[:2], digest)
+
+    def path(self, name):
+        digest = self._get_digest(name)
+        return super().path(self._get_blob_name(digest) if digest else name)
+
+    def get_available_name(self, name, max_length=None):
+        """
+        The final name is made of the content digest: never taken, but longer by the digest directory.
+        The original file name is truncated (keeping its extension) so that the final name fits max_length.
+        """
+        if max_length is None:
+            return name
+        dirname, filename = os.path.split(name)
+        excess = len(name) + len("/") + 64 - max_length
+        if excess > 0:
+            root, ext = os.path.splitext(filename)
+            if excess >= len(root):
+                raise SuspiciousFileOperation(f"Storage can not find an available filename for \"{name}\".")
+            filename = root[:-excess] + ext
+        return os.path.join(dirname, filename)
+
+    def _write_hashed(self, content):
+        """Writes the content to a temporary file next to the blobs while hashing it."""
+        blobs_path = super().path(self.blobs_dir)
+        os.makedirs(blobs_path, exist_ok=True)
+        hasher = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=blobs_path, suffix=".tmp", delete=False) as temporary_file:
+            for chunk in content.chunks():
+                hasher.update(chunk)
+                temporary_file.write(chunk)
+        return hasher.hexdigest(), temporary_file.name
+
+    def _hash_file(self, path):
+        hasher = hashlib.sha256()
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(64 * 1024), b""):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def _save(self, name, content):
+        from .models import StoredBlob
+
+        if hasattr(content, "temporary_file_path"):
+            source_path, is_own_temporary_file = content.temporary_file_path(), False
+            digest = self._hash_file(source_path)
+        else:
+            digest, source_path = self._write_hashed(content)
+            is_own_temporary_file = True
+
+        blob_path = super().path(self._get_blob_name(digest))
+        with transaction.atomic():
+            StoredBlob.objects.select_for_update().get_or_create(
+                digest=digest, defaults={"size": os.path.getsize(source_path)}
+            )
+            if not os.path.exists(blob_path):
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                file_move_safe(source_path, blob_path, allow_overwrite=True)
+                self._set_permissions(blob_path)
+            elif is_own_temporary_file:
+                os.remove(source_path)
+            os.utime(blob_path)  # recently saved: not purged while its row may still be uncommitted
+
+        dirname, filename = os.path.split(name)
+        return "/".join(part for part in (dirname, digest, filename) if part)
+
+    def _set_permissions(self, path):
+        if self.file_permissions_mode is not None:
+            os.chmod(path, self.file_permissions_mode)
+
+    def reference(self, name):
+        """Counts a new reference to the file's blob."""
+        from .models import StoredBlob
+
+        digest = self._get_digest(name)
+        if digest:
+            StoredBlob.objects.filter(digest=digest).update(refcount=F("refcount") + 1)
+
+    def delete(self, name):
+        """Releases a reference to the file's blob."""
+        from .models import StoredBlob
+
+        digest = self._get_digest(name)
+        if not digest:
+            return super().delete(name)
+
+        with transaction.atomic():
+            blob = StoredBlob.objects.select_for_update().filter(digest=digest).first()
+            if blob is None:
+                return
+            if blob.refcount > 1:
+                StoredBlob.objects.filter(digest=digest).update(refcount=F("refcount") - 1)
+            else:
+                blob.delete()
+                transaction.on_commit(lambda: self._delete_unreferenced_blob(digest))
+
+    def _delete_unreferenced_blob(self, digest):
+        from .models import StoredBlob
+
+        if not StoredBlob.objects.filter(digest=digest).exists():
+            super().delete(self._get_blob_name(digest))
+
+    def purge_unreferenced(self, older_than):
+        """
+        Deletes blobs without references saved more than older_than (timedelta) ago, and blob files
+        without a StoredBlob row (theirs was rolled back) or left temporary files as old.
+        """
+        from .models import StoredBlob
+
+        with transaction.atomic():
+            digests = list(
+                StoredBlob.objects.select_for_update()
+                .filter(refcount=0, created_on__lt=timezone.now() - older_than).values_list("digest", flat=True)
+            )
+            StoredBlob.objects.filter(digest__in=digests, refcount=0).delete()
+            transaction.on_commit(lambda: [self._delete_unreferenced_blob(digest) for digest in digests])
+
+        modified_before = time.time() - older_than.total_seconds()
+        old_files = {}  # name: path
+        for directory, _, filenames in os.walk(super().path(self.blobs_dir)):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                if os.path.getmtime(path) < modified_before:
+                    old_files[filename] = path
+        names, known_digests = list(old_files), set()
+        for i in range(0, len(names), 500):
+            known_digests.update(
+                StoredBlob.objects.filter(digest__in=names[i:i + 500]).values_list("digest", flat=True)
+            )
+        for name, path in old_files.items():
+            if name not in known_digests:
+                os.remove(path)
+        return len(digests) + len(old_files) - len(known_digests)
@@ -1,3 +1,1570 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.hashers import make_password
+from django.core import mail
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.db.models import F
+from django.db.models.signals import m2m_changed
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APITestCase
+
+from .access import courses_ids, verify_access_index, visible_comments, visible_homework_instances, visible_marks
+from .authentication import (
+    ACCESS, REFRESH, _hashing_executor, decode_token, issue_tokens, purge_revoked_tokens, revoke_token,
+)
+from .async_api import AsyncReadAPI
+from .broker import get_broker, homework_instance_channel
+from .caching import get_response_cache
+from .checks import check_primary_pin_cache
+from .dashboard import build_dashboard
+from .downloads import _parse_range
+from .jobs import _jobs, claim_jobs, enqueue, job, mark_notification_key, run_job
+from .serializers import CourseSerializer
+from .uploads import write_chunk
+from .metrics import QueryRecorder
+from .pooling import ConnectionPool, PooledDatabaseWrapperMixin, PoolTimeout, discard_all
+from .search import create_sqlite_triggers
+from .replicas import PIN_COOKIE, ReplicaHealth, ReplicaPinMiddleware, ReplicaRouter
+from .models import (
+    User, Course, CourseAccess, Lecture, Homework, HomeworkInstance, HomeworkInstanceComment, HomeworkInstanceMark, Job,
+    Group, RevokedToken, StoredBlob, UploadSession,
+)
+from .roles import STUDENTS, TEACHERS, _get_roles_cache, get_user_roles
+
+# Blobs are deleted on commit, which never comes in TestCase: files go to a directory removed after the tests.
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def tearDownModule():
+    shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+
+def create_user(email, group):
+    """User of the group ("teachers", "students"), with "password" as password."""
+    return User.objects.create_user(email, "password", first_name=group[:-1].title(), last_name="Test", group=group)
+
+
+def create_lecture(test, course, title="Lecture", filename="lecture.txt", content=b"lecture"):
+    """Lecture with a file, deleted (and its file released) after the test."""
+    lecture = Lecture(course=course, title=title)
+    lecture.file.save(filename, ContentFile(content), save=False)
+    lecture.save()
+    test.addCleanup(lecture.delete)
+    return lecture
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class CourseQueriesTest(APITestCase):
+    def setUp(self):
+        self.teacher = create_user("teacher@test.com", "teachers")
+        self.students = [create_user(f"student{i}@test.com", "students") for i in range(5)]
+        get_response_cache().clear()
+
+    def _authenticate(self):
+        # A fresh user object per request, as the token authentication does.
+        self.client.force_authenticate(User.objects.get(pk=self.teacher.pk))
+
+    def _create_courses(self, count):
+        for i in range(count):
+            course = Course.objects.create(title=f"Course number {Course.objects.count()}")
+            course.teachers.set([self.teacher])
+            course.students.set(self.students)
+
+    def test_course_list_queries_do_not_depend_on_courses_count(self):
+        # roles, version (ETag), user's courses for the response cache key, courses, teachers, students
+        self._create_courses(1)
+        self._authenticate()
+        with self.assertNumQueries(6):
+            response = self.client.get("/api/course/")
+        self.assertEqual(response.status_code, 200)
+
+        self._create_courses(10)
+        self._authenticate()
+        with self.assertNumQueries(6):
+            response = self.client.get("/api/course/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 11)
+        self.assertEqual(len(response.data["results"][0]["course_students"]), 5)
+
+    def test_course_sparse_fields_skip_members_queries(self):
+        # roles, version (ETag), user's courses for the response cache key, courses
+        self._create_courses(3)
+        self._authenticate()
+        with self.assertNumQueries(4):
+            response = self.client.get("/api/course/?fields=id,title")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data["results"][0]), {"id", "title"})
+
+    def test_expanded_foreign_keys_are_joined(self):
+        self._create_courses(1)
+        course = Course.objects.get()
+        lecture = create_lecture(self, course)
+        self._authenticate()
+        with self.assertNumQueries(4):
+            response = self.client.get("/api/lecture/?expand=course&fields=id,course")
+        self.assertEqual(
+            response.data["results"], [{"id": lecture.id, "course": {"id": course.id, "title": course.title}}]
+        )
+
+    def test_course_retrieve_queries(self):
+        self._create_courses(1)
+        course = Course.objects.get()
+        self._authenticate()
+        with self.assertNumQueries(6):
+            response = self.client.get(f"/api/course/{course.id}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["course_teachers"], [self.teacher.email])
+
+
+class CourseMembersTest(APITestCase):
+    def setUp(self):
+        self.teacher = create_user("teacher@test.com", "teachers")
+        self.students = [create_user(f"student{i}@test.com", "students") for i in range(3)]
+        self.course = Course.objects.create(title="Course")
+        self.course.teachers.set([self.teacher])
+        self.course.students.set(self.students[:1])
+        self.client.force_authenticate(self.teacher)
+
+        self.signals = []
+
+        def record_signal(sender, action, pk_set, **kwargs):
+            self.signals.append((action, pk_set))
+
+        m2m_changed.connect(record_signal, sender=Course.students.through)
+        self.addCleanup(m2m_changed.disconnect, record_signal, sender=Course.students.through)
+
+    def _members(self, data, format="json"):
+        return self.client.post(f"/api/course/{self.course.id}/members/", data, format=format)
+
+    def _students_ids(self):
+        return set(self.course.students.values_list("id", flat=True))
+
+    def test_lists_apply_the_difference(self):
+        first, second, third = self.students
+        response = self._members({
+            "role": "students", "add": [first.email, second.email], "remove": [third.email],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {"role": "students", "added": 1, "removed": 0})
+        self.assertEqual(self._students_ids(), {first.id, second.id})
+        self.assertEqual(self.signals, [("pre_add", {second.id}), ("post_add", {second.id})])
+
+        self.signals.clear()
+        response = self._members({"role": "students", "remove": [first.email, second.email]})
+        self.assertEqual(response.data, {"role": "students", "added": 0, "removed": 2})
+        self.assertEqual(self._students_ids(), set())
+        self.assertEqual(self.signals, [("pre_remove", {first.id, second.id}), ("post_remove", {first.id, second.id})])
+        self.assertEqual(verify_access_index(), {})
+
+    def test_csv_upload(self):
+        first, second, third = self.students
+        file = SimpleUploadedFile(
+            "members.csv", f"{first.email},remove\n\n{second.email}\n{third.email}, ADD\n".encode()
+        )
+        response = self._members({"role": "students", "file": file}, format="multipart")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {"role": "students", "added": 2, "removed": 1})
+        self.assertEqual(self._students_ids(), {second.id, third.id})
+
+        file = SimpleUploadedFile("members.csv", f"{first.email},enroll\n".encode())
+        response = self._members({"role": "students", "file": file}, format="multipart")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["file"], [f"Unknown action enroll for {first.email}."])
+
+    def test_unknown_and_conflicting_emails_are_rejected(self):
+        response = self._members({
+            "role": "students", "add": ["unknown@test.com", self.teacher.email, self.students[1].email],
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {
+            "unknown_emails": ["unknown@test.com"], "wrong_role_emails": [self.teacher.email],
+        })
+
+        response = self._members({
+            "role": "students", "add": [self.students[1].email], "remove": [self.students[1].email],
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self._students_ids(), {self.students[0].id})
+        self.assertEqual(self.signals, [])
+
+    def test_course_emails_are_resolved_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post("/api/course/", {
+                "title": "Other course", "students_emails": [student.email for student in self.students],
+            }, format="json")
+        self.assertEqual(response.status_code, 201)
+        # The resolved ids are set: users are not selected again by id.
+        sqls = [query["sql"] for query in queries]
+        self.assertEqual(len([sql for sql in sqls if '"elearn_app_user"."email" IN' in sql]), 1)
+        self.assertEqual([sql for sql in sqls if '"elearn_app_user"."id" IN' in sql], [])
+        course = Course.objects.get(title="Other course")
+        self.assertEqual(set(course.students.all()), set(self.students))
+        self.assertEqual(list(course.teachers.all()), [self.teacher])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class PaginationTest(APITestCase):
+    def setUp(self):
+        self.teacher = create_user("teacher@test.com", "teachers")
+        self.student = create_user("student@test.com", "students")
+        self.course = Course.objects.create(title="Course")
+        self.course.teachers.set([self.teacher])
+        self.course.students.set([self.student])
+        lecture = create_lecture(self, self.course)
+        self.homeworks = [Homework.objects.create(lecture=lecture, title=f"Homework {i}", text="Text") for i in range(4)]
+        self.homework_instance = HomeworkInstance.objects.create(homework=self.homeworks[0], student=self.student)
+        get_response_cache().clear()
+        self.client.force_authenticate(self.teacher)
+
+    def _walk(self, url, on_first_page=None):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [result["id"] for result in response.data["results"]]
+            url = response.data["next"]
+            if on_first_page is not None:
+                on_first_page()
+                on_first_page = None
+        return ids
+
+    def _comment(self):
+        return HomeworkInstanceComment.objects.create(
+            homework_instance=self.homework_instance, author=self.student, body="Comment"
+        ).id
+
+    def test_pages_are_stable_under_inserts(self):
+        courses_ids = [self.course.id] + [Course.objects.create(title=f"Course {i}").id for i in range(4)]
+        for course_id in courses_ids[1:]:
+            Course.objects.get(id=course_id).teachers.add(self.teacher)
+        new_courses_ids = []
+
+        def insert_course():
+            course = Course.objects.create(title="New course")
+            course.teachers.add(self.teacher)
+            new_courses_ids.append(course.id)
+
+        self.assertEqual(self._walk("/api/course/?page_size=2", insert_course), courses_ids + new_courses_ids)
+
+        comments_ids = [self._comment() for _ in range(5)]
+        new_comments_ids = []
+        ids = self._walk("/api/homework_instance_comment/?page_size=2", lambda: new_comments_ids.append(self._comment()))
+        self.assertEqual(ids, comments_ids + new_comments_ids)
+
+    def test_created_on_ties_are_ordered_by_id(self):
+        comments_ids = [self._comment() for _ in range(5)]
+        HomeworkInstanceComment.objects.update(created_on=timezone.now())
+        self.assertEqual(self._walk("/api/homework_instance_comment/?page_size=2"), comments_ids)
+
+    @override_settings(PAGINATION_MAX_PAGE_SIZE=2, PAGINATION_MAX_PAGE_SIZES={"homework-instance": 3})
+    def test_max_page_size_by_basename(self):
+        for homework in self.homeworks[1:]:
+            HomeworkInstance.objects.create(homework=homework, student=self.student)
+        response = self.client.get("/api/homework/?page_size=10")
+        self.assertEqual(len(response.data["results"]), 2)
+        response = self.client.get("/api/homework_instance/?page_size=10")
+        self.assertEqual(len(response.data["results"]), 3)
+        response = self.client.get("/api/homework_instance/?page_size=1")
+        self.assertEqual(len(response.data["results"]), 1)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class GradebookTest(APITestCase):
+    def setUp(self):
+        self.teacher = create_user("teacher@test.com", "teachers")
+        self.students = [create_user(f"student{i}@test.com", "students") for i in range(3)]
+        self.course = Course.objects.create(title="Course")
+        self.course.teachers.set([self.teacher])
+        self.course.students.set(self.students)
+        self.lecture = create_lecture(self, self.course)
+        self.homeworks = [
+            Homework.objects.create(lecture=self.lecture, title=f"Homework {i}", text="Text") for i in range(2)
+        ]
+        first, second, _ = self.students
+        done = HomeworkInstance.objects.create(homework=self.homeworks[0], student=first, is_done=True)
+        HomeworkInstanceMark.objects.create(homework_instance=done, mark=80)
+        for _ in range(2):
+            HomeworkInstanceComment.objects.create(homework_instance=done, author=first, body="Comment")
+        HomeworkInstanceMark.objects.create(
+            homework_instance=HomeworkInstance.objects.create(homework=self.homeworks[0], student=second), mark=50
+        )
+        HomeworkInstance.objects.create(homework=self.homeworks[1], student=first)
+        self.url = f"/api/course/{self.course.id}/gradebook/"
+        self.client.force_authenticate(self.teacher)
+
+    def test_matrices_and_stats(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["students"]["id"], [student.id for student in self.students])
+        self.assertEqual(response.data["homeworks"]["id"], [homework.id for homework in self.homeworks])
+        self.assertEqual(response.data["marks"], [[80, None], [50, None], [None, None]])
+        self.assertEqual(response.data["is_done"], [[True, False], [False, False], [False, False]])
+        self.assertEqual(response.data["comments"], [[2, 0], [0, 0], [0, 0]])
+        # The second homework has no marks.
+        self.assertEqual(response.data["homeworks"]["mean"], [65, None])
+        self.assertEqual(response.data["homeworks"]["median"], [65, None])
+        self.assertEqual(response.data["homeworks"]["submission_rate"], [1 / 3, 0])
+
+    def test_students_and_other_teachers_are_forbidden(self):
+        other_teacher = create_user("other@test.com", "teachers")
+        for user in (self.students[0], other_teacher):
+            with self.subTest(user=user.email):
+                self.client.force_authenticate(user)
+                self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_queries_do_not_depend_on_the_course_size(self):
+        # roles, course, its visibility, students, homeworks, cells
+        with self.assertNumQueries(6):
+            self.client.get(self.url)
+        student = create_user("student@test.com", "students")
+        self.course.students.add(student)
+        homework = Homework.objects.create(lecture=self.lecture, title="Homework", text="Text")
+        HomeworkInstance.objects.create(homework=homework, student=student, is_done=True)
+        self.client.force_authenticate(User.objects.get(id=self.teacher.id))
+        with self.assertNumQueries(6):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data["marks"]), 4)
+
+
+@override_settings(ROLES_CACHE_TIMEOUT=60)
+class RolesCacheTest(APITestCase):
+    def setUp(self):
+        _get_roles_cache().clear()
+        self.user = create_user("user@test.com", "students")
+
+    def _get_roles(self):
+        return get_user_roles(User.objects.get(id=self.user.id))  # a new user object per request
+
+    def test_cached_roles_need_no_queries(self):
+        self.assertEqual(self._get_roles(), {STUDENTS})
+        user = User.objects.get(id=self.user.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user_roles(user), {STUDENTS})
+
+    def test_groups_changes_invalidate_cached_roles(self):
+        teachers, students = Group.objects.get(name=TEACHERS), Group.objects.get(name=STUDENTS)
+        self.assertEqual(self._get_roles(), {STUDENTS})
+        self.user.groups.set([teachers])
+        self.assertEqual(self._get_roles(), {TEACHERS})
+
+        students.user_set.add(self.user)  # reversed
+        self.assertEqual(self._get_roles(), {TEACHERS, STUDENTS})
+        teachers.user_set.clear()
+        self.assertEqual(self._get_roles(), {STUDENTS})
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class CourseAccessTest(APITestCase):
+    def setUp(self):
+        self.teacher = create_user("teacher@test.com", "teachers")
+        self.student = create_user("student@test.com", "students")
+        self.courses = [Course.objects.create(title=f"Course {i}") for i in range(2)]
+
+    def _access(self):
+        return set(CourseAccess.objects.values_list("user_id", "role", "course_id"))
+
+    def test_members_changes_are_indexed(self):
+        course, other_course = self.courses
+        course.teachers.add(self.teacher)
+        course.students.add(self.student)
+        self.student.course_students.add(other_course)  # reversed
+        self.assertEqual(self._access(), {
+            (self.teacher.id, "teachers", course.id),
+            (self.student.id, "students", course.id),
+            (self.student.id, "students", other_course.id),
+        })
+        self.assertEqual(
+            {row["course_id"] for row in courses_ids(self.student, "students")}, {course.id, other_course.id}
+        )
+
+        course.students.remove(self.student)
+        self.assertEqual(self._access(), {
+            (self.teacher.id, "teachers", course.id), (self.student.id, "students", other_course.id),
+        })
+        self.student.course_students.clear()
+        course.teachers.clear()
+        self.assertEqual(self._access(), set())
+        self.assertEqual(verify_access_index(), {})
+
+    def test_course_moves_are_propagated(self):
+        course, other_course = self.courses
+        lecture = create_lecture(self, course)
+        other_lecture = Lecture(course=course, title="Other lecture", file=lecture.file.name)
+        other_lecture.save()
+        self.addCleanup(other_lecture.delete)
+        homework = Homework.objects.create(lecture=lecture, title="Homework", text="Text")
+        instance = HomeworkInstance.objects.create(homework=homework, student=self.student)
+
+        lecture.course = other_course
+        lecture.save()
+        self.assertEqual(Homework.objects.get(id=homework.id).course_id, other_course.id)
+        self.assertEqual(HomeworkInstance.objects.get(id=instance.id).course_id, other_course.id)
+
+        homework = Homework.objects.get(id=homework.id)
+        homework.lecture = other_lecture
+        homework.save()
+        self.assertEqual(HomeworkInstance.objects.get(id=instance.id).course_id, course.id)
+        self.assertEqual(verify_access_index(), {})
+
+    def test_rebuild_fixes_the_index(self):
+        self.courses[0].students.add(self.student)
+        lecture = create_lecture(self, self.courses[0])
+        homework = Homework.objects.create(lecture=lecture, title="Homework", text="Text")
+        HomeworkInstance.objects.create(homework=homework, student=self.student)
+
+        CourseAccess.objects.all().delete()
+        CourseAccess.objects.create(user=self.teacher, role="teachers", course=self.courses[1])
+        Homework.objects.update(course=self.courses[1])
+        HomeworkInstance.objects.update(course=self.courses[1])
+        message = "extra teachers: 1, missing students: 1, homeworks with wrong course: 1"
+        with self.assertRaisesMessage(CommandError, message):
+            call_command("course_access_index", "--verify", stdout=io.StringIO())
+
+        call_command("course_access_index", stdout=io.StringIO())
+        self.assertEqual(self._access(), {(self.student.id, "students", self.courses[0].id)})
+        self.assertEqual(verify_access_index(), {})
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, COMMENTS_BROKER="elearn_app.broker.InProcessBroker")
+class CommentsFeedTest(APITestCase):
+    def setUp(self):
+        self.teacher = create_user("teacher@test.com", "teachers")
+        self.student = create_user("student@test.com", "students")
+        course = Course.objects.create(title="Course")
+        course.teachers.set([self.teacher])
+        course.students.set([self.student])
+        lecture = create_lecture(self, course)
+        homework = Homework.objects.create(lecture=lecture, title="Homework", text="Text")
+        self.homework_instance = HomeworkInstance.objects.create(homework=homework, student=self.student)
+
+    def _comment(self, body):
+        return HomeworkInstanceComment.objects.create(
+            homework_instance=self.homework_instance, author=self.student, body=body
+        )
+
+    def test_since_returns_only_newer_comments(self):
+        first, second = self._comment("first"), self._comment("second")
+        self.client.force_authenticate(self.teacher)
+        response = self.client.get(
+            f"/api/homework_instance_comment/?homework_instance={self.homework_instance.id}&since={first.id}"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([comment["id"] for comment in response.data["results"]], [second.id])
+
+        response = self.client.get("/api/homework_instance_comment/?since=last")
+        self.assertEqual(response.status_code, 400)
+
+    def test_new_comment_is_published_after_commit(self):
+        broker, channel = get_broker(), homework_instance_channel(self.homework_instance.id)
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        queue = asyncio.Queue()  # bound to the loop on first use
+        broker.subscribe(channel, loop, queue)
+        self.addCleanup(broker.unsubscribe, channel, loop, queue)
+
+        with mock.patch("elearn_app.signals.transaction.on_commit", lambda callback: callback()):
+            comment = self._comment("published")
+        message = loop.run_until_complete(asyncio.wait_for(queue.get(), timeout=1))
+        self.assertEqual(message["id"], comment.id)
+        self.assertEqual(message["body"], "published")
+
+
+# Committed data: the async API reads the database from its threads.
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, COMMENTS_BROKER="elearn_app.broker.InProcessBroker")
+class CommentsStreamTest(TransactionTestCase):
+    serialized_rollback = True  # groups of the data migration
+
+    def setUp(self):
+        self.student = create_user("student@test.com", "students")
+        self.other_student = create_user("other@test.com", "students")
+        course = Course.objects.create(title="Course")
+        course.students.set([self.student, self.other_student])
+        lecture = create_lecture(self, course)
+        homework = Homework.objects.create(lecture=lecture, title="Homework", text="Text")
+        self.homework_instance = HomeworkInstance.objects.create(homework=homework, student=self.student)
+        self.first = self._comment("first")
+
+    def _comment(self, body):
+        return HomeworkInstanceComment.objects.create(
+            homework_instance=self.homework_instance, author=self.student, body=body
+        )
+
+    def _stream(self, user=None, query=b"", on_start=None):
+        """Runs a stream request until the "on_start" function (run in a thread) is done; returns the messages."""
+        path = f"/api/async/homework_instance/{self.homework_instance.id}/comments/stream/"
+        headers = [(b"authorization", f"Bearer {issue_tokens(user)[ACCESS]}".encode())] if user else []
+        scope = {"type": "http", "method": "GET", "path": path, "query_string": query, "headers": headers}
+        messages = []
+
+        async def run():
+            disconnect, started = asyncio.Event(), asyncio.Event()
+
+            async def receive():
+                await disconnect.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                messages.append(message)
+                if message["type"] == "http.response.start":
+                    started.set()
+
+            request = asyncio.ensure_future(AsyncReadAPI()(scope, receive, send))
+            await asyncio.wait({request, asyncio.ensure_future(started.wait())}, return_when=asyncio.FIRST_COMPLETED)
+            if on_start is not None:
+                await asyncio.get_event_loop().run_in_executor(None, on_start)
+                await asyncio.sleep(0.1)  # delivered by the broker
+            disconnect.set()
+            await asyncio.wait_for(request, timeout=5)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+        return messages
+
+    def _events(self, messages):
+        body = b"".join(message.get("body", b"") for message in messages[1:]).decode()
+        return [
+            json.loads(line[len("data: "):])["body"] for line in body.splitlines() if line.startswith("data: ")
+        ]
+
+    def test_authentication_and_access(self):
+        self.assertEqual(self._stream()[0]["status"], 401)
+        self.assertEqual(self._stream(self.other_student)[0]["status"], 404)
+
+    def test_backlog_since_cursor(self):
+        second = self._comment("second")
+        messages = self._stream(self.student)
+        self.assertEqual(messages[0]["status"], 200)
+        self.assertEqual(self._events(messages), ["first", "second"])
+        self.assertEqual(self._events(self._stream(self.student, f"since={self.first.id}".encode())), ["second"])
+        self.assertIn(f"id: {second.id}", b"".join(message.get("body", b"") for message in messages).decode())
+
+    def test_new_comments_are_pushed(self):
+        messages = self._stream(self.student, on_start=lambda: [self._comment("pushed"), close_old_connections()])
+        self.assertEqual(self._events(messages), ["first", "pushed"])
+
+    def test_reduced_messages_are_read_from_the_database(self):
+        def publish_id_only():  # as PostgresBroker does with comments too big for a notification
+            HomeworkInstanceComment.objects.bulk_create([HomeworkInstanceComment(
+                homework_instance=self.homework_instance, author=self.student, body="big"
+            )])
+            comment_id = HomeworkInstanceComment.objects.get(body="big").id
+            get_broker().publish(homework_instance_channel(self.homework_instance.id), {"id": comment_id})
+            close_old_connections()
+
+        self.assertEqual(self._events(self._stream(self.student, on_start=publish_id_only)), ["first", "big"])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, COMMENTS_BROKER="elearn_app.broker.InProcessBroker")
+class AsyncReadAPITest(TransactionTestCase):
+    serialized_rollback = True
+
+    def setUp(self):
+        self.teacher = create_user("teacher@test.com", "teachers")
+        self.student = create_user("student@test.com", "students")
+        self.outsider = create_user("outsider@test.com", "students")
+        for i in range(2):
+            course = Course.objects.create(title=f"Course {i}")
+            if i == 0:
+                course.teachers.set([self.teacher])
+                course.students.set([self.student])
+            lecture = create_lecture(self, course)
+            homework = Homework.objects.create(lecture=lecture, title="Homework", text="Text")
+            if i == 0:
+                homework_instance = HomeworkInstance.objects.create(homework=homework, student=self.student)
+                HomeworkInstanceComment.objects.create(
+                    homework_instance=homework_instance, author=self.student, body="Comment"
+                )
+        get_response_cache().clear()
+
+    def _get_async(self, path, user):
+        scope = {
+            "type": "http", "method": "GET", "path": f"/api/async/{path}", "query_string": b"",
+            "headers": [
+                (b"host", b"testserver"), (b"authorization", f"Bearer {issue_tokens(user)[ACCESS]}".encode()),
+            ],
+        }
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            messages.append(message)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(AsyncReadAPI()(scope, receive, send))
+        finally:
+            loop.close()
+        return messages[0]["status"], json.loads(messages[1]["body"])
+
+    def test_lists_are_the_rest_ones(self):
+        for user in (self.teacher, self.student, self.outsider):
+            for resource, url in (
+                ("course", "/api/course/"),
+                ("lecture", "/api/lecture/"),
+                ("homework", "/api/homework/"),
+                ("homework_instance_comment", "/api/homework_instance_comment/"),
+            ):
+                with self.subTest(user=user.email, resource=resource):
+                    response = self.client.get(url, HTTP_AUTHORIZATION=f"Bearer {issue_tokens(user)[ACCESS]}")
+                    status, data = self._get_async(f"{resource}/", user)
+                    self.assertEqual((status, response.status_code), (200, 200))
+                    self.assertEqual(data["results"], json.loads(response.content)["results"])
+        self.assertEqual(len(self._get_async("lecture/", self.student)[1]["results"]), 1)
+
+    def test_tokens_are_decoded_off_the_event_loop(self):
+        threads = []
+
+        def record_thread(*args):
+            threads.append(threading.current_thread().name)
+            return decode_token(*args)
+
+        with mock.patch("elearn_app.async_api.decode_token", record_thread):
+            self.assertEqual(self._get_async("course/", self.teacher)[0], 200)
+        self.assertTrue(threads[0].startswith("async-db"), threads)
+
+        revoke_token(decode_token(access := issue_tokens(self.teacher)[ACCESS], ACCESS))
+        with mock.patch("elearn_app.tests.issue_tokens", return_value={ACCESS: access}):
+            self.assertEqual(self._get_async("course/", self.teacher)[0], 401)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class MarksBulkTest(APITestCase):
+    def setUp(self):
+        self.teacher = create_user("teacher@test.com", "teachers")
+        students = [create_user(f"student{i}@test.com", "students") for i in range(3)]
+        course = Course.objects.create(title="Course")
+        course.teachers.set([self.teacher])
+        course.students.set(students)
+        lecture = create_lecture(self, course)
+        homework = Homework.objects.create(lecture=lecture, title="Homework", text="Text")
+        self.homework_instances = [
+            HomeworkInstance.objects.create(homework=homework, student=student) for student in students
+        ]
+        HomeworkInstanceMark.objects.create(homework_instance=self.homework_instances[0], mark=10)
+        self.client.force_authenticate(self.teacher)
+
+    def test_valid_rows_are_upserted_and_invalid_reported(self):
+        first, second, third = (homework_instance.id for homework_instance in self.homework_instances)
+        response = self.client.post("/api/homework_instance_mark/bulk/", {"marks": [
+            {"homework_instance": first, "mark": 90},
+            {"homework_instance": second, "mark": 101},
+            {"homework_instance": third, "mark": 70},
+            [third, 80],
+        ]}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data["created"], response.data["updated"]), (1, 1))
+        self.assertEqual([error["index"] for error in response.data["errors"]], [1, 3])
+        self.assertEqual(
+            dict(HomeworkInstanceMark.objects.values_list("homework_instance_id", "mark")), {first: 90, third: 70}
+        )
+
+        response = self.client.post("/api/homework_instance_mark/bulk/", {"marks": [
+            {"homework_instance": first, "mark": 90},
+            {"homework_instance": third, "mark": 75},
+        ]}, format="json")
+        self.assertEqual((response.data["created"], response.data["updated"]), (0, 1))  # first is unchanged
+
+    def test_strict_mode_writes_nothing_on_errors(self):
+        first, second, _ = (homework_instance.id for homework_instance in self.homework_instances)
+        response = self.client.post("/api/homework_instance_mark/bulk/", {"strict": True, "marks": [
+            {"homework_instance": first, "mark": 90},
+            {"homework_instance": second, "mark": -1},
+        ]}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(HomeworkInstanceMark.objects.get().mark, 10)
+
+    def test_marks_created_concurrently_are_updated(self):
+        second = self.homework_instances[1].id
+        bulk_create = HomeworkInstanceMark.objects.bulk_create
+
+        def bulk_create_after_concurrent_insert(objs, **kwargs):
+            HomeworkInstanceMark.objects.create(homework_instance_id=second, mark=5)  # by another request
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(HomeworkInstanceMark.objects, "bulk_create", bulk_create_after_concurrent_insert):
+            response = self.client.post("/api/homework_instance_mark/bulk/", {"marks": [
+                {"homework_instance": second, "mark": 50},
+            ]}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data["created"], response.data["updated"]), (0, 1))
+        self.assertEqual(HomeworkInstanceMark.objects.get(homework_instance_id=second).mark, 50)
+
+    def test_only_changed_marks_are_notified(self):
+        first, second, _ = (homework_instance.id for homework_instance in self.homework_instances)
+        self.client.post("/api/homework_instance_mark/bulk/", {"marks": [
+            {"homework_instance": first, "mark": 10},
+            {"homework_instance": second, "mark": 50},
+        ]}, format="json")
+        self.assertEqual(
+            set(Job.objects.filter(name="notify_mark").values_list("idempotency_key", flat=True)),
+            {mark_notification_key(mark) for mark in HomeworkInstanceMark.objects.all()},
+        )
+
+        homework_instance_mark = HomeworkInstanceMark.objects.get(homework_instance_id=second)
+        homework_instance_mark.save()
+        self.assertEqual(Job.objects.filter(name="notify_mark").count(), 2)
+        homework_instance_mark.mark = 60
+        homework_instance_mark.save()
+        homework_instance_mark.save()
+        self.assertEqual(Job.objects.filter(name="notify_mark").count(), 3)
+        homework_instance_mark.mark = 50  # back to a previous value
+        homework_instance_mark.save()
+        self.assertEqual(Job.objects.filter(name="notify_mark").count(), 4)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class HotQueriesPlanTest(APITestCase):
+    """Fails if a hot query of the API reads its main table with a sequential scan instead of an index."""
+
+    def setUp(self):
+        self.teacher = create_user("teacher@test.com", "teachers")
+        self.student = create_user("student@test.com", "students")
+        for i in range(3):
+            course = Course.objects.create(title=f"Course {i}")
+            course.teachers.set([self.teacher])
+            course.students.set([self.student])
+            lecture = create_lecture(self, course)
+            homework = Homework.objects.create(lecture=lecture, title="Homework", text="Text")
+            homework_instance = HomeworkInstance.objects.create(homework=homework, student=self.student, is_done=i > 0)
+            HomeworkInstanceMark.objects.create(homework_instance=homework_instance, mark=50)
+            HomeworkInstanceComment.objects.create(homework_instance=homework_instance, author=self.student, body="Hi")
+
+    def hot_queries(self):
+        homework_instance = HomeworkInstance.objects.first()
+        return [
+            ("elearn_app_homeworkinstancecomment", HomeworkInstanceComment.objects.filter(
+                homework_instance_id=homework_instance.id
+            ).order_by("created_on", "id")),
+            ("elearn_app_homeworkinstance", HomeworkInstance.objects.filter(student_id=self.student.id, is_done=False)),
+            ("elearn_app_course", Course.objects.filter(title="Course 1")),
+            ("elearn_app_course_students", Course.students.through.objects.filter(user_id=self.student.id)),
+            ("elearn_app_courseaccess", courses_ids(self.teacher, TEACHERS)),
+            ("elearn_app_homeworkinstance", visible_homework_instances(self.teacher)),
+            ("elearn_app_homeworkinstancemark", visible_marks(self.student)),
+            ("elearn_app_homeworkinstancecomment", visible_comments(self.student)),
+        ]
+
+    def _explain(self, queryset):
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SET enable_seqscan = off")
+                try:
+                    return queryset.explain()
+                finally:
+                    cursor.execute("RESET enable_seqscan")
+        return queryset.explain()
+
+    def _is_sequential_scan(self, plan, table):
+        if connection.vendor == "postgresql":
+            return f"Seq Scan on {table}" in plan
+        # SQLite: "SCAN <table>" reads the whole table (or index), "SEARCH <table> USING ..." doesn't.
+        return re.search(rf"\bSCAN (TABLE )?{table}\b", plan) is not None
+
+    def test_hot_queries_use_indexes(self):
+        if connection.vendor not in {"postgresql", "sqlite"}:
+            self.skipTest(f"No query plan checks for {connection.vendor}.")
+        for table, queryset in self.hot_queries():
+            with self.subTest(query=str(queryset.query)):
+                plan = self._explain(queryset)
+                self.assertFalse(self._is_sequential_scan(plan, table), plan)
+
+
+class StorageTest(APITestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = self.settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # Blob files are deleted on commit, run at once here.
+        on_commit_patch = mock.patch("elearn_app.storage.transaction.on_commit", lambda func: func())
+        on_commit_patch.start()
+        self.addCleanup(on_commit_patch.stop)
+        self.course = Course.objects.create(title="Course")
+
+    def _create_lecture(self, content, filename="lecture.txt"):
+        lecture = Lecture(course=self.course, title=filename)
+        lecture.file.save(filename, ContentFile(content), save=False)
+        lecture.save()
+        return lecture
+
+    def _refcounts(self):
+        return dict(StoredBlob.objects.values_list("size", "refcount"))
+
+    def test_duplicates_are_stored_once(self):
+        first, second = self._create_lecture(b"same"), self._create_lecture(b"same", "other.txt")
+        self.assertEqual(self._refcounts(), {4: 2})
+        self.assertEqual(first.file.path, second.file.path)
+        self.assertEqual(first.file.read(), b"same")
+
+    def test_long_names_fit_the_field(self):
+        filename = "a" * 250 + ".pdf"
+        lecture = Lecture(course=self.course, title="Long name")
+        lecture.file.save(filename, ContentFile(b"long"), save=False)
+        lecture.save()
+        field = Lecture._meta.get_field("file")
+        self.assertLessEqual(len(lecture.file.name), field.max_length)
+        self.assertTrue(lecture.file.name.endswith("aaa.pdf"))
+        self.assertEqual(Lecture.objects.get(id=lecture.id).file.read(), b"long")
+
+    def test_replaced_and_deleted_files_are_released(self):
+        lecture = self._create_lecture(b"first")
+        path = lecture.file.path
+        lecture.file.save("lecture.txt", ContentFile(b"second!"), save=True)
+        self.assertEqual(self._refcounts(), {7: 1})
+        self.assertFalse(os.path.exists(path))
+
+        lecture = Lecture.objects.get(id=lecture.id)
+        path = lecture.file.path
+        lecture.delete()
+        self.assertEqual(self._refcounts(), {})
+        self.assertFalse(os.path.exists(path))
+
+    def test_same_content_upload_keeps_one_reference(self):
+        lecture = self._create_lecture(b"content")
+        lecture.file.save("lecture.txt", ContentFile(b"content"), save=True)
+        self.assertEqual(self._refcounts(), {7: 1})
+        Lecture.objects.get(id=lecture.id).delete()
+        self.assertEqual(self._refcounts(), {})
+
+    def test_rolled_back_saves_are_purged(self):
+        lecture = self._create_lecture(b"kept")
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self._create_lecture(b"rolled back", "other.txt")
+            self._create_lecture(b"kept")  # same title
+        self.assertEqual(self._refcounts(), {4: 1})  # the rolled back references and blob row
+
+        lecture.file.storage.save("lecture.txt", ContentFile(b"unreferenced"))  # saved, the row never was
+        self.assertEqual(self._refcounts(), {4: 1, 12: 0})
+        self.assertEqual(lecture.file.storage.purge_unreferenced(timedelta(seconds=-1)), 2)
+        self.assertEqual(self._refcounts(), {4: 1})
+        self.assertEqual(Lecture.objects.get(id=lecture.id).file.read(), b"kept")
+
+
+class _BrokenStream(io.BytesIO):
+    """Request body of a client disconnecting after the bytes."""
+
+    def read(self, size=-1):
+        data = super().read(size)
+        if not data:
+            raise OSError("Connection reset by peer")
+        return data
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, UPLOAD_SESSIONS_DIR=os.path.join(MEDIA_ROOT, "uploads_tmp"))
+class UploadSessionTest(APITestCase):
+    def setUp(self):
+        self.student = create_user("student@test.com", "students")
+        course = Course.objects.create(title="Course")
+        course.students.set([self.student])
+        lecture = create_lecture(self, course)
+        homework = Homework.objects.create(lecture=lecture, title="Homework", text="Text")
+        self.homework_instance = HomeworkInstance.objects.create(homework=homework, student=self.student)
+        self.client.force_authenticate(self.student)
+        response = self.client.post("/api/upload/", {
+            "target": "homework_instance", "target_id": self.homework_instance.id, "filename": "done.txt", "size": 10,
+        })
+        self.assertEqual(response.status_code, 201)
+        self.session_url = f"/api/upload/{response.data['id']}/"
+
+    def _put(self, offset, data):
+        return self.client.put(f"{self.session_url}chunk/?offset={offset}", data, content_type="application/octet-stream")
+
+    def test_chunks_are_resumed_at_the_offset(self):
+        self.assertEqual(self._put(0, b"01234").data["offset"], 5)
+        response = self._put(0, b"01234")
+        self.assertEqual((response.status_code, response.data["offset"]), (409, 5))
+        self.assertEqual(self.client.get(self.session_url).data["offset"], 5)
+        self.assertEqual(self._put(5, b"56789").data["checksum"], zlib.crc32(b"0123456789"))
+
+        response = self.client.post(f"{self.session_url}finalize/", {"checksum": zlib.crc32(b"0123456789")})
+        self.assertEqual(response.status_code, 200)
+        self.homework_instance.refresh_from_db()
+        self.assertEqual(self.homework_instance.file.read(), b"0123456789")
+        self.assertEqual(self.client.get(self.session_url).status_code, 404)
+
+    def test_oversized_and_incomplete_uploads_are_rejected(self):
+        response = self._put(0, b"0123456789+")
+        self.assertEqual((response.status_code, response.data["offset"]), (400, 0))
+        self._put(0, b"01234")
+        self.assertEqual(self.client.post(f"{self.session_url}finalize/").status_code, 400)
+        self._put(5, b"56789")
+        self.assertEqual(self.client.post(f"{self.session_url}finalize/", {"checksum": 1}).status_code, 400)
+
+    def test_progress_is_kept_when_the_stream_breaks(self):
+        def write_broken_chunk(session, stream):
+            write_chunk(session, _BrokenStream(b"01234"))
+
+        with mock.patch("elearn_app.views.write_chunk", write_broken_chunk):
+            response = self._put(0, b"01234")
+        self.assertEqual((response.status_code, response.data["offset"]), (400, 5))
+        self.assertEqual(self.client.get(self.session_url).data["offset"], 5)
+
+    def test_expired_sessions_are_cleaned_up(self):
+        self._put(0, b"01234")
+        session = UploadSession.objects.get()
+        self.assertTrue(os.path.exists(session.part_path))
+        UploadSession.objects.update(expires_on=timezone.now())
+        call_command("cleanup_upload_sessions", stdout=io.StringIO())
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(session.part_path))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class SeedDataTest(APITestCase):
+    def test_seeded_data_is_consistent(self):
+        call_command(
+            "seed_data", "--teachers", "3", "--students", "10", "--courses", "4", "--teachers-per-course", "1",
+            "--students-per-course", "5", "--lectures-per-course", "2", "--homeworks-per-lecture", "2",
+            "--comments-per-instance", "1", stdout=io.StringIO(),
+        )
+        self.assertEqual(HomeworkInstance.objects.count(), 4 * 2 * 2 * 5)
+        self.assertEqual(HomeworkInstanceComment.objects.count(), HomeworkInstance.objects.count())
+        self.assertEqual(
+            HomeworkInstanceMark.objects.count(), HomeworkInstance.objects.filter(is_done=True).count()
+        )
+        self.assertEqual(verify_access_index(), {})
+        self.assertTrue(User.objects.get(email="seed.students0@example.com").check_password("password"))
+
+
+class RequestMetricsTest(APITestCase):
+    def test_requests_are_measured_by_view(self):
+        teacher = create_user("teacher@test.com", "teachers")
+        self.client.force_authenticate(teacher)
+        with override_settings(METRICS_SLOW_REQUEST_SECONDS=0), self.assertLogs("elearn_app.metrics") as logs:
+            self.client.get("/api/course/")
+        self.assertIn("CourseViewSet.list", logs.output[0])
+
+        with override_settings(METRICS_TOKEN="secret"):
+            response = self.client.get("/metrics/", HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+        metrics = response.content.decode()
+        self.assertIn('elearn_requests_total{view="CourseViewSet.list",status="200"}', metrics)
+        self.assertIn('elearn_request_queries_count{view="CourseViewSet.list"}', metrics)
+
+    def test_duplicated_queries_are_counted(self):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for email in ("first@test.com", "second@test.com"):
+                User.objects.filter(email=email).exists()
+            Course.objects.exists()
+        self.assertEqual((recorder.count, recorder.duplicates), (3, 1))
+        self.assertEqual(recorder.top_duplicates(5)[0][1], 2)
+
+    def test_metrics_need_the_token(self):
+        self.assertEqual(self.client.get("/metrics/").status_code, 404)  # disabled without a token
+        with override_settings(METRICS_TOKEN="secret"):
+            self.assertEqual(self.client.get("/metrics/").status_code, 404)
+            self.assertEqual(self.client.get("/metrics/", HTTP_AUTHORIZATION="Bearer wrong").status_code, 404)
+            self.assertEqual(self.client.get("/metrics/", HTTP_AUTHORIZATION="Bearer secret").status_code, 200)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ResponseCacheInvalidationTest(APITestCase):
+    def setUp(self):
+        self.teacher = create_user("teacher@test.com", "teachers")
+        self.student = create_user("student@test.com", "students")
+        self.course, self.other_course = Course.objects.create(title="Course"), Course.objects.create(title="Other")
+        self.course.teachers.set([self.teacher])
+        self.course.students.set([self.student])
+        self.client.force_authenticate(self.teacher)
+        get_response_cache().clear()
+        # Versions are bumped on commit, run at once here.
+        on_commit_patch = mock.patch("elearn_app.caching.transaction.on_commit", lambda func: func())
+        on_commit_patch.start()
+        self.addCleanup(on_commit_patch.stop)
+
+    def _get_students(self):
+        return self.client.get(f"/api/course/{self.course.id}/").data["course_students"]
+
+    def test_members_edits_invalidate_courses(self):
+        self.assertEqual(self._get_students(), ["student@test.com"])
+        self.student.email = "renamed@test.com"
+        self.student.save()
+        self.assertEqual(self._get_students(), ["renamed@test.com"])
+        User.objects.get(id=self.student.id).delete()
+        self.assertEqual(self._get_students(), [])
+
+    def test_moved_content_leaves_the_previous_course(self):
+        lecture = create_lecture(self, self.course)
+        self.assertEqual(len(self.client.get("/api/lecture/").data["results"]), 1)
+        lecture.course = self.other_course
+        lecture.save()
+        self.assertEqual(self.client.get("/api/lecture/").data["results"], [])
+
+
+class ConditionalGetTest(APITestCase):
+    def setUp(self):
+        self.teacher = create_user("teacher@test.com", "teachers")
+        self.student = create_user("student@test.com", "students")
+        self.course = Course.objects.create(title="Course")
+        self.course.teachers.set([self.teacher])
+        self.client.force_authenticate(self.teacher)
+        get_response_cache().clear()
+
+    def test_unchanged_list_is_not_modified(self):
+        etag = self.client.get("/api/course/")["ETag"]
+        with mock.patch.object(CourseSerializer, "to_representation") as to_representation:
+            response = self.client.get("/api/course/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        to_representation.assert_not_called()
+
+    def test_list_versions_are_made_of_the_page(self):
+        courses = [self.course] + [Course.objects.create(title=f"Course {i}") for i in range(3)]
+        for course in courses[1:]:
+            course.teachers.add(self.teacher)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/course/?page_size=2")
+        version_sql = next(query["sql"] for query in queries if '"updated_at"' in query["sql"])
+        self.assertNotIn("COUNT(", version_sql)
+        self.assertIn("LIMIT 3", version_sql)
+        etag, next_url = response["ETag"], response.data["next"]
+
+        courses[3].title = "Renamed"
+        courses[3].save()  # next page
+        self.assertEqual(self.client.get("/api/course/?page_size=2", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(next_url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        courses[1].delete()
+        self.assertEqual(self.client.get("/api/course/?page_size=2", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_members_changes_modify_courses(self):
+        # Last-Modified has seconds precision.
+        Course.objects.filter(id=self.course.id).update(updated_at=timezone.now() - timedelta(seconds=5))
+        etag = self.client.get("/api/course/")["ETag"]
+        last_modified = self.client.get(f"/api/course/{self.course.id}/")["Last-Modified"]
+
+        self.course.students.add(self.student)
+        self.assertEqual(self.client.get("/api/course/", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        response = self.client.get(f"/api/course/{self.course.id}/", HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+
+
+class ParseRangeTest(SimpleTestCase):
+    def test_ranges(self):
+        for header, expected in (
+            ("bytes=0-4", (0, 4)),
+            ("bytes=5-", (5, 9)),
+            ("bytes=5-100", (5, 9)),
+            ("bytes=-3", (7, 9)),
+            ("bytes=-100", (0, 9)),
+            ("bytes=5-3", None),  # invalid: ignored
+            ("bytes=0-1,3-4", None),  # multiple ranges: the whole file
+            ("items=0-4", None),
+            ("bytes=-", None),
+        ):
+            with self.subTest(header=header):
+                self.assertEqual(_parse_range(header, 10), expected)
+
+    def test_unsatisfiable_ranges(self):
+        for header in ("bytes=10-", "bytes=10-20", "bytes=-0"):
+            with self.subTest(header=header), self.assertRaises(ValueError):
+                _parse_range(header, 10)
+        for header in ("bytes=-5", "bytes=0-", "bytes=0-0"):
+            with self.subTest(header=header, size=0), self.assertRaises(ValueError):
+                _parse_range(header, 0)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class DownloadTest(APITestCase):
+    def setUp(self):
+        teacher = create_user("teacher@test.com", "teachers")
+        course = Course.objects.create(title="Course")
+        course.teachers.set([teacher])
+        lecture = create_lecture(self, course, "Lecture", "lecture notes é.txt", b"0123456789")
+        self.lecture = lecture
+        self.url = f"/api/lecture/{lecture.id}/download/"
+        self.client.force_authenticate(teacher)
+
+    def _content(self, response):
+        return b"".join(response.streaming_content)
+
+    def test_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=2-5")
+        self.assertEqual((response.status_code, response["Content-Range"]), (206, "bytes 2-5/10"))
+        self.assertEqual(self._content(response), b"2345")
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=5-3")
+        self.assertEqual((response.status_code, self._content(response)), (200, b"0123456789"))
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=10-")
+        self.assertEqual((response.status_code, response["Content-Range"]), (416, "bytes */10"))
+
+    def test_if_range(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response["Content-Disposition"], "attachment; filename*=utf-8''lecture_notes_%C3%A9.txt")
+        etag, last_modified = response["ETag"], response["Last-Modified"]
+        for if_range, status in ((etag, 206), (last_modified, 206), ('"stale"', 200), ("W/" + etag, 200)):
+            with self.subTest(if_range=if_range):
+                response = self.client.get(self.url, HTTP_RANGE="bytes=0-0", HTTP_IF_RANGE=if_range)
+                self.assertEqual(response.status_code, status)
+
+    def test_serialized_urls_are_downloads(self):
+        student = create_user("student@test.com", "students")
+        self.lecture.course.students.set([student])
+        homework = Homework.objects.create(lecture=self.lecture, title="Homework", text="Text")
+        homework_instance = HomeworkInstance(homework=homework, student=student)
+        homework_instance.file.save("done.txt", ContentFile(b"done"), save=True)
+        self.addCleanup(homework_instance.delete)
+
+        for url, content in (
+            (f"/api/lecture/{self.lecture.id}/", b"0123456789"),
+            (f"/api/homework_instance/{homework_instance.id}/", b"done"),
+        ):
+            with self.subTest(url=url):
+                file_url = self.client.get(url).data["file"]
+                self.assertTrue(file_url.startswith("http://testserver/api/"), file_url)
+                self.assertEqual(self._content(self.client.get(file_url)), content)
+
+    def test_empty_files_ranges_are_not_satisfiable(self):
+        self.lecture.file.save("empty.txt", ContentFile(b""), save=True)
+        response = self.client.get(self.url, HTTP_RANGE="bytes=-5")
+        self.assertEqual((response.status_code, response["Content-Range"]), (416, "bytes */0"))
+
+    @override_settings(FILES_SENDFILE_BACKEND="x-accel-redirect")
+    def test_accel_redirect_to_the_blob(self):
+        response = self.client.get(self.url)
+        self.assertRegex(response["X-Accel-Redirect"], r"^/protected-media/blobs/[0-9a-f]{2}/[0-9a-f]{64}$")
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class JobsTest(APITestCase):
+    def setUp(self):
+        self.student = create_user("student@test.com", "students")
+        self.course = Course.objects.create(title="Course")
+        self.course.students.set([self.student])
+
+    def _run_due_jobs(self):
+        return [run_job(job_id) for job_id in claim_jobs(10)]
+
+    def test_saves_enqueue_notifications(self):
+        lecture = create_lecture(self, self.course)
+        lecture.save()  # not a new lecture
+        homework = Homework.objects.create(lecture=lecture, title="Homework", text="Text")
+        homework_instance = HomeworkInstance.objects.create(homework=homework, student=self.student)
+        HomeworkInstanceMark.objects.create(homework_instance=homework_instance, mark=90)
+        self.assertEqual(
+            sorted(Job.objects.values_list("name", flat=True)), ["notify_mark", "notify_new_homework", "notify_new_lecture"]
+        )
+        self.assertEqual(mail.outbox, [])
+
+        self.assertEqual(self._run_due_jobs(), [Job.DONE] * 3)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertTrue(all(message.to == [self.student.email] for message in mail.outbox))
+
+    def test_idempotency_key(self):
+        with mock.patch.dict(_jobs):
+            job("test_job")(lambda: None)
+            first = enqueue("test_job", idempotency_key="key")
+            self.assertEqual(enqueue("test_job", idempotency_key="key").id, first.id)
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_failed_attempts_are_retried_with_backoff(self):
+        failing_job = mock.Mock(side_effect=[RuntimeError("Temporary error"), None])
+        with mock.patch.dict(_jobs):
+            job("test_job")(failing_job)
+            test_job = enqueue("test_job", {"value": 1}, max_attempts=2)
+            with self.assertLogs("elearn_app.jobs", "WARNING"):
+                self.assertEqual(self._run_due_jobs(), [Job.PENDING])
+            test_job.refresh_from_db()
+            self.assertEqual(test_job.attempts, 1)
+            self.assertIn("Temporary error", test_job.last_error)
+            self.assertGreater(test_job.run_after, timezone.now())
+            self.assertEqual(self._run_due_jobs(), [])  # backing off
+
+            Job.objects.filter(id=test_job.id).update(run_after=timezone.now())
+            self.assertEqual(self._run_due_jobs(), [Job.DONE])
+        failing_job.assert_called_with(value=1)
+        self.assertEqual(failing_job.call_count, 2)
+
+    def test_abandoned_last_attempt_fails(self):
+        with mock.patch.dict(_jobs):
+            job("test_job")(lambda: None)
+            test_job = enqueue("test_job", max_attempts=1)
+            self.assertEqual(claim_jobs(10), [test_job.id])  # the worker dies
+            Job.objects.filter(id=test_job.id).update(locked_until=timezone.now())
+            self.assertEqual(claim_jobs(10), [])
+        self.assertEqual(Job.objects.get(id=test_job.id).status, Job.FAILED)
+
+    def test_results_of_stale_attempts_are_dropped(self):
+        def claimed_again():  # the lease expired during the attempt and another worker claimed the job
+            Job.objects.filter(name="test_job").update(attempts=F("attempts") + 1)
+
+        with mock.patch.dict(_jobs):
+            job("test_job")(claimed_again)
+            test_job = enqueue("test_job")
+            self.assertEqual(self._run_due_jobs(), [None])
+        test_job.refresh_from_db()
+        self.assertEqual((test_job.status, test_job.attempts), (Job.RUNNING, 2))
+
+
+class TokensTest(APITestCase):
+    def setUp(self):
+        self.student = create_user("student@test.com", "students")
+        self.tokens = issue_tokens(self.student)
+
+    def _get_dashboard(self, access):
+        return self.client.get("/api/dashboard/", HTTP_AUTHORIZATION=f"Bearer {access}")
+
+    def test_access_token_claims(self):
+        payload = decode_token(self.tokens[ACCESS], ACCESS)
+        self.assertEqual((payload["sub"], payload["roles"]), (self.student.id, ["students"]))
+        self.assertEqual(self._get_dashboard(self.tokens[ACCESS]).status_code, 200)
+        self.assertEqual(self._get_dashboard(self.tokens[REFRESH]).status_code, 401)
+
+    def test_refresh_rotates_the_refresh_token(self):
+        response = self.client.post("/api/token/refresh/", {"refresh": self.tokens[REFRESH]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._get_dashboard(response.data[ACCESS]).status_code, 200)
+        self.assertEqual(self.client.post("/api/token/refresh/", {"refresh": self.tokens[REFRESH]}).status_code, 401)
+        self.assertEqual(
+            self.client.post("/api/token/refresh/", {"refresh": response.data[REFRESH]}).status_code, 200
+        )
+
+    def test_concurrent_rotation_succeeds_once(self):
+        payload = decode_token(self.tokens[REFRESH], REFRESH)
+        self.assertTrue(revoke_token(payload))
+        self.assertFalse(revoke_token(payload))
+
+    def test_logout_revokes_tokens(self):
+        response = self.client.post(
+            "/api/logout/", {"refresh": self.tokens[REFRESH]}, HTTP_AUTHORIZATION=f"Bearer {self.tokens[ACCESS]}"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._get_dashboard(self.tokens[ACCESS]).status_code, 401)
+        self.assertEqual(self.client.post("/api/token/refresh/", {"refresh": self.tokens[REFRESH]}).status_code, 401)
+
+    def test_access_tokens_checks_need_no_queries(self):
+        decode_token(self.tokens[ACCESS], ACCESS)  # loads the denylist if it's stale
+        with self.assertNumQueries(0):
+            self.assertEqual(decode_token(self.tokens[ACCESS], ACCESS)["sub"], self.student.id)
+
+    def test_denylist_is_reloaded(self):
+        payload = decode_token(self.tokens[ACCESS], ACCESS)
+        RevokedToken.objects.create(  # by another process
+            jti=payload["jti"], token_type=ACCESS, expires_on=timezone.now() + timedelta(minutes=5)
+        )
+        with self.settings(REVOKED_TOKENS_RELOAD_INTERVAL=60):
+            self.assertEqual(decode_token(self.tokens[ACCESS], ACCESS), payload)
+        with self.settings(REVOKED_TOKENS_RELOAD_INTERVAL=0), self.assertRaises(AuthenticationFailed):
+            decode_token(self.tokens[ACCESS], ACCESS)
+
+    def test_login_issues_tokens(self):
+        response = self.client.post("/api/login/", {"username": "student@test.com", "password": "password"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._get_dashboard(response.data[ACCESS]).status_code, 200)
+        response = self.client.post("/api/login/", {"username": "student@test.com", "password": "wrong"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post("/api/login/", {"username": "nobody@test.com", "password": "password"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_old_hashes_are_upgraded_on_login(self):
+        User.objects.filter(id=self.student.id).update(password=make_password("password", hasher="pbkdf2_sha256"))
+        with mock.patch("elearn_app.authentication._hashing_executor.submit", wraps=_hashing_executor.submit) as submit:
+            response = self.client.post("/api/login/", {"username": "student@test.com", "password": "password"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(submit.call_count, 2)  # check, then rehash
+        self.assertTrue(User.objects.get(id=self.student.id).password.startswith("argon2$argon2id$"))
+
+    @override_settings(ACCESS_TOKEN_LIFETIME=-1)
+    def test_expired_tokens_are_rejected_and_purged(self):
+        access = issue_tokens(self.student)[ACCESS]
+        response = self._get_dashboard(access)
+        self.assertEqual((response.status_code, response.data["detail"]), (401, "Token has expired."))
+
+        revoke_token({"type": ACCESS, "jti": "expired", "exp": time.time() - 1})
+        revoke_token(decode_token(self.tokens[REFRESH], REFRESH))
+        self.assertEqual(purge_revoked_tokens(), 1)
+        self.assertEqual(RevokedToken.objects.count(), 1)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class DashboardTest(APITestCase):
+    def setUp(self):
+        self.student = create_user("student@test.com", "students")
+        self.courses = [Course.objects.create(title=f"Course {i}") for i in range(3)]
+        for course in self.courses[:2]:
+            course.students.set([self.student])
+            lecture = create_lecture(self, course)
+            for i in range(2):
+                homework = Homework.objects.create(lecture=lecture, title=f"Homework {i}", text="Text")
+                if i == 0:
+                    homework_instance = HomeworkInstance.objects.create(homework=homework, student=self.student)
+                    HomeworkInstanceMark.objects.create(homework_instance=homework_instance, mark=90)
+
+    def test_nested_payload_in_fixed_queries(self):
+        with self.assertNumQueries(4):
+            dashboard = build_dashboard(self.student)
+        self.assertEqual([course["title"] for course in dashboard["courses"]], ["Course 0", "Course 1"])
+        homeworks = dashboard["courses"][0]["lectures"][0]["homeworks"]
+        self.assertEqual(homeworks[0]["instance"]["mark"], 90)
+        self.assertIsNone(homeworks[1]["instance"])
+
+    def test_only_for_students(self):
+        self.client.force_authenticate(self.student)
+        self.assertEqual(self.client.get("/api/dashboard/").status_code, 200)
+        teacher = create_user("teacher@test.com", "teachers")
+        self.client.force_authenticate(teacher)
+        self.assertEqual(self.client.get("/api/dashboard/").status_code, 403)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class SearchTest(APITestCase):
+    def setUp(self):
+        self.student = create_user("student@test.com", "students")
+        self.other_student = create_user("other@test.com", "students")
+        course = Course.objects.create(title="Course")
+        course.students.set([self.student, self.other_student])
+        lecture = create_lecture(self, course)
+        self.text_match = Homework.objects.create(lecture=lecture, title="Sorting", text="Recursive merge sort.")
+        self.title_match = Homework.objects.create(lecture=lecture, title="Recursion", text="Towers of Hanoi.")
+        other_lecture = Lecture.objects.create(course=Course.objects.create(title="Other"), title="Recursion")
+        Homework.objects.create(lecture=other_lecture, title="Recursion", text="Text")
+        homework_instance = HomeworkInstance.objects.create(homework=self.text_match, student=self.other_student)
+        HomeworkInstanceComment.objects.create(homework_instance=homework_instance, author=self.other_student,
+                                               body="Recursion depth?")
+        self.client.force_authenticate(self.student)
+
+    def _search(self, query, **params):
+        response = self.client.get("/api/search/", {"q": query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [(result["type"], result["id"]) for result in response.data["results"]]
+
+    def test_ranked_visible_results(self):
+        # Other courses' homeworks and other students' comments are not visible.
+        results = self._search("recursions", type="homework,comment")
+        self.assertEqual(results, [("homework", self.title_match.id), ("homework", self.text_match.id)])
+
+    def test_index_follows_saves(self):
+        self.title_match.text = "Fibonacci numbers."
+        self.title_match.save()
+        self.assertEqual(self._search("hanoi"), [])
+        self.assertEqual(self._search("fibonacci"), [("homework", self.title_match.id)])
+        self.title_match.delete()
+        self.assertEqual(self._search("fibonacci"), [])
+
+    def test_triggers_dropped_by_table_rebuilds_are_recreated(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER elearn_app_homework_fts_update")
+        self.title_match.text = "Fibonacci numbers."
+        self.title_match.save()
+        self.assertEqual(self._search("fibonacci"), [])
+        create_sqlite_triggers()
+        create_sqlite_triggers()  # idempotent
+        self.assertEqual(self._search("fibonacci"), [("homework", self.title_match.id)])
+        self.title_match.text = "Towers of Hanoi."
+        self.title_match.save()
+        self.assertEqual(self._search("fibonacci"), [])
+
+    def test_query_syntax_is_plain_words(self):
+        self.assertEqual(self._search("\"sorting\" -*", type="homework"), [("homework", self.text_match.id)])
+        self.assertEqual(self.client.get("/api/search/", {"q": "sorting", "type": "user"}).status_code, 400)
+
+
+class PooledDatabaseWrapperTest(SimpleTestCase):
+    class DatabaseWrapper(PooledDatabaseWrapperMixin, SQLiteDatabaseWrapper):
+        pass
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings_dict = {**connection.settings_dict, "NAME": os.path.join(directory, "db.sqlite3"), "POOL": {}}
+        self.wrapper = self.DatabaseWrapper(settings_dict, "pooled")
+        self.wrapper.ensure_connection()
+        self.addCleanup(self.wrapper._pool.close_idle)
+
+    def test_connections_are_returned_on_close(self):
+        raw_connection = self.wrapper.connection
+        self.wrapper.close()
+        self.assertIsNone(self.wrapper.connection)
+        self.assertEqual(self.wrapper._pool.get_stats()["idle"], 1)
+        self.wrapper.ensure_connection()
+        self.assertIs(self.wrapper.connection, raw_connection)
+
+    def test_connections_closed_in_atomic_blocks_are_discarded(self):
+        with mock.patch("django.db.transaction.get_connection", return_value=self.wrapper):
+            with transaction.atomic(using="pooled"):
+                self.wrapper.close()
+                self.assertTrue(self.wrapper.closed_in_transaction)
+        self.assertIsNone(self.wrapper.connection)
+        stats = self.wrapper._pool.get_stats()
+        self.assertEqual((stats["open"], stats["idle"], stats["closed"]), (0, 0, 1))
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class ReplicaRouterTest(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(ReplicaRouter, "health", ReplicaHealth())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = ReplicaRouter()
+
+    def _request(self, method="get", writes=False, user=None, **kwargs):
+        """Returns the databases of a read before and after the (optional) write of the view, and the response."""
+        databases = []
+
+        def view(request):
+            if user is not None:
+                request.user = user  # authenticated by the view, as DRF views do
+            databases.append(self.router.db_for_read(Course))
+            if writes:
+                self.router.db_for_write(Course)
+                databases.append(self.router.db_for_read(Course))
+            return HttpResponse()
+
+        response = ReplicaPinMiddleware(view)(getattr(RequestFactory(), method)("/", **kwargs))
+        return databases, response
+
+    @mock.patch.object(ReplicaHealth, "get_lag", return_value=0)
+    def test_reads_after_writes_go_to_primary(self, get_lag):
+        databases, response = self._request(writes=True)
+        self.assertEqual(databases, ["replica", "default"])
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+        databases, response = self._request(HTTP_COOKIE=f"{PIN_COOKIE}=1")
+        self.assertEqual(databases, ["default"])
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(self._request("post")[0], ["default"])
+        self.assertEqual(self.router.db_for_read(Course), "default")  # outside requests
+        get_lag.assert_called_once_with("replica")  # checked once per interval
+
+    @mock.patch.object(ReplicaHealth, "get_lag", return_value=0)
+    def test_reads_after_writes_of_the_user_go_to_primary(self, get_lag):
+        caches["default"].clear()
+        user, other_user = User(id=1, email="user@test.com"), User(id=2, email="other@test.com")
+        self.assertEqual(self._request(writes=True, user=user)[0], ["replica", "default"])
+        self.assertEqual(self._request(user=user)[0], ["default"])  # another client, without the cookie
+        self.assertEqual(self._request(user=other_user)[0], ["replica"])
+        self.assertEqual(self._request()[0], ["replica"])
+
+    def test_lagging_or_unavailable_replicas_are_not_used(self):
+        for lag in (60, None):
+            with self.subTest(lag=lag), mock.patch.object(ReplicaRouter, "health", ReplicaHealth()), \
+                    mock.patch.object(ReplicaHealth, "get_lag", return_value=lag), self.assertLogs("elearn_app.replicas"):
+                self.assertEqual(self._request()[0], ["default"])
+
+
+class PrimaryPinCacheCheckTest(SimpleTestCase):
+    def test_local_memory_pins_are_warned_with_replicas(self):
+        locmem = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        shared = {"BACKEND": "django.core.cache.backends.db.DatabaseCache", "LOCATION": "pins"}
+        for replicas, caches, warnings in (
+            ([], {"default": locmem}, []),
+            (["replica"], {"default": locmem}, ["elearn_app.W001"]),
+            (["replica"], {"default": locmem, "pins": shared}, []),
+        ):
+            with self.subTest(replicas=replicas, caches=list(caches)), self.settings(
+                DATABASE_REPLICAS=replicas, CACHES=caches, DATABASE_PRIMARY_PIN_CACHE_ALIAS=list(caches)[-1]
+            ):
+                self.assertEqual([warning.id for warning in check_primary_pin_cache(None)], warnings)
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    def _pool(self, max_size=2, max_lifetime=60, timeout=1):
+        pool = ConnectionPool(lambda: sqlite3.connect(":memory:", check_same_thread=False), max_size, max_lifetime, timeout)
+        self.addCleanup(pool.close_idle)
+        return pool
+
+    def test_connections_are_reused(self):
+        pool = self._pool()
+        connection = pool.acquire()
+        pool.release(connection)
+        self.assertIs(pool.acquire(), connection)
+        self.assertEqual(pool.get_stats()["created"], 1)
+
+    def test_broken_and_old_connections_are_replaced(self):
+        pool = self._pool()
+        connection = pool.acquire()
+        pool.release(connection)
+        connection.close()
+        self.assertIsNot(pool.acquire(), connection)
+        self.assertEqual(pool.get_stats()["failed_checks"], 1)
+
+        pool = self._pool(max_lifetime=0)
+        connection = pool.acquire()
+        pool.release(connection)
+        self.assertEqual(pool.get_stats()["open"], 0)
+
+    def test_checkouts_wait_for_a_free_connection(self):
+        pool = self._pool(max_size=1, timeout=0.01)
+        connection = pool.acquire()
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+
+        timer = threading.Timer(0.01, pool.release, [connection])
+        timer.start()
+        pool.timeout = 5
+        self.assertIs(pool.acquire(), connection)
+        timer.join()
+        stats = pool.get_stats()
+        self.assertEqual((stats["waits"], stats["timeouts"], stats["in_use"]), (2, 1, 1))
+        self.assertGreater(stats["wait_seconds"], 0)
+
+    def test_connections_are_reset_when_returned(self):
+        pool = self._pool()
+        connection = pool.acquire()
+        connection.execute("CREATE TABLE pooled (id INTEGER)")
+        connection.execute("INSERT INTO pooled VALUES (1)")
+        pool.release(connection)
+        self.assertEqual(connection.execute("SELECT COUNT(*) FROM pooled").fetchone(), (0,))
+
+        pool.reset = mock.Mock(side_effect=sqlite3.OperationalError)
+        with self.assertLogs("elearn_app.pooling"):
+            pool.release(pool.acquire())
+        self.assertEqual(pool.get_stats()["open"], 0)
+
+    def test_postgresql_sessions_are_discarded(self):
+        connection = mock.Mock(autocommit=False)
+        connection.cursor.return_value.execute.side_effect = lambda sql: self.assertTrue(connection.autocommit)
+        discard_all(connection)
+        connection.rollback.assert_called_once_with()
+        connection.cursor.return_value.execute.assert_called_once_with("DISCARD ALL")
+        self.assertFalse(connection.autocommit)
+
+    def test_thread_safety(self):
+        pool, max_in_use, errors = self._pool(max_size=3, timeout=5), [0], []
+
+        def work():
+            try:
+                for _ in range(50):
+                    connection = pool.acquire()
+                    max_in_use[0] = max(max_in_use[0], pool.get_stats()["in_use"])
+                    connection.execute("SELECT 1")
+                    pool.release(connection)
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(max_in_use[0], 3)
+        self.assertEqual(pool.get_stats()["in_use"], 0)
@@ -0,0 +1,51 @@
+import os
+import zlib
+
+from django.conf import settings
+from django.core.files import File
+
+from .models import Lecture, HomeworkInstance
+
+TARGETS_MODELS = {"lecture": Lecture, "homework_instance": HomeworkInstance}
+
+
+class _PartFile(File):
+    # FileSystemStorage moves files having temporary_file_path() instead of reading them.
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def write_chunk(session, stream):
+    """
+    Appends the stream to the session's part file at session.offset, updating the running checksum.
+    The progress is saved even if the stream breaks, so the client can resume from session.offset.
+    """
+    os.makedirs(settings.UPLOAD_SESSIONS_DIR, exist_ok=True)
+    chunk_size = settings.FILES_CHUNK_SIZE
+    mode = "r+b" if os.path.exists(session.part_path) else "wb"
+
+    with open(session.part_path, mode) as part_file:
+        part_file.seek(session.offset)
+        part_file.truncate()
+        try:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                if session.offset + len(chunk) > session.size:
+                    raise ValueError("Received more bytes than the declared size.")
+                part_file.write(chunk)
+                session.checksum = zlib.crc32(chunk, session.checksum)
+                session.offset += len(chunk)
+        finally:
+            part_file.flush()
+            session.save(update_fields=("offset", "checksum"))
+
+
+def finalize(session):
+    """Attaches the assembled file to the target object. The part file is moved to the storage."""
+    instance = TARGETS_MODELS[session.target].objects.get(id=session.target_id)
+    with _PartFile(open(session.part_path, "rb"), name=session.filename) as part_file:
+        instance.file.save(session.filename, part_file, save=True)
+    session.discard()
+    return instance
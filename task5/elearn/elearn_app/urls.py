@@ -7,8 +7,9 @@ from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
 from .views import (
-    CreateUserAPIView, LoginView, LogoutView, UserViewSet, CourseViewSet, LectureViewSet,
-    HomeworkViewSet, HomeworkInstanceViewSet, HomeworkInstanceCommentViewSet, HomeworkInstanceMarkViewSet
+    CreateUserAPIView, DashboardView, LoginView, LogoutView, TokenRefreshView, UserViewSet, CourseViewSet, LectureViewSet,
+    HomeworkViewSet, HomeworkInstanceViewSet, HomeworkInstanceCommentViewSet, HomeworkInstanceMarkViewSet,
+    UploadSessionViewSet, SearchView
 )
 
 router = DefaultRouter()
@@ -20,6 +21,7 @@ router.register('homework', HomeworkViewSet, basename='homework')
 router.register('homework_instance', HomeworkInstanceViewSet, basename="homework-instance")
 router.register("homework_instance_comment", HomeworkInstanceCommentViewSet, basename="homework-instance-comment")
 router.register("homework_instance_mark", HomeworkInstanceMarkViewSet, basename="homework-instance-mark")
+router.register("upload", UploadSessionViewSet, basename="upload")
 
 schema_view = get_schema_view(
    openapi.Info(
@@ -38,6 +40,9 @@ urlpatterns = [
     path("", include(router.urls)),
     path("register/", CreateUserAPIView.as_view(), name="register"),
     path("logout/", LogoutView.as_view(), name="logout"),
+    path("token/refresh/", TokenRefreshView.as_view(), name="token-refresh"),
+    path("dashboard/", DashboardView.as_view(), name="dashboard"),
+    path("search/", SearchView.as_view(), name="search"),
 
     url(r'^swagger(?P<format>\.json|\.yaml)$', schema_view.without_ui(cache_timeout=0), name='schema-json'),
     url(r'^swagger/$', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
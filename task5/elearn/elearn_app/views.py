@@ -1,19 +1,39 @@
+from django.conf import settings
+from django.db import transaction
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.serializers import AuthTokenSerializer
-from rest_framework.authtoken.views import ObtainAuthToken
-from rest_framework.viewsets import ViewSet, ModelViewSet
-from rest_framework.authentication import TokenAuthentication
+from rest_framework.viewsets import ViewSet, ModelViewSet, GenericViewSet
+from rest_framework import mixins
+from rest_framework.decorators import action
+from rest_framework.exceptions import AuthenticationFailed, PermissionDenied, ValidationError
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework import status
 from rest_framework.response import Response
 
-from drf_yasg.utils import swagger_auto_schema
+from drf_yasg.utils import swagger_auto_schema, no_body
 
+from .access import (
+    visible_courses, visible_lectures, visible_homeworks, visible_homework_instances, visible_comments, visible_marks
+)
+from .authentication import AUTHENTICATION_CLASSES, REFRESH, decode_token, issue_tokens, revoke_token
+from .caching import CachedResponseMixin
+from .conditional import ConditionalGetMixin
+from .dashboard import build_dashboard
+from .downloads import file_response
+from .gradebook import build_gradebook
+from .uploads import write_chunk, finalize as finalize_upload
+from .pagination import CreatedOnCursorPagination
 from .permission import IsSuperuser, IsTeacher, IsStudent
-from .models import User, Course, Lecture, Homework, HomeworkInstance, HomeworkInstanceComment, HomeworkInstanceMark
+from .search import SEARCH_TYPES, search
+from .models import User, Course, UploadSession
 from .serializers import (
-    UserSerializer, CourseSerializer, LectureSerializer, HomeworkSerializer,
-    HomeworkInstanceSerializer, HomeworkInstanceCommentSerializer, HomeworkInstanceMarkSerializer
+    UserSerializer, CourseSerializer, CourseMembersSerializer, LectureSerializer, HomeworkSerializer,
+    HomeworkInstanceSerializer, HomeworkInstanceCommentSerializer, HomeworkInstanceMarkSerializer,
+    HomeworkInstanceMarksBulkSerializer,
+    UploadSessionSerializer, TokenRefreshSerializer
 )
 
 
@@ -30,9 +50,8 @@ class CreateUserAPIView(APIView):
 
 
 class UserViewSet(ModelViewSet):
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = AUTHENTICATION_CLASSES
     serializer_class = UserSerializer
-    queryset = User.objects.all()
 
     def get_permissions(self):
         if self.action in {"create", "update", "partial_update", "destroy"}:
@@ -40,6 +59,9 @@ class UserViewSet(ModelViewSet):
         elif self.action in {"list", "retrieve"}:
             return [(IsSuperuser | IsTeacher)()]
 
+    def get_queryset(self):
+        return UserSerializer.setup_eager_loading(User.objects.all(), self.request)
+
 
 class LoginView(ViewSet):
     serializer_class = AuthTokenSerializer
@@ -47,61 +69,138 @@ class LoginView(ViewSet):
 
     @swagger_auto_schema(request_body=AuthTokenSerializer, tags=("Accounting",))
     def create(self, request):
-        return ObtainAuthToken().post(request)
+        serializer = AuthTokenSerializer(data=request.data, context={"request": request})
+        serializer.is_valid(raise_exception=True)  # passwords are hashed in the pool (HashingPoolModelBackend)
+        user = serializer.validated_data["user"]
+
+        data = issue_tokens(user)
+        if settings.LEGACY_TOKEN_AUTHENTICATION:
+            data["token"] = Token.objects.get_or_create(user=user)[0].key
+        return Response(data)
+
+
+class TokenRefreshView(APIView):
+    permission_classes = [AllowAny]
+
+    @swagger_auto_schema(request_body=TokenRefreshSerializer, tags=("Accounting",))
+    def post(self, request):
+        serializer = TokenRefreshSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        payload = decode_token(serializer.validated_data["refresh"], REFRESH)
+
+        user = User.objects.filter(id=payload["sub"], is_active=True).first()
+        if user is None:
+            raise AuthenticationFailed("User not found or inactive.")
+        if not revoke_token(payload):  # rotated by a concurrent refresh
+            raise AuthenticationFailed("Token has been revoked.")
+        return Response(issue_tokens(user))
 
 
 class LogoutView(APIView):
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = AUTHENTICATION_CLASSES
     permission_classes = [IsAuthenticated]
 
-    @swagger_auto_schema(tags=("Accounting",))
+    @swagger_auto_schema(request_body=TokenRefreshSerializer, tags=("Accounting",))
     def post(self, request, format=None):
-        request.user.auth_token.delete()
+        if isinstance(request.auth, dict):  # signed access token's payload
+            revoke_token(request.auth)
+        else:
+            request.user.auth_token.delete()
+
+        if request.data.get("refresh"):
+            revoke_token(decode_token(request.data["refresh"], REFRESH))
         return Response(status=status.HTTP_200_OK)
 
 
-class CourseViewSet(ModelViewSet):
-    authentication_classes = [TokenAuthentication]
+class DashboardView(APIView):
+    """The student's courses, lectures, homeworks and own homework instances with marks in one request."""
+    authentication_classes = AUTHENTICATION_CLASSES
+    permission_classes = [IsStudent]
+
+    @swagger_auto_schema(tags=("Dashboard",))
+    def get(self, request, format=None):
+        return Response(build_dashboard(request.user, request))
+
+
+class SearchView(APIView):
+    """
+    Ranked full-text search of visible lectures, homeworks and comments:
+    ?q=words&type=lecture,homework,comment&limit=20 (up to 100).
+    """
+    authentication_classes = AUTHENTICATION_CLASSES
+    permission_classes = [IsSuperuser | IsTeacher | IsStudent]
+
+    @swagger_auto_schema(tags=("Search",))
+    def get(self, request, format=None):
+        params = request.query_params
+        types = [search_type for search_type in params.get("type", "").split(",") if search_type] or None
+        if types and not set(types) <= SEARCH_TYPES.keys():
+            raise ValidationError({"detail": [f"\"type\" must be of {', '.join(SEARCH_TYPES)}."]})
+        try:
+            limit = int(params.get("limit", 20))
+        except ValueError:
+            raise ValidationError({"detail": ["\"limit\" must be an integer."]})
+        if not 1 <= limit <= 100:
+            raise ValidationError({"detail": ["\"limit\" must be in [1:100]."]})
+
+        return Response({"results": search(request.user, params.get("q", ""), types, limit)})
+
+
+class CourseViewSet(ConditionalGetMixin, CachedResponseMixin, ModelViewSet):
+    authentication_classes = AUTHENTICATION_CLASSES
     serializer_class = CourseSerializer
 
     def get_permissions(self):
-        if self.action in {"create", "update", "partial_update", "destroy"}:
+        if self.action in {"create", "update", "partial_update", "destroy", "members", "gradebook"}:
             return [(IsSuperuser | IsTeacher)()]
         elif self.action in {"list", "retrieve"}:
             return [(IsSuperuser | IsTeacher | IsStudent)()]
 
     def get_queryset(self):
-        user = self.request.user
-        if user.groups.filter(name="superusers").exists():
-            return Course.objects.all()
-        elif user.groups.filter(name="teachers").exists():
-            return Course.objects.filter(teachers__email=user)
-        elif user.groups.filter(name="students").exists():
-            return Course.objects.filter(students__email=user)
+        if self.action == "gradebook":
+            return Course.objects.all()  # other teachers' courses get 403, see gradebook()
+        queryset = visible_courses(self.request.user)
+        if self.action == "members":
+            return queryset
+
+        return CourseSerializer.setup_eager_loading(queryset, self.request)
+
+    @swagger_auto_schema(request_body=CourseMembersSerializer)
+    @action(detail=True, methods=["post"])
+    def members(self, request, pk=None):
+        course = self.get_object()
+        serializer = CourseMembersSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        return Response(serializer.apply(course), status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=["get"])
+    def gradebook(self, request, pk=None):
+        course = self.get_object()
+        if not visible_courses(request.user).filter(id=course.id).exists():
+            raise PermissionDenied("Only teachers of the course can see its gradebook.")
+        return Response(build_gradebook(course))
 
 
-class LectureViewSet(ModelViewSet):
-    authentication_classes = [TokenAuthentication]
+class LectureViewSet(ConditionalGetMixin, CachedResponseMixin, ModelViewSet):
+    authentication_classes = AUTHENTICATION_CLASSES
     serializer_class = LectureSerializer
 
     def get_permissions(self):
         if self.action in {"create", "update", "partial_update", " destroy"}:
             return [(IsSuperuser | IsTeacher)()]
-        elif self.action in {"list", "retrieve"}:
+        elif self.action in {"list", "retrieve", "download"}:
             return [(IsSuperuser | IsTeacher | IsStudent)()]
 
     def get_queryset(self):
-        user = self.request.user
-        if user.groups.filter(name="superusers").exists():
-            return Lecture.objects.all()
-        elif user.groups.filter(name="teachers").exists():
-            return Lecture.objects.filter(course__teachers__email=user)
-        elif user.groups.filter(name="students").exists():
-            return Lecture.objects.filter(course__students__email=user)
+        return LectureSerializer.setup_eager_loading(visible_lectures(self.request.user), self.request)
+
+    @action(detail=True, methods=["get"])
+    def download(self, request, pk=None):
+        return file_response(request, self.get_object().file)
 
 
-class HomeworkViewSet(ModelViewSet):
-    authentication_classes = [TokenAuthentication]
+class HomeworkViewSet(ConditionalGetMixin, CachedResponseMixin, ModelViewSet):
+    authentication_classes = AUTHENTICATION_CLASSES
     serializer_class = HomeworkSerializer
 
     def get_permissions(self):
@@ -111,71 +210,131 @@ class HomeworkViewSet(ModelViewSet):
             return [(IsSuperuser | IsTeacher | IsStudent)()]
 
     def get_queryset(self):
-        user = self.request.user
-        if user.groups.filter(name="superusers").exists():
-            return Homework.objects.all()
-        elif user.groups.filter(name="teachers").exists():
-            return Homework.objects.filter(lecture__course__teachers__email=user)
-        elif user.groups.filter(name="students").exists():
-            return Homework.objects.filter(lecture__course__students__email=user)
+        return HomeworkSerializer.setup_eager_loading(visible_homeworks(self.request.user), self.request)
 
 
-class HomeworkInstanceViewSet(ModelViewSet):
-    authentication_classes = [TokenAuthentication]
+class HomeworkInstanceViewSet(ConditionalGetMixin, ModelViewSet):
+    authentication_classes = AUTHENTICATION_CLASSES
     serializer_class = HomeworkInstanceSerializer
 
     def get_permissions(self):
         if self.action in {"create", "update", "partial_update"}:
             return [IsStudent()]
-        elif self.action in {"list", "retrieve"}:
+        elif self.action in {"list", "retrieve", "download"}:
             return [(IsSuperuser | IsTeacher | IsStudent)()]
         elif self.action == 'destroy':
             return [IsSuperuser()]
 
     def get_queryset(self):
-        user = self.request.user
-        if user.groups.filter(name="superusers").exists():
-            return HomeworkInstance.objects.all()
-        elif user.groups.filter(name="teachers").exists():
-            return HomeworkInstance.objects.filter(homework__lecture__course__teachers__email=user)
-        elif user.groups.filter(name="students").exists():
-            return HomeworkInstance.objects.filter(homework__lecture__course__students__email=user)
+        return HomeworkInstanceSerializer.setup_eager_loading(
+            visible_homework_instances(self.request.user), self.request
+        )
+
+    @action(detail=True, methods=["get"])
+    def download(self, request, pk=None):
+        return file_response(request, self.get_object().file)
 
 
-class HomeworkInstanceCommentViewSet(ModelViewSet):
-    authentication_classes = [TokenAuthentication]
+class HomeworkInstanceCommentViewSet(ConditionalGetMixin, ModelViewSet):
+    authentication_classes = AUTHENTICATION_CLASSES
     serializer_class = HomeworkInstanceCommentSerializer
+    pagination_class = CreatedOnCursorPagination
 
     def get_permissions(self):
         return [(IsSuperuser | IsTeacher | IsStudent)()]
 
     def get_queryset(self):
-        user = self.request.user
-        if user.groups.filter(name="superusers").exists():
-            return HomeworkInstanceComment.objects.all()
-        elif user.groups.filter(name="teachers").exists():
-            return HomeworkInstanceComment.objects.filter(
-                homework_instance__homework__lecture__course__teachers__email=user)
-        elif user.groups.filter(name="students").exists():
-            return HomeworkInstanceComment.objects.filter(homework_instance__student_id=user)
-
-
-class HomeworkInstanceMarkViewSet(ModelViewSet):
-    authentication_classes = [TokenAuthentication]
+        queryset = HomeworkInstanceCommentSerializer.setup_eager_loading(
+            visible_comments(self.request.user), self.request
+        )
+        if self.action != "list":
+            return queryset
+
+        params = self.request.query_params
+        try:
+            if "homework_instance" in params:
+                queryset = queryset.filter(homework_instance_id=int(params["homework_instance"]))
+            if "since" in params:  # id of the last received comment
+                queryset = queryset.filter(id__gt=int(params["since"]))
+        except ValueError:
+            raise ValidationError({"detail": ["\"homework_instance\" and \"since\" must be integers."]})
+        return queryset
+
+
+class HomeworkInstanceMarkViewSet(ConditionalGetMixin, ModelViewSet):
+    authentication_classes = AUTHENTICATION_CLASSES
     serializer_class = HomeworkInstanceMarkSerializer
 
     def get_permissions(self):
-        if self.action in {"create", "update", "partial_update", "destroy"}:
+        if self.action in {"create", "update", "partial_update", "destroy", "bulk"}:
             return [(IsSuperuser | IsTeacher)()]
         elif self.action in {"list", "retrieve"}:
             return [(IsSuperuser | IsTeacher | IsStudent)()]
 
     def get_queryset(self):
-        user = self.request.user
-        if user.groups.filter(name="superusers").exists():
-            return HomeworkInstanceMark.objects.all()
-        elif user.groups.filter(name="teachers").exists():
-            return HomeworkInstanceMark.objects.filter(
-                homework_instance__homework__lecture__course__teachers__email=user)
-        elif user.groups.filter(name="students").exists():
-            return HomeworkInstanceMark.objects.filter(homework_instance__student_id=user)
+        return HomeworkInstanceMarkSerializer.setup_eager_loading(visible_marks(self.request.user), self.request)
+
+    @swagger_auto_schema(request_body=HomeworkInstanceMarksBulkSerializer)
+    @action(detail=False, methods=["post"])
+    def bulk(self, request):
+        serializer = HomeworkInstanceMarksBulkSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        if serializer.rejected:
+            return Response({"errors": serializer.validated_data["errors"]}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(serializer.apply(), status=status.HTTP_200_OK)
+
+
+class UploadSessionViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.DestroyModelMixin, GenericViewSet):
+    """
+    Resumable upload: create a session, PUT chunks to "chunk" at the session's offset
+    (?offset=, the current one is returned by GET), then POST "finalize" to attach the file.
+    """
+    authentication_classes = AUTHENTICATION_CLASSES
+    permission_classes = [IsAuthenticated]
+    serializer_class = UploadSessionSerializer
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(owner=self.request.user, expires_on__gt=timezone.now())
+
+    def perform_destroy(self, instance):
+        instance.discard()
+
+    @swagger_auto_schema(request_body=no_body)
+    @action(detail=True, methods=["put"])
+    def chunk(self, request, pk=None):
+        with transaction.atomic():
+            session = get_object_or_404(self.get_queryset().select_for_update(), pk=pk)
+            if request.query_params.get("offset") != str(session.offset):
+                return Response(
+                    {"detail": [f"Wrong offset. Expected {session.offset}."], "offset": session.offset},
+                    status=status.HTTP_409_CONFLICT
+                )
+            # Errors are responses, not exceptions, so the transaction commits the progress saved by write_chunk().
+            try:
+                if request.stream is not None:
+                    write_chunk(session, request.stream)
+            except ValueError as error:
+                return Response({"detail": [str(error)], "offset": session.offset}, status=status.HTTP_400_BAD_REQUEST)
+            except OSError:  # the client disconnected, or the request body is unreadable
+                return Response(
+                    {"detail": ["Chunk upload was interrupted."], "offset": session.offset},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        return Response(self.get_serializer(session).data, status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(request_body=no_body)
+    @action(detail=True, methods=["post"])
+    def finalize(self, request, pk=None):
+        with transaction.atomic():
+            # Locked: concurrent chunks or finalizations of the session wait, then find it changed or gone.
+            session = get_object_or_404(self.get_queryset().select_for_update(), pk=pk)
+            if session.offset != session.size:
+                return Response(
+                    {"detail": [f"Upload is not complete: {session.offset} of {session.size} bytes received."]},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if "checksum" in request.data and str(request.data["checksum"]) != str(session.checksum):
+                return Response({"detail": ["Checksum mismatch."]}, status=status.HTTP_400_BAD_REQUEST)
+
+            instance = finalize_upload(session)
+        return Response({"target": session.target, "target_id": instance.id, "file": instance.file.name})